@@ -7,98 +7,80 @@ which have been identified in the Nature paper "Contextual and combinatorial str
 as a way to make it easy for the training of transformers and the application of other techniques in
 language decoding. Rubato is added in the generate_whale_dialogue_txt_with_proper_timings.py file.
 
-See construct_string function comment below for more detail on the scheme used in this script.
-"""
+See construct_strings function comment below for more detail on the scheme used in this script.
 
-import pandas as pd
-from numpy import genfromtxt
-import pickle
-import numpy as np
+All the new columns are computed for whole arrays at once (no per row python calls). By default the whole csv is
+augmented in one go. For catalogs too large to hold in memory, use --chunksize to stream the csv through in blocks
+of rows, each block being read, labelled and appended to the output before the next one is read:
 
+    python add_tempo_rubato_rhythm_ornament_to_datasets.py --chunksize 100000
+    python add_tempo_rubato_rhythm_ornament_to_datasets.py --chunksize 100000 --format parquet
 
-# Load the data
-my_data = genfromtxt('../data/sperm-whale-dialogues.csv', delimiter=',', dtype=None, encoding="utf8")
+The rhythm and ornament labels can be given as .npy files (--rhythms, --ornaments), which are memory mapped so each
+block only reads its own slice of labels. Pickled label lists (rhythms.p, ornaments.p) can't be read in part and are
+loaded whole, which is fine for labels of up to a few million codas.
 
-# durations of whale codas
-durs = my_data[1:,2].astype(float)
+With --detect-ornaments, the ornament flags come from ornament_detector.py instead of ornaments.p, and are saved
+next to the output as <destination>_ornaments.npy (uint8, one per coda). With --chunksize they are detected in a
+first pass over the csv, one recording at a time, so the catalog is never loaded whole.
 
-# names of whale conversations (conversations between whales or from one whale happening at similar time)
-file_names = my_data[1:,0]
+With --profile, the time, rows, memory and allocations of the load, augment and write stages are saved to a json
+report, see instrumentation.py.
+"""
 
-# Load extra_clicks binary (aka ornaments). 1 if ornament was added or not the coda, 0 otherwise
-extra_click = pickle.load(open('../data/ornaments.p', "rb"))
+import argparse
+import os
+import pickle
 
-# the number of clicks in the coda
-num_clicks = my_data[1:,1].astype(int)
+import numpy as np
+import pandas as pd
 
-# the starting time stamp of the coda
-TsTo = my_data[1:,-1].astype(float)
+from coda_data import DATA_DIR, DIALOGUES_CSV, RECORDING_NAME_LENGTH, categorical_values, load_dialogues
+from instrumentation import PROFILERS, Profiler, stage, timed
+from ornament_detector import ORNAMENT_JSON, catalog_features, detect_ornaments, load_threshold, stream_ornaments
+from tempo_model import DEFAULT_BOUNDARIES, assign_tempos, load_boundaries
 
-# the rhythm category stamp of the coda (0-17)
-rhythms = pickle.load(open("../data/rhythms.p","rb"))
 
+AUGMENTED_CSV = os.path.join(DATA_DIR, 'sperm-whale-dialogues_augmented.csv')
+ORNAMENTS_PICKLE = os.path.join(DATA_DIR, 'ornaments.p')
+RHYTHMS_PICKLE = os.path.join(DATA_DIR, 'rhythms.p')
 
-# Define the return_tempo function, gets the tempo category of the coda based on coda duration.
+# Upper edges (seconds) of the coda duration of tempo categories 0 to 3. Anything longer is tempo 4.
 # Tempo is just a measure of how long it took for a coda to be vocalized.
-def return_tempo(dur):
-    if dur < 0.45:
-        return 0
-    elif dur < 0.61:
-        return 1
-    elif dur < 0.93:
-        return 2
-    elif dur < 1.08:
-        return 3
-    else:
-        return 4
+# These are the boundaries of 2-tempo, main() uses the ones fitted by tempo_model.py instead with --tempo-boundaries.
+TEMPO_BOUNDARIES = np.array(DEFAULT_BOUNDARIES)
 
+NUM_RHYTHMS = 18
+NUM_TEMPOS = len(TEMPO_BOUNDARIES) + 1
 
-# Create the data
-data = {
-    'Whale': [my_data[i,-2].astype(int) for i in range(1, my_data.shape[0])],
-    'File': [my_data[i,0][:6] for i in range(1, my_data.shape[0])],
-    'Time': [my_data[i,-1].astype(float) for i in range(1, my_data.shape[0])],
-    'Tempo': [return_tempo(my_data[i,2].astype(float)) for i in range(1, my_data.shape[0])],
-    'Rhythm': [rhythms[i-1] for i in range(1, my_data.shape[0])],
-    'Clicks': [my_data[i,1].astype(int) for i in range(1, my_data.shape[0])],
-    'Extra Click': [extra_click[i-1] for i in range(1, my_data.shape[0])]
-}
 
+# Define the return_tempo function, gets the tempo category of the coda based on coda duration.
+def return_tempo(dur, boundaries=TEMPO_BOUNDARIES):
+    return int(assign_tempos(dur, boundaries))
 
 
-def interrupted(i):
+def return_tempos(durs, boundaries=TEMPO_BOUNDARIES):
     """
-    If coda i was interrupted by the next whale coda, return the index of the next (interrupting) coda.
-    Otherwise return -1.
+    Tempo categories of a whole array of durations, with a single digitize.
     """
-    # Start and end times of the click
-    st = TsTo[i]
-    en = TsTo[i]+durs[i]
+    return assign_tempos(durs, boundaries)
 
-    # if it's the last item, return -1. The last coda can't be interrupted by the next one.
-    if i==my_data.shape[0]-1: # only check the previous
-        return -1
-    else:
-        #the index of the next coda
-        nex = i+1
 
-        # return if next index is the last item
-        if nex>=3840:
-            return -1
+def build_word_table(num_rhythms=NUM_RHYTHMS, num_tempos=NUM_TEMPOS):
+    """
+    All the "words" a coda can be written as, indexed by [extra click, rhythm, tempo].
+    See construct_strings for the scheme.
+    """
+    letters = np.array([chr(ord('a') + r) for r in range(num_rhythms)])
+    letters = np.stack([letters, np.char.upper(letters)])
+    digits = np.array([str(t + 1) for t in range(num_tempos)])
+    return np.char.add(letters[:, :, None], digits[None, None, :])
 
-        elif TsTo[nex]<=en and TsTo[nex]>=st:
-            # if the starting timestamp of the next whale vocalization started before the end of this timestamp
-            # of the current one, and the starting timestamp of the next vocalization is also starting after this one began.
-            return nex
-        else:
-            return -1
 
+WORD_TABLE = build_word_table()
 
-# Create the DataFrame
-df = pd.DataFrame(data)
 
-# Define a function to help create the constructed string which helps us visualize the type of each coda
-def construct_string(data):
+def construct_strings(rhythms, extra_clicks, tempos):
     """
     Here's how the string is constructed:
     - There are 17 discernable rythms whales use for codas. We use the letters A-R, a different letter for each
@@ -106,7 +88,7 @@ def construct_string(data):
     - The letter representing the coda is capitalized if it's ornamented, which just means it has an extra click.
       Otherwise its lowercase.
     - If the coda is interrupting a previous coda, the relative duration of this second coda defines its rubato.
-      Most coda durations are constant (-), but sometimes the duration reduces (\) and sometimes it increases (/).
+      Most coda durations are constant (-), but sometimes the duration reduces (\\) and sometimes it increases (/).
       Non-interrupting codas do not have rubatos appended. NOTE: Rubato is only added in generate_whale_dialogue_txt_with_proper_timings.py
 
     For example, the coda rythm category 13, which is typically labelled 5R3 (just making this up as an example, that's probably wrong)
@@ -116,32 +98,220 @@ def construct_string(data):
     than the other, it would be the "/" rubato tag appended, leaving us with the "word" spelled like:
     "/h3"
     All codas are represented with between 2 and three characters depending on if they have rubato.
+
+    Every possible word is precomputed in WORD_TABLE, so building the strings is a single lookup over the arrays.
     """
-    rhythm = chr(ord('a') + data['Rhythm']).upper() if data['Extra Click'] == 1 else chr(ord('a') + data['Rhythm'])
-    return rhythm + str(data['Tempo'] + 1)
+    return WORD_TABLE[(np.asarray(extra_clicks) == 1).astype(int), rhythms, tempos]
 
-# Create new column 'ConstructedString'
-df['ConstructedString'] = df.apply(construct_string, axis=1)
 
+def interrupted(i, TsTo, durs):
+    """
+    If coda i was interrupted by the next whale coda, return the index of the next (interrupting) coda.
+    Otherwise return -1.
+    Only the next row is checked, overlaps.py finds every overlapping pair of codas at once.
+    """
+    # Start and end times of the click
+    st = TsTo[i]
+    en = TsTo[i]+durs[i]
+
+    #the index of the next coda
+    nex = i+1
+
+    # if it's the last item, return -1. The last coda can't be interrupted by the next one.
+    if nex>=len(TsTo):
+        return -1
 
+    elif TsTo[nex]<=en and TsTo[nex]>=st:
+        # if the starting timestamp of the next whale vocalization started before the end of this timestamp
+        # of the current one, and the starting timestamp of the next vocalization is also starting after this one began.
+        return nex
+    else:
+        return -1
+
+
+def load_labels(path):
+    """
+    Per coda labels (rhythms, ornaments), from a pickled list or a .npy array (memory mapped, nothing is read until
+    sliced).
+    """
+    if path.endswith('.npy'):
+        return np.load(path, mmap_mode='r')
+    return np.asarray(pickle.load(open(path, "rb")))
 
-# Combine and export the data
 
-transposed_array = np.array(my_data[1:]).T
-column_names = my_data[0]
-original_columns = {}
-for i in range(len(column_names)):
-    column_name = column_names[i]
-    original_columns[column_name] = transposed_array[i]
+def augment_columns(whale_id, file_names, TsTo, durs, rhythms, num_clicks, extra_click, index=None,
+                    boundaries=TEMPO_BOUNDARIES):
+    """
+    The new categorization columns for a block of codas, as a DataFrame (with the row index of the block).
+    """
+    tempos = return_tempos(durs, boundaries)
+    return pd.DataFrame({
+        'Whale': whale_id,
+        'File': file_names,
+        'Time': TsTo,
+        'Tempo': tempos,
+        'Rhythm': rhythms,
+        'Clicks': num_clicks,
+        'Extra Click': extra_click,
+        'ConstructedString': construct_strings(rhythms, extra_click, tempos),
+    }, index=index)
+
+
+def iter_chunks(source, chunksize=None, boundaries=TEMPO_BOUNDARIES, ornaments_path=ORNAMENTS_PICKLE,
+                rhythms_path=RHYTHMS_PICKLE):
+    """
+    Yields (original_columns_df, new_columns_df) blocks of the augmented dataset, in order.
+
+    The original columns are read as text so they are written out exactly as they appear in the source csv.
+    Without a chunksize the typed columns come from the cached loader (coda_data.py) and there is a single block.
+    With a chunksize, each block is read and converted on its own, with its slice of the labels, so memory stays
+    bounded by the chunk size (and the size of pickled labels, see the module docstring).
+    """
+    # Load extra_clicks binary (aka ornaments). 1 if ornament was added or not the coda, 0 otherwise
+    extra_click = load_labels(ornaments_path)
+    # the rhythm category stamp of the coda (0-17)
+    rhythms = load_labels(rhythms_path)
+
+    if chunksize is None:
+        with stage('load', rows=len(rhythms)):
+            columns = load_dialogues(source)
+            original_columns_df = pd.read_csv(source, dtype=str, keep_default_na=False)
+        with stage('augment', rows=len(original_columns_df)):
+            new_columns_df = augment_columns(
+                columns['Whale'], categorical_values(columns, 'File'), columns['TsTo'], columns['Duration'],
+                np.asarray(rhythms), columns['nClicks'], np.asarray(extra_click), boundaries=boundaries)
+        yield original_columns_df, new_columns_df
+        return
+
+    start = 0
+    for original_columns_df in timed(pd.read_csv(source, dtype=str, keep_default_na=False, chunksize=chunksize),
+                                     'load'):
+        stop = start + len(original_columns_df)
+        with stage('augment', rows=len(original_columns_df)):
+            new_columns_df = augment_columns(
+                original_columns_df['Whale'].to_numpy(dtype=np.int64),
+                original_columns_df['REC'].str[:RECORDING_NAME_LENGTH].to_numpy(dtype=str),
+                original_columns_df['TsTo'].to_numpy(dtype=np.float64),
+                original_columns_df['Duration'].to_numpy(dtype=np.float64),
+                np.asarray(rhythms[start:stop]),
+                original_columns_df['nClicks'].to_numpy(dtype=np.int64),
+                np.asarray(extra_click[start:stop]),
+                index=original_columns_df.index,
+                boundaries=boundaries)
+        yield original_columns_df, new_columns_df
+        start = stop
+
+
+def write_csv(blocks, destination):
+    """
+    Write the augmented blocks one after the other to a csv file. Returns the first block, for display.
+    ValueError if there are no blocks (a source csv without rows, read in chunks).
+    """
+    first = None
+    for original_columns_df, new_columns_df in blocks:
+        with stage('write', rows=len(original_columns_df)):
+            df = pd.concat([original_columns_df, new_columns_df], axis=1)
+            df.to_csv(destination, index=False, mode='w' if first is None else 'a', header=first is None)
+        if first is None:
+            first = (original_columns_df.head(), df.head())
+    if first is None:
+        raise ValueError(f"No codas to write to {destination}")
+    return first
+
+
+def write_parquet(blocks, destination):
+    """
+    Write the augmented blocks as row groups of a parquet file (needs pyarrow). Returns the first block, for display.
+    ValueError if there are no blocks, as write_csv.
+
+    Here the original columns are stored typed rather than as text, and the new 'Whale' column is left out since
+    parquet column names must be unique and it is identical to the original one.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    first = None
+    writer = None
+    for original_columns_df, new_columns_df in blocks:
+        with stage('write', rows=len(original_columns_df)):
+            # fixed types, so every row group has the same schema
+            original_typed_df = original_columns_df.astype({
+                name: np.int64 if name in ['nClicks', 'Whale'] else np.float64
+                for name in original_columns_df.columns if name != 'REC'})
+            df = pd.concat([original_typed_df, new_columns_df.drop(columns=['Whale'])], axis=1)
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(destination, table.schema)
+                first = (original_columns_df.head(), df.head())
+            writer.write_table(table)
+    if writer is None:
+        raise ValueError(f"No codas to write to {destination}")
+    writer.close()
+    return first
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--source', default=DIALOGUES_CSV, help='coda csv to augment')
+    parser.add_argument('--destination', default=None,
+                        help='augmented output (default ../data/sperm-whale-dialogues_augmented.csv or .parquet)')
+    parser.add_argument('--chunksize', type=int, default=None,
+                        help='stream the csv through in blocks of this many rows instead of loading it whole')
+    parser.add_argument('--format', choices=['csv', 'parquet'], default='csv')
+    parser.add_argument('--ornaments', default=ORNAMENTS_PICKLE,
+                        help='ornament of each coda of the source (pickle or .npy)')
+    parser.add_argument('--detect-ornaments', action='store_true',
+                        help='detect the ornaments (ornament_detector.py) instead of reading --ornaments')
+    parser.add_argument('--ornament-threshold', default=ORNAMENT_JSON,
+                        help='threshold fitted by ornament_detector.py (the default one if the file is missing)')
+    parser.add_argument('--rhythms', default=RHYTHMS_PICKLE, help='rhythm of each coda of the source')
+    parser.add_argument('--tempo-boundaries', default=None,
+                        help='tempo boundaries fitted by tempo_model.py (../data/tempo_boundaries.json), '
+                             'instead of the 2-tempo ones')
+    parser.add_argument('--profile', default=None, help='save the per stage statistics to this json file')
+    parser.add_argument('--profiler', choices=PROFILERS, default='none',
+                        help='also profile the whole run with cProfile or the sampling profiler (with --profile)')
+    args = parser.parse_args()
+
+    profiler = Profiler(args.profiler).start() if args.profile is not None else None
+
+    boundaries = TEMPO_BOUNDARIES
+    if args.tempo_boundaries is not None:
+        boundaries = np.array(load_boundaries(args.tempo_boundaries))
+    assert len(boundaries) == NUM_TEMPOS - 1, f"expected {NUM_TEMPOS - 1} tempo boundaries, got {len(boundaries)}"
+
+    destination = args.destination
+    if destination is None:
+        destination = AUGMENTED_CSV if args.format == 'csv' else AUGMENTED_CSV[:-len('.csv')] + '.parquet'
+
+    ornaments_path = args.ornaments
+    if args.detect_ornaments:
+        threshold = load_threshold(args.ornament_threshold)
+        with stage('ornaments'):
+            if args.chunksize is None:
+                flags = detect_ornaments(catalog_features(load_dialogues(args.source)), threshold)
+            else:
+                flags = stream_ornaments(args.source, threshold, args.chunksize)
+        ornaments_path = os.path.splitext(destination)[0] + '_ornaments.npy'
+        np.save(ornaments_path, flags)
+        print(f"{flags.sum()} of {len(flags)} codas ornamented, flags saved to {ornaments_path}")
+
+    # Combine and export the data
+    blocks = iter_chunks(args.source, args.chunksize, boundaries, ornaments_path, args.rhythms)
+    if args.format == 'csv':
+        original_head, augmented_head = write_csv(blocks, destination)
+    else:
+        original_head, augmented_head = write_parquet(blocks, destination)
+
+    if profiler is not None:
+        profiler.stop().write(args.profile, chunksize=args.chunksize, format=args.format)
 
-# Save the DataFrame df as a csv file
-original_columns_df = pd.DataFrame(original_columns)
+    print("The original data")
+    print(original_head)
+    print()
+    print("New categorization columns added to data:")
+    print(augmented_head)
 
-df = pd.concat([original_columns_df, df], axis=1)
 
-df.to_csv('../data/sperm-whale-dialogues_augmented.csv', index=False)
-print("The original data")
-print(original_columns_df.head())
-print()
-print("New categorization columns added to data:")
-print(df.head())
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+"""
+Benchmarks of the pipeline stages on synthetic catalogs of growing size (see synthetic_catalog.py).
+
+For each scale, a synthetic catalog is written to a temporary folder and every stage is run on it in turn, recording
+its wall clock time, then run again under tracemalloc (which numpy reports its arrays to) for the peak memory it
+allocated, since tracing slows down python allocations a lot. Stages run in this process, with a single worker, so
+the numbers compare across runs and machines of the same kind:
+
+    load           parse sperm-whale-dialogues.csv into typed columns and write the cache (coda_data.py)
+    load_cached    memory map the cached columns and read them all
+    augmentation   the augmented csv, streamed in blocks of rows
+    rubato         duration deltas of every recording, streamed, and their percentiles (rubato.py)
+    dialogue       render whale_dialogues.txt
+    segmentation   conversation blocks for 5 gaps, per whale (segmentation.py)
+    overlaps       every overlapping pair of codas (overlaps.py)
+    permutation    permutation and bucket null distributions of the coda durations (resampling.py)
+    rhythm_types   mean codas of DominicaCodas.csv (rhythm_types.py)
+
+    python benchmarks.py --scales 1 10 100
+    python benchmarks.py --scales 1000 --stages load load_cached segmentation overlaps --output results.json
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from add_tempo_rubato_rhythm_ornament_to_datasets import iter_chunks, write_csv
+from click_times import load_click_matrix
+from coda_data import iter_recordings, load_dialogues, load_dominica
+from generate_whale_dialogue_txt_with_proper_timings import render_recordings
+from overlaps import overlapping_pairs
+from resampling import bucket_null, permutation_null
+from rhythm_types import rhythm_types
+from rubato import DEFAULT_THRESHOLDS, QuantileSketch, recording_deltas
+from segmentation import block_bounds
+from synthetic_catalog import write_catalog
+
+
+# Number of resamples of the permutation stage
+NUM_RESAMPLES = 1000
+
+
+def stage_load(paths):
+    with tempfile.TemporaryDirectory(dir=paths['folder']) as cache_dir:
+        load_dialogues(paths['dialogues'], cache_dir=cache_dir)
+
+
+def stage_load_cached(paths):
+    columns = load_dialogues(paths['dialogues'], cache_dir=paths['cache'])
+    for values in columns.values():
+        np.array(values)
+
+
+def stage_augmentation(paths):
+    write_csv(iter_chunks(paths['dialogues'], 100000, ornaments_path=paths['ornaments'],
+                          rhythms_path=paths['rhythms']), paths['augmented'])
+
+
+def stage_rubato(paths):
+    sketch = QuantileSketch()
+    for recording in iter_recordings(paths['augmented']):
+        sketch.update(recording_deltas(recording))
+    sketch.thresholds()
+
+
+def stage_dialogue(paths):
+    with open(os.path.join(paths['folder'], 'whale_dialogues.txt'), 'w') as f:
+        for text in render_recordings(iter_recordings(paths['augmented']), DEFAULT_THRESHOLDS):
+            f.write(text)
+
+
+def stage_segmentation(paths):
+    columns = load_dialogues(paths['dialogues'], cache_dir=paths['cache'])
+    block_bounds(columns['File'], columns['TsTo'], [2, 4, 8, 12, 16], columns['Whale'])
+
+
+def stage_overlaps(paths):
+    columns = load_dialogues(paths['dialogues'], cache_dir=paths['cache'])
+    overlapping_pairs(columns['File'], columns['TsTo'], columns['TsTo'] + columns['Duration'])
+
+
+def stage_permutation(paths):
+    columns = load_dialogues(paths['dialogues'], cache_dir=paths['cache'])
+    durations = np.asarray(columns['Duration'])
+    n_clicks = np.asarray(columns['nClicks'])
+    permutation_null(durations[n_clicks == 5], durations[n_clicks == 4], n_resamples=NUM_RESAMPLES)
+    sample = durations[:len(durations) // 10]
+    bucket_null(sample, n_clicks[:len(sample)], durations, n_clicks, n_resamples=NUM_RESAMPLES)
+
+
+def stage_rhythm_types(paths):
+    columns = load_dominica(paths['dominica'], cache_dir=paths['cache'])
+    clicks = load_click_matrix(paths['dominica'], load_dominica, os.path.join(paths['cache'], 'click_times'))
+    rhythm_types(columns, clicks)
+
+
+STAGES = {
+    'load': stage_load,
+    'load_cached': stage_load_cached,
+    'augmentation': stage_augmentation,
+    'rubato': stage_rubato,
+    'dialogue': stage_dialogue,
+    'segmentation': stage_segmentation,
+    'overlaps': stage_overlaps,
+    'permutation': stage_permutation,
+    'rhythm_types': stage_rhythm_types,
+}
+
+
+def measure(stage, paths, memory=True):
+    """
+    Run a stage, returning (seconds, peak MB allocated while it ran, None unless memory).
+    """
+    start = time.perf_counter()
+    stage(paths)
+    seconds = time.perf_counter() - start
+    if not memory:
+        return seconds, None
+    tracemalloc.start()
+    stage(paths)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak / 2**20
+
+
+def run(scales, stages, seed=0, memory=True):
+    """
+    Benchmark the stages on a synthetic catalog of each scale. Returns one result dict per (scale, stage).
+    """
+    results = []
+    for scale in scales:
+        with tempfile.TemporaryDirectory() as folder:
+            paths = write_catalog(folder, scale, seed)
+            paths.update(folder=folder, cache=os.path.join(folder, 'cache'),
+                         augmented=os.path.join(folder, 'sperm-whale-dialogues_augmented.csv'))
+            num_codas = len(load_dialogues(paths['dialogues'], cache_dir=paths['cache'])['TsTo'])
+            # the stages after the augmentation read its output
+            if 'augmentation' not in stages and {'rubato', 'dialogue'} & set(stages):
+                stage_augmentation(paths)
+            for name in stages:
+                seconds, peak = measure(STAGES[name], paths, memory)
+                results.append({'scale': scale, 'codas': num_codas, 'stage': name, 'seconds': seconds,
+                                'peak_mb': peak})
+                peak_text = '' if peak is None else f"{peak:>10.1f} MB"
+                print(f"scale {scale:>6g} {num_codas:>9} codas  {name:<13} {seconds:>9.3f} s {peak_text}", flush=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scales', type=float, nargs='+', default=[1, 10])
+    parser.add_argument('--stages', nargs='+', choices=list(STAGES), default=list(STAGES))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-memory', action='store_true', help="don't measure the peak memory (twice faster)")
+    parser.add_argument('--output', default=None, help='also save the results to this json file')
+    args = parser.parse_args()
+
+    results = run(args.scales, args.stages, args.seed, not args.no_memory)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""
+Click times of every coda: the cumulative click times (t_k - t_1) and duration normalized positions
+(t_k - t_1) / (t_n - t_1), as zero padded matrices with one row per coda.
+
+The notebooks each have their own return_relative, which sums my_data[idx, 3:t] again for every click t, and the
+dialogue script and notebook 1 rebuild the same click times for their "book" arrays. Here they are computed once for
+the whole catalog with a cumulative sum over the ICI matrix, and cached next to the typed columns of coda_data.py
+(keyed by the hash of the source csv), as memory mapped .npy files:
+
+- 'click_times': float32 (n, max clicks) cumulative click times of the first nClicks clicks, the first one at 0
+- 'positions': float32 (n, max clicks) click times divided by the coda duration t_n - t_1 (NaN if it is zero)
+- 'click_mask': bool (n, max clicks), True for the clicks that are part of the coda
+- 'n_clicks': int32 number of clicks of each coda
+- 'duration': float32 t_n - t_1
+
+Example:
+    clicks = load_click_matrix()
+    coda = clicks['positions'][i, :clicks['n_clicks'][i]]   # return_relative(i + 1, num_clicks[i]) of 4-rubato
+"""
+
+import os
+
+import numpy as np
+
+from coda_data import CACHE_DIR, DIALOGUES_CSV, DOMINICA_CSV, load_columns, load_dialogues, load_dominica
+
+
+CLICK_CACHE_DIR = os.path.join(CACHE_DIR, 'click_times')
+
+# ICIs at or below this are annotation mistakes and are not counted as clicks (see click_times_from_icis)
+MIN_ICI = 0.0002
+
+
+def cumulative_click_times(icis, n_clicks):
+    """
+    Cumulative click times of the first n_clicks clicks of each coda (the first n_clicks - 1 ICIs), as a zero padded
+    (n, number of ICIs + 1) float64 matrix, and the mask of the clicks that are part of the coda.
+    """
+    icis = np.asarray(icis, dtype=np.float64)
+    n_clicks = np.asarray(n_clicks)
+    click_mask = np.arange(icis.shape[1] + 1)[None, :] < n_clicks[:, None]
+    click_times = np.zeros((icis.shape[0], icis.shape[1] + 1))
+    click_times[:, 1:] = np.cumsum(np.where(click_mask[:, 1:], icis, 0), axis=1)
+    click_times[~click_mask] = 0
+    return click_times, click_mask
+
+
+def relative_click_positions(icis, n_clicks):
+    """
+    Relative position of each click in its coda, (t_k - t_1) / (t_n - t_1) for the first n_clicks clicks,
+    as a zero padded (n, number of ICIs + 1) matrix. NaN rows for codas of zero duration.
+    """
+    click_times, click_mask = cumulative_click_times(icis, n_clicks)
+    return normalize(click_times, click_mask)
+
+
+def normalize(click_times, click_mask):
+    """
+    Divide the click times of each coda by its duration (its largest click time).
+    """
+    duration = click_times.max(axis=1, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        positions = click_times / duration
+    positions[~click_mask] = 0
+    return positions
+
+
+def click_times_from_icis(icis, min_ici=MIN_ICI):
+    """
+    Relative click times (t1-t1),(t2-t1),(t3-t1)... of each coda from its ICI row, following the dialogue script:
+    clicks stop at the first zero ICI, and ICIs <= min_ici add no click (their time still counts towards the next).
+    Returns the (n, max clicks) zero padded click times (column 0 is always 0) and the number of clicks per coda.
+    """
+    icis = np.asarray(icis, dtype=np.float64)
+    before_first_zero = np.cumprod(icis != 0, axis=1).astype(bool)
+    is_click = before_first_zero & (icis > min_ici)
+    cumulative = np.cumsum(icis, axis=1)
+
+    n_clicks = is_click.sum(axis=1) + 1
+    click_times = np.zeros((icis.shape[0], icis.shape[1] + 1))
+    rows, cols = np.nonzero(is_click)
+    # position of each click within its coda, counting the first click (always at 0)
+    slots = np.cumsum(is_click, axis=1)[rows, cols]
+    click_times[rows, slots] = cumulative[rows, cols]
+    return click_times, n_clicks
+
+
+def click_matrix(columns):
+    """
+    The click matrices (see the module docstring) from typed columns with 'ICI' and 'nClicks'.
+    """
+    n_clicks = np.minimum(np.asarray(columns['nClicks']), columns['ICI'].shape[1] + 1)
+    click_times, click_mask = cumulative_click_times(columns['ICI'], n_clicks)
+    return {
+        'click_times': click_times.astype(np.float32),
+        'positions': normalize(click_times, click_mask).astype(np.float32),
+        'click_mask': click_mask,
+        'n_clicks': n_clicks.astype(np.int32),
+        'duration': click_times.max(axis=1).astype(np.float32),
+    }
+
+
+def load_click_matrix(path=DIALOGUES_CSV, load=None, cache_dir=CLICK_CACHE_DIR, mmap_mode='r'):
+    """
+    The cached click matrices of the coda csv at path, computed from its typed columns on the first call.
+    load is the coda_data loader of the csv, by default load_dominica for DominicaCodas.csv and load_dialogues
+    otherwise.
+    """
+    if load is None:
+        load = load_dominica if os.path.basename(path) == os.path.basename(DOMINICA_CSV) else load_dialogues
+    return load_columns(path, lambda p: click_matrix(load(p)), cache_dir, mmap_mode)
@@ -0,0 +1,199 @@
+"""
+Typed, cached loading of the coda csv files (sperm-whale-dialogues.csv and DominicaCodas.csv).
+
+genfromtxt(..., dtype=None) returns a matrix of strings, so the scripts and notebooks end up calling
+my_data[i,j].astype(float) on every cell they touch. Here each csv is parsed once into typed columns:
+
+- 'ICI': float32 matrix of inter click intervals (one row per coda, zero padded)
+- 'nClicks', 'Whale', ...: integer columns
+- 'Duration', 'TsTo': float64 columns
+- 'REC', 'File', 'Clan', 'Unit', 'CodaType', ...: categorical columns, stored as int32 codes in <name>
+  with the distinct values in <name>_categories
+
+The columns are written as .npy files into a cache folder named after the hash of the source csv, so later loads
+just memory map those files instead of parsing text again. Editing the csv changes its hash, so a stale cache is
+never used.
+
+Example:
+    columns = load_dialogues()
+    durs = columns['Duration']
+    file_names = categorical_values(columns, 'File')
+"""
+
+import hashlib
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+CACHE_DIR = os.path.join(DATA_DIR, 'cache')
+
+DIALOGUES_CSV = os.path.join(DATA_DIR, 'sperm-whale-dialogues.csv')
+DOMINICA_CSV = os.path.join(DATA_DIR, 'DominicaCodas.csv')
+
+# Number of characters of REC naming the recording (conversation) a coda belongs to, e.g. sw061b001_124 -> sw061b
+RECORDING_NAME_LENGTH = 6
+
+
+def file_hash(path, block_size=1 << 20):
+    """
+    Hash of the file contents, used to key the cache. Read in blocks so large catalogs don't need to fit in memory.
+    """
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            h.update(block)
+    return h.hexdigest()[:16]
+
+
+def add_categorical(columns, name, values):
+    """
+    Store values as int32 codes in columns[name] and the sorted distinct values in columns[name + '_categories'].
+    """
+    categories, codes = np.unique(np.asarray(values).astype(str), return_inverse=True)
+    columns[name] = codes.astype(np.int32)
+    columns[name + '_categories'] = categories
+
+
+def categorical_values(columns, name):
+    """
+    Decode a categorical column back into its string values (one per coda).
+    """
+    return columns[name + '_categories'][columns[name]]
+
+
+def prefix_categorical(columns, name, n_chars):
+    """
+    Regroup the categorical column name by the first n_chars characters of its values, for example REC[:9]
+    (the audio file) or REC[:6] (the recording). Only the categories are truncated, not every row.
+    Returns (codes, categories).
+    """
+    categories, remap = np.unique(columns[name + '_categories'].astype(f'U{n_chars}'), return_inverse=True)
+    return remap.astype(np.int32)[columns[name]], categories
+
+
+def parse_dialogues(path):
+    """
+    Parse sperm-whale-dialogues.csv into typed columns.
+    """
+    df = pd.read_csv(path)
+    ici_names = [c for c in df.columns if c.startswith('ICI')]
+
+    columns = {}
+    add_categorical(columns, 'REC', df['REC'].to_numpy(dtype=str))
+    columns['File'], columns['File_categories'] = prefix_categorical(columns, 'REC', RECORDING_NAME_LENGTH)
+    columns['nClicks'] = df['nClicks'].to_numpy(dtype=np.int32)
+    columns['Duration'] = df['Duration'].to_numpy(dtype=np.float64)
+    columns['ICI'] = df[ici_names].to_numpy(dtype=np.float32)
+    columns['Whale'] = df['Whale'].to_numpy(dtype=np.int32)
+    columns['TsTo'] = df['TsTo'].to_numpy(dtype=np.float64)
+    return columns
+
+
+def parse_dominica(path):
+    """
+    Parse DominicaCodas.csv into typed columns.
+    """
+    # The file starts with a byte order mark, which would otherwise end up in the first column name
+    df = pd.read_csv(path, encoding='utf-8-sig')
+    ici_names = [c for c in df.columns if c.startswith('ICI')]
+
+    columns = {}
+    columns['codaNUM2018'] = df['codaNUM2018'].to_numpy(dtype=np.int32)
+    add_categorical(columns, 'Date', df['Date'].to_numpy(dtype=str))
+    columns['nClicks'] = df['nClicks'].to_numpy(dtype=np.int32)
+    columns['Duration'] = df['Duration'].to_numpy(dtype=np.float64)
+    columns['ICI'] = df[ici_names].to_numpy(dtype=np.float32)
+    for name in ['CodaType', 'Clan', 'Unit', 'IDN']:
+        add_categorical(columns, name, df[name].to_numpy(dtype=str))
+    columns['UnitNum'] = df['UnitNum'].to_numpy(dtype=np.int32)
+    return columns
+
+
+def cache_folder(path, cache_dir=CACHE_DIR):
+    """
+    Folder holding the cached columns of the csv at path, e.g. cache/sperm-whale-dialogues-<hash>.
+    """
+    name = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(cache_dir, f"{name}-{file_hash(path)}")
+
+
+def write_columns(folder, columns):
+    """
+    Write each column as <folder>/<name>.npy. Written to a temporary folder first and then renamed, so an
+    interrupted run never leaves a half written cache behind.
+    """
+    tmp_folder = folder + f".tmp{os.getpid()}"
+    os.makedirs(tmp_folder, exist_ok=True)
+    for name, values in columns.items():
+        np.save(os.path.join(tmp_folder, name + '.npy'), np.ascontiguousarray(values), allow_pickle=False)
+    try:
+        os.rename(tmp_folder, folder)
+    except OSError:
+        # another process wrote the same cache in the meantime
+        shutil.rmtree(tmp_folder)
+
+
+def read_columns(folder, mmap_mode='r'):
+    """
+    Load every <name>.npy in folder into a dict of columns, memory mapped unless mmap_mode is None.
+    """
+    columns = {}
+    for file_name in sorted(os.listdir(folder)):
+        if file_name.endswith('.npy'):
+            columns[file_name[:-4]] = np.load(os.path.join(folder, file_name), mmap_mode=mmap_mode)
+    return columns
+
+
+def load_columns(path, parse, cache_dir=CACHE_DIR, mmap_mode='r'):
+    """
+    Return the typed columns of the csv at path, parsing it with parse(path) only if it is not cached yet.
+    Use cache_dir=None to always parse and skip the cache.
+    """
+    if cache_dir is None:
+        return parse(path)
+
+    folder = cache_folder(path, cache_dir)
+    if not os.path.isdir(folder):
+        write_columns(folder, parse(path))
+    return read_columns(folder, mmap_mode)
+
+
+def load_dialogues(path=DIALOGUES_CSV, cache_dir=CACHE_DIR, mmap_mode='r'):
+    """
+    Typed columns of sperm-whale-dialogues.csv: REC, File, nClicks, Duration, ICI, Whale, TsTo.
+    """
+    return load_columns(path, parse_dialogues, cache_dir, mmap_mode)
+
+
+def load_dominica(path=DOMINICA_CSV, cache_dir=CACHE_DIR, mmap_mode='r'):
+    """
+    Typed columns of DominicaCodas.csv: codaNUM2018, Date, nClicks, Duration, ICI, CodaType, Clan, Unit,
+    UnitNum, IDN.
+    """
+    return load_columns(path, parse_dominica, cache_dir, mmap_mode)
+
+
+def iter_recordings(path, chunksize=100000, key='File', n_chars=None):
+    """
+    Yield a csv (e.g. the augmented one) as one DataFrame per recording (value of the key column), in order of
+    appearance, reading it in blocks of chunksize rows so memory is bounded by the chunk and recording size.
+    With n_chars, recordings are the first n_chars characters of the key column instead (REC[:6] for
+    sperm-whale-dialogues.csv itself). Rows of a recording are expected to be contiguous in the csv, as they are in
+    sperm-whale-dialogues.csv.
+    """
+    rest = None
+    for chunk in pd.read_csv(path, chunksize=chunksize):
+        if rest is not None:
+            chunk = pd.concat([rest, chunk])
+        keys = chunk[key] if n_chars is None else chunk[key].str[:n_chars]
+        # the last recording of the chunk may continue in the next chunk
+        complete = keys != keys.iloc[-1]
+        for _, recording in chunk[complete].groupby(keys[complete], sort=False):
+            yield recording
+        rest = chunk[~complete]
+    if rest is not None and len(rest) > 0:
+        yield rest
@@ -0,0 +1,66 @@
+"""
+Precomputed same-whale successor / predecessor index.
+
+getNextCoda / getPreviousCoda (dialogue script, notebooks 1, 4 and 5) scan forward or backward from coda i until
+they meet another coda of the same whale, which costs O(n) per call and O(n^2) per recording. Here the neighbours
+of every coda are found at once: the codas are sorted by (file, whale, position in the sequence) and consecutive
+entries of the same (file, whale) group are successor / predecessor of each other. After that, looking up the
+neighbour of a coda is just next_ids[i].
+
+Example:
+    next_ids, previous_ids = same_whale_neighbours(columns['File'], columns['Whale'])
+    chains = successor_chain(next_ids, 2)   # chains[:, 1] is the next-of-next coda of the same whale
+"""
+
+import numpy as np
+
+
+def same_whale_neighbours(file_codes, whale_id, order=None):
+    """
+    For every coda, the index of the next and of the previous coda of the same whale in the same file.
+
+    file_codes: integer (or string) label of the file / recording of each coda. Neighbours never cross files.
+    whale_id: whale number of each coda.
+    order: optional sort key (e.g. TsTo) defining the sequence of codas. By default the row order is used, which is
+           what getNextCoda / getPreviousCoda do on a book already sorted by time.
+
+    Returns (next_ids, previous_ids), int64 arrays with -1 where there is no such coda.
+    """
+    file_codes = np.asarray(file_codes)
+    whale_id = np.asarray(whale_id)
+    n = len(whale_id)
+    positions = np.arange(n) if order is None else np.asarray(order)
+
+    # np.lexsort sorts by the last key first and is stable, so ties in order keep their row order
+    sorted_ids = np.lexsort((positions, whale_id, file_codes))
+    same_group = (file_codes[sorted_ids[1:]] == file_codes[sorted_ids[:-1]]) & \
+                 (whale_id[sorted_ids[1:]] == whale_id[sorted_ids[:-1]])
+
+    next_ids = np.full(n, -1, dtype=np.int64)
+    previous_ids = np.full(n, -1, dtype=np.int64)
+    next_ids[sorted_ids[:-1][same_group]] = sorted_ids[1:][same_group]
+    previous_ids[sorted_ids[1:][same_group]] = sorted_ids[:-1][same_group]
+    return next_ids, previous_ids
+
+
+def successor_chain(next_ids, k):
+    """
+    The 1 to k step successors of every coda, as an (n, k) int64 matrix: column 0 is next_ids, column 1 the
+    next-of-next coda and so on. Works the same with previous_ids to get predecessor chains. -1 once the chain ends.
+    """
+    next_ids = np.asarray(next_ids)
+    chains = np.full((len(next_ids), k), -1, dtype=np.int64)
+    current = np.arange(len(next_ids))
+    for step in range(k):
+        current = np.where(current >= 0, next_ids[np.maximum(current, 0)], -1)
+        chains[:, step] = current
+    return chains
+
+
+def neighbours_by_recording(columns, order_by_time=True):
+    """
+    same_whale_neighbours over a column dict from coda_data.load_dialogues, grouping by recording ('File') and
+    ordering codas by their start time TsTo unless order_by_time is False (then the csv row order is used).
+    """
+    order = columns['TsTo'] if order_by_time else None
+    return same_whale_neighbours(columns['File'], columns['Whale'], order)
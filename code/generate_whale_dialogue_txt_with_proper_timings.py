@@ -7,290 +7,111 @@ a different "filename", are separated and labelled by their filename.
 This also includes proper timings: printing the time of the new conversations, as well as reordering the display by
 timestamp and printing when codas are spoken effectively simultaneously.
 
-"""
-import pandas as pd
-import numpy as np
-import os
-from numpy import genfromtxt
-import pickle
-from IPython import embed
-from scipy.io import loadmat
-
-# Load the data
-data = pd.read_csv('../data/sperm-whale-dialogues_augmented.csv')
-
-# Parses, cleans and orders the annotations in the order of appearence of the clicks
-
-# Initialize all the different conversations as empty arrays
-annotations = {}
-for i, row in data.iterrows():
-    # If it's the start of a new conversation, add a new dialogue
-    file_name = row['File'][:9]
-    annotations[file_name] = []
-
-# Then we go over the entries of the annotation file one by one (row wise) and append the annotation to the list corresponding to the file name
-# The annotations are not ordered in time in the annotation file so it is a random order.
-
-for i, row in data.iterrows():
-    file_name = row['File'][:9]
-    time_start = float(row['TsTo']) # start time of the first click of the coda seq
-
-    # collect all files with that name
-    temp = [] # List of times the clicks of the codas lie at - (t1-t1),(t2-t1),(t3-t1)...
-    temp.append(0)
-    j = 3
-    while (float(row.iloc[j]) != 0 and j<31): # Until the value of the ICI is zero we continue to append (tn-t1)
-        if float(row.iloc[j])> 0.0002: # To ignore mistakes in annotations
-            temp.append(0+np.sum(row.iloc[3:(j+1)].astype(float))) # t3-t1 = (t3-t2)+(t2-t1) = ICI2+ICI1
-        j = j+1
-    annotations[file_name].append([temp, time_start, int(row['Whale']), row['ConstructedString'], 0]) # Coda seq, what_time, what_whale_number
-
-
-
-# Annotation is now a dict of annotations but is still not ordered in time
-# Convert the dict of lists into a list of numpy array
-books = []
-for key in annotations.keys():
-    story = annotations[key] #each entity is a line of a coda
+Recordings are independent of each other, so the csv is streamed through one recording at a time: parse, sort by
+TsTo, assign rubato, run the chorus / pause state machine and write. Recordings are spread over a pool of worker
+processes (--workers), and their text is written in the order of the csv whatever the order they finish in.
 
+With --incremental, the rendered text of each recording is kept (in ../data/cache/dialogue_fragments, or the folder
+given with --fragments) and only the recordings whose rows were added or changed since the last run are parsed and
+rendered again, the others being spliced back into whale_dialogues.txt as they were.
 
-    book = np.zeros((len(story),44))
-    words = [''] * len(story) # store all the "words" in the story.
-    for j in range(len(story)):
-        book[j,0] = story[j][2] # Who made the sound (ID number)
-        book[j,1] = story[j][1] # What time did it start at
-        book[j,2:len(story[j][0])+2] = story[j][0] # Coda sequence
-        book[j,43] = story[j][-1] # Labels
-        words[j] = story[j][3] # The string sequence corresponding to this word
-    books.append((book,np.array(words),key))
-
+With --profile, the time, rows, memory and allocations of each stage (load, parse, rubato, chorus, write) are saved
+to a json report, see instrumentation.py. The stages run in the workers are recorded there and merged into the
+report.
+"""
+import argparse
+import hashlib
+import io
+import json
+import os
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
 
-# Sorts the annotation arrays of each audio file in order of time
-edited = []
-for i in range(len(books)):
-    book = books[i][0]
-    words = books[i][1]
-    key = books[i][2]
+import numpy as np
+import pandas as pd
 
+import click_times
+import coda_index
+import rubato
+from click_times import click_times_from_icis
+from coda_data import CACHE_DIR, DATA_DIR, iter_recordings
+from coda_index import same_whale_neighbours
+from instrumentation import PROFILERS, Profiler, profiled, stage, timed
+from rubato import DEFAULT_THRESHOLDS, categorize_rubato, durations_without_ornament, load_thresholds
+from rubato import rubato_deltas
 
-    # both the words and the books are sorted by the time
-    sorted_book = book[np.argsort(book[:, 1])]
-    sorted_words = words[np.argsort(book[:, 1])]
 
-    edited.append((sorted_book,sorted_words,key))
+AUGMENTED_CSV = os.path.join(DATA_DIR, 'sperm-whale-dialogues_augmented.csv')
+DIALOGUES_TXT = os.path.join(DATA_DIR, 'whale_dialogues.txt')
+FRAGMENTS_DIR = os.path.join(CACHE_DIR, 'dialogue_fragments')
 
 # CODA grouping parameters:
 max_diff = 10 # Max time difference otherwise print that there was a pause
 
-# visualization parameters:
-average_ICI = 0.2
-duration_coda = 8*average_ICI # seconds for the vertical axis
-
-
-
-previous_audiobook = ''
-page_time_origin = -10000000000
-
-
-newfile=0
-starting_book =0
-rootname='sw061b'
-# duration_page = 60*3 # seconds for the horizontal axis
-
-def determine_rubato(word_string_previous, word_string, click_times_previous, click_times,t_diff):
-    if t_diff > 10:
-        return " "
-
-    assert word_string[0].lower() in ['a','b','c','d','e','f','g','h','i','j','k','l','m','n','o','p','q','r']
-    assert word_string_previous[0].lower() in ['a','b','c','d','e','f','g','h','i','j','k','l','m','n','o','p','q','r']
 
-    if word_string[0].isupper():
-        # Ignore click if just for ornament
-        coda_duration_without_ornament = click_times[-2]
-    else:
-        coda_duration_without_ornament = click_times[-1]
-
-    if word_string_previous[0].isupper():
-        # Ignore click if just for ornament
-        coda_duration_without_ornament_previous = click_times_previous[-2]
-    else:
-        coda_duration_without_ornament_previous = click_times_previous[-1]
-
-
-
-    rhythm_previous = word_string_previous.lower()[0]
-    rhythm = word_string.lower()[0]
-    tempo_previous = word_string_previous.lower()[1]
-    tempo = word_string.lower()[1]
-
-    # the supplement to the paper defines rubato as change of duration within the same tempo and rhythm class
-    # however, a histogram statistical plot of the duration delta does not show any sort of bimodal results when
-    # these return " ". Also, the durations tend to match between codas regardless of rhythm is a key result of
-    # the paper. So it would maybe make sense to remove these returns. I guess tempo category would convey the appropiate
-    # Information regardless though.
-    if rhythm_previous != rhythm:
-        return " "
-
-    if tempo_previous != tempo:
-        return " "
-
-    duration_delta = coda_duration_without_ornament - coda_duration_without_ornament_previous
-
-    return duration_delta
-
-def categorize_rubato(rubato):
-    # quantile_25th = np.percentile(numeric_rubato_deltas, 25)
-    quantile_25th = -0.021416925000000087
-    # quantile_75th = np.percentile(numeric_rubato_deltas, 75)
-    quantile_75th = 0.018462550000000105
-
-    # Assign categories based on these quantiles
-    if rubato < quantile_25th:
-        # Decreasing
-        return str("\\")
-    elif rubato < quantile_75th:
-        # constant
-        return str("-")
-    else:
-        # increasing
-        return str("/")
-
-# Change this value depending on how many audiofiles you want to see plotted (one audio file may be split into several pages)
-num_audiobooks = len(edited) # max value it can take = len(edited)
-
-# Initialize an empty list to hold the dialogues
-dialogues = []
-# with open('../data/whale_dialogues_with_choruses.txt', 'w') as f:
-rubato_deltas = []
-for idx in range(num_audiobooks):
-    book = edited[idx][0]
-    words = edited[idx][1]
-    name = edited[idx][2]
-    rootname = name[0:6]
-    # print("----------------------------------------------------------------")
-    # print('idx: '+str(idx)+' File:'+name)
-    # print('   number of codas='+str(book.shape[0]-1))
-    # print('  '+ rootname +' previous=' + previous_audiobook)
-    # print("----------------------------------------------------------------")
-    # f.write(f"\nFile: {name}\n")
-
-
-    dialogues.append({
+def parse_recording(recording):
+    """
+    Parses, cleans and orders the annotations of one recording in the order of appearence of the clicks.
+
+    Returns (book, words) where book is a numpy array of shape (codas, 44) sorted by time:
+    0th column : ID of whale that made the coda
+    1st colum  : What absolute time in the file did the coda start at?
+    2nd column to 42nd column: Time from the first click the jth click of the coda occurs at.
+    43rd column: Labels
+    and words holds the string sequence ("word") corresponding to each coda.
+    """
+    # List of times the clicks of the codas lie at - (t1-t1),(t2-t1),(t3-t1)...
+    # Until the value of the ICI is zero we continue to append (tn-t1), ignoring ICIs <= 0.0002 (mistakes in annotations)
+    icis = recording[[c for c in recording.columns if c.startswith('ICI')]].to_numpy(dtype=np.float64)
+    click_times, _ = click_times_from_icis(icis)
+
+    book = np.zeros((len(recording),44))
+    book[:,0] = recording['Whale'].to_numpy() # Who made the sound (ID number)
+    book[:,1] = recording['TsTo'].to_numpy(dtype=np.float64) # What time did it start at
+    book[:,2:2+click_times.shape[1]] = click_times # Coda sequence
+    words = recording['ConstructedString'].to_numpy(dtype=str)
+
+    # The annotations are not ordered in time in the annotation file, so both the words and the book are sorted by the time
+    order = np.argsort(book[:, 1])
+    return book[order], words[order]
+
+
+def assign_rubato(book, words, time_origin, thresholds):
+    """
+    Rubato string of every coda of the book at once (see rubato.py). The first letter of the word is the rhythm,
+    capitalized if ornamented, the second character is the tempo.
+    """
+    # The next and previous coda of the same whale, for every coda of the book (see coda_index.py)
+    _, previous_ids = same_whale_neighbours(np.zeros(book.shape[0], dtype=int), book[:,0].astype(int))
+
+    letters = words.astype('U2').view('U1').reshape(-1, 2)
+    assert np.isin(np.char.lower(letters[:,0]), list('abcdefghijklmnopqr')).all()
+    click_times = book[:,2:42]
+    num_clicks = np.count_nonzero(click_times, axis=1)+1 # sum 1 because the first click is always zero.
+    durations = durations_without_ornament(click_times, num_clicks, np.char.isupper(letters[:,0]))
+    deltas = rubato_deltas(previous_ids, book[:,1]-time_origin, durations, np.char.lower(letters[:,0]), letters[:,1])
+    return categorize_rubato(deltas, thresholds)
+
+
+def build_dialogue(name, book, words, thresholds):
+    """
+    The dialogue of one recording: for each coda (in order of time) the whale, the text (rubato + word) and the time.
+    """
+    time_origin = book[0,1]
+    rubato_strings = assign_rubato(book, words, time_origin, thresholds)
+
+    dialogue = {
         'file': name,
         'dialogue': []
-    })
-
-    # Function: parse de coda and get basic info
-    def parseCoda(i):
-        if i==-1:
-            return [0,0,0,0,0,0]
-        coda = book[i,:]
-        word_string = words[i]
-        whale_number = coda[0].astype(int)
-        t_init = coda[1]-time_origin
-        click_times = coda[2:42].astype(float).tolist()
-        num_clicks = np.count_nonzero(click_times)+1 # sum 1 because the first click is always zero.
-        click_times = click_times[0:num_clicks]
-        label_ = coda[43].astype(int)
-        return [whale_number,t_init,word_string,num_clicks,click_times,label_] #,average_power,click_power]
-
-    # Function: returns the index for the next coda (after coda i) from the same whale.
-    def getNextCoda(i, whale_number):
-        found = -1
-        while found==-1 and i<book.shape[0]-1:
-            i=i+1
-            [whale_number_i,t_init,word_string,num_clicks,click_times,label_] = parseCoda(i)
-            if whale_number_i==whale_number:
-                found = i
-        return found
-
-    # Function: returns the index for the previous coda (before coda i) from the same whale.
-    def getPreviousCoda(i, whale_number):
-        found = -1
-        while found==-1 and i>0:
-            i=i-1
-            [whale_number_i,t_init,word_string,num_clicks,click_times,label_] = parseCoda(i)
-            if whale_number_i==whale_number:
-                found = i
-        return found
-
-
-    if rootname == previous_audiobook:
-        page_time_origin = -10000000000
-    else:
-        time_origin = book[0,1]
-        previous_audiobook = rootname
-        newfile=1
-
+    }
     for i in range(book.shape[0]):
-
-        [whale_number,t_init,word_string,num_clicks,click_times,label_curr] = parseCoda(i)
-        i_next = getNextCoda(i, whale_number)
-        [whale_number_next, t_init_next, word_string_next, num_clicks_next, click_times_next,label_next] = parseCoda(i_next)
-        i_previous = getPreviousCoda(i, whale_number)
-        [whale_number_previous, t_init_previous, word_string_previous, num_clicks_previous, click_times_previous,label_previous] = parseCoda(i_previous)
-        rubato_string = " "
-        if i_previous != -1: # not the first item
-            t_diff = t_init - t_init_previous
-            rubato = determine_rubato(word_string_previous, word_string, click_times_previous, click_times,t_diff)
-            if rubato != " ":
-                rubato_deltas.append(rubato)
-                rubato_string = categorize_rubato(rubato)
-        dialogues[-1]['dialogue'].append({
-            'whale': whale_number,
-            'text': rubato_string+word_string, # the rubato comes between previous coda and this one, so put before.
-            'timestamp': t_init
+        dialogue['dialogue'].append({
+            'whale': int(book[i,0]),
+            'text': rubato_strings[i]+words[i], # the rubato comes between previous coda and this one, so put before.
+            'timestamp': book[i,1]-time_origin
         })
+    return dialogue
 
-""" Uncomment block below to see how rubato percentiles we calculated.
-def plot_histogram_and_print_percentiles(rubato_deltas):
-    import matplotlib.pyplot as plt
-    plt.figure()
-    plt.hist(rubato_deltas, bins=300, color='blue')  # Adjust number of bins as needed
-    plt.title('Histogram of Rubato Deltas')
-    plt.xlabel('Rubato Delta')
-    plt.ylabel('Frequency')
-    plt.show()
-
-    # Calculate the 25th and 75th quantiles
-    quantile_25th = np.percentile(rubato_deltas, 25)
-    quantile_75th = np.percentile(rubato_deltas, 75)
-
-    # Separate data based on quantiles
-    data_decreasing = [delta for delta in rubato_deltas if delta < quantile_25th]
-    data_constant = [delta for delta in rubato_deltas if quantile_25th <= delta <= quantile_75th]
-    data_increasing = [delta for delta in rubato_deltas if delta > quantile_75th]
-
-    # Prepare bins to be consistent across histograms
-    bins = np.histogram_bin_edges(rubato_deltas, bins=100)  # Define bins from the entire data range
-
-    # Plot three histograms and capture the bin counts
-    fig, ax = plt.subplots()
-    counts_decreasing, _, _ = ax.hist(data_decreasing, bins=bins, color='red', alpha=0.5, label='Decreasing')
-    counts_constant, _, _ = ax.hist(data_constant, bins=bins, color='green', alpha=0.5, label='Constant')
-    counts_increasing, _, _ = ax.hist(data_increasing, bins=bins, color='blue', alpha=0.5, label='Increasing')
-
-    # Determine the maximum y-value across all histograms for consistent y-axis
-    max_count = max(max(counts_decreasing), max(counts_constant), max(counts_increasing))
-    ax.set_ylim([0, max_count])  # Set the y-axis limit to the maximum count
-
-    # Add titles and labels
-    ax.set_title('Histogram of Rubato Deltas with Quantile Ranges')
-    ax.set_xlabel('Rubato Delta')
-    ax.set_ylabel('Frequency')
-
-    # Add legend
-    ax.legend()
-
-    # Show plot
-    plt.show()
-
-    print("quantile_25th")
-    print(quantile_25th)
-    print("quantile_75th")
-    print(quantile_75th)
-plot_histogram_and_print_percentiles(rubato_deltas)
-"""
 
 def print_chorus(chorus_whales_data, f):
     sorted_keys = sorted(chorus_whales_data)  # Sort the keys of the dictionary
@@ -331,110 +152,294 @@ def print_time_no_vocalizations(time_diff,f):
     unit_label += "" if rounded == 1 else "s"
     f.write(f"\n(No vocalizations, {int(rounded)} {unit_label})\n\n")
 
-# Open the output file
-with open('../data/whale_dialogues.txt', 'w') as f:
-
-    # Initialize a variable outside the loop to track the silent time
-    # time_diff = 0
 
-    # Print the dialogues
-    for dialogue in dialogues:
+class DialogueWriter:
+    """
+    The chorus / pause state machine of one recording, fed one line of the dialogue (whale, text, timestamp) at a
+    time in order of time. Each line of text is written to f as soon as it is known: a turn once another whale
+    speaks, a chorus once it ends, a pause when the next coda comes. close() writes whatever is pending.
+    """
 
+    def __init__(self, name, f):
+        self.f = f
         # Initialize variables
-        previous_whale_name = ""  # empty as there is no previous, it's the start of a conversation
-        what_last_whale_said = ""
-        what_last_whale_said_array = []
-        last_timestamp = -np.inf
-        chorus_texts = {}
+        self.previous_whale_name = ""  # empty as there is no previous, it's the start of a conversation
+        self.what_last_whale_said = ""
+        self.what_last_whale_said_array = []
+        self.last_timestamp = -np.inf
 
         # Write filename right above the start of the conversation to the file
-        f.write(f"File: {dialogue['file']}\n")
+        f.write(f"File: {name}\n")
 
         # Before starting the dialogue loop
-        chorus_whales_data = {}
-        chorus_text = ""
-        previously_in_chorus = False
-        previous_whale_utterance = ""
-
-        # Inside the dialogue loop
-        for i in range(len(dialogue['dialogue'])):
-            line = dialogue['dialogue'][i]
-
-            this_timestamp = line['timestamp']
-            assert last_timestamp <= this_timestamp
-
-            # Check time difference and manage chorus
-            time_diff = abs(this_timestamp - last_timestamp)
-
-            # uncomment below to print the line as well for debugging
-            # f.write("\n"+str(line)+f" tdiff: {time_diff}\n")
-
-            if time_diff < 0.5 and previous_whale_name != line['whale']:
-                # if previous_whale_name and what_last_whale_said: # if not on the first one
-                if not previously_in_chorus:
-                    # we don't need to repeat this one, it will be in the chorus, so go up to the penultamate entry
-                    if len(what_last_whale_said_array) > 1:
-                        # If there was any previous stored thing to say, print it.
-                        # Also remove the most previous as it's part of the chorus
-                        f.write(f"Whale {previous_whale_name}: " + " ".join(what_last_whale_said_array[:-1]) + ".\n")
-
-                # Add current whale to chorus if not already in it
-                if previous_whale_name not in chorus_whales_data.keys():
-                    chorus_whales_data[previous_whale_name] = previous_whale_utterance
-                if line['whale'] not in chorus_whales_data.keys():
-                    chorus_whales_data[line['whale']] = line['text']
-
-                what_last_whale_said = ""
-                what_last_whale_said_array = []
-                previously_in_chorus = True
+        self.chorus_whales_data = {}
+        self.previously_in_chorus = False
+        self.previous_whale_utterance = ""
+
+    def add(self, line):
+        f = self.f
+        this_timestamp = line['timestamp']
+        assert self.last_timestamp <= this_timestamp
+
+        # Check time difference and manage chorus
+        time_diff = abs(this_timestamp - self.last_timestamp)
+
+        # uncomment below to print the line as well for debugging
+        # f.write("\n"+str(line)+f" tdiff: {time_diff}\n")
+
+        if time_diff < 0.5 and self.previous_whale_name != line['whale']:
+            # if previous_whale_name and what_last_whale_said: # if not on the first one
+            if not self.previously_in_chorus:
+                # we don't need to repeat this one, it will be in the chorus, so go up to the penultamate entry
+                if len(self.what_last_whale_said_array) > 1:
+                    # If there was any previous stored thing to say, print it.
+                    # Also remove the most previous as it's part of the chorus
+                    f.write(f"Whale {self.previous_whale_name}: " + " ".join(self.what_last_whale_said_array[:-1]) + ".\n")
+
+            # Add current whale to chorus if not already in it
+            if self.previous_whale_name not in self.chorus_whales_data.keys():
+                self.chorus_whales_data[self.previous_whale_name] = self.previous_whale_utterance
+            if line['whale'] not in self.chorus_whales_data.keys():
+                self.chorus_whales_data[line['whale']] = line['text']
+
+            self.what_last_whale_said = ""
+            self.what_last_whale_said_array = []
+            self.previously_in_chorus = True
 
+        else:
+            # Output chorus if it exists and reset
+            if self.previously_in_chorus: # if was chorus last time, and not this time.
+                print_chorus(self.chorus_whales_data, f)
+                self.chorus_whales_data = {}
+                self.what_last_whale_said = f"Whale {line['whale']}: {line['text']}"
+                self.what_last_whale_said_array.append(line['text'])
             else:
-                # Output chorus if it exists and reset
-                if previously_in_chorus: # if was chorus last time, and not this time.
-                    print_chorus(chorus_whales_data, f)
-                    chorus_whales_data = {}
-                    what_last_whale_said = f"Whale {line['whale']}: {line['text']}"
-                    what_last_whale_said_array.append(line['text'])
-                else:
-                    # Continue with the regular logic
-                    if line['whale'] == previous_whale_name:
-                        # We know the tdiff was large last time, but that might have been a time that chorus was printed.
-                        # we should have loaded the word when first not in chorus into what_last_whale_said_array
-                        # we do want to print if the last whale was in chorus before.
-                        what_last_whale_said += " " + line['text']
-                        what_last_whale_said_array.append(line['text'])
-
-                    else: # not in a chorus, not previously in a chorus, and the whale is different.
-                        if previous_whale_name and what_last_whale_said: # and, last whale said something, and not first entry
-                            f.write(what_last_whale_said + ".\n")
-                        what_last_whale_said = f"Whale {line['whale']}: {line['text']}"
-                        what_last_whale_said_array = [line['text']]
-                previously_in_chorus = False
-
-            # we want to split up vocalizations that are a long time apart in text dialogue.
-            if time_diff > max_diff and not np.isnan(time_diff) and not time_diff == np.inf:
-                # this cannot be a chorus, as time_diff is high. So it would have printed.
-                # Also print past vocalizations of the same whale (which otherwise would be skipped) because its a long pause.
-                # we don't want to print this entry though, it needs to be printed after the pause (tdiff is prev - current time)
-                if len(what_last_whale_said_array) > 1:
-                    f.write(f"Whale {previous_whale_name}: " + " ".join(what_last_whale_said_array[:-1]) + ".\n")
-                    # previous_whale_name = ""  # empty as there is no previous, it's the start of a conversation
-                    what_last_whale_said = f"Whale {line['whale']}: {line['text']}"
-                    what_last_whale_said_array = [line['text']]
-
-                print_time_no_vocalizations(time_diff,f)
-                time_diff = 0
-
-            previous_whale_name = line["whale"]
-            previous_whale_utterance = line["text"]
-            last_timestamp = this_timestamp
-
+                # Continue with the regular logic
+                if line['whale'] == self.previous_whale_name:
+                    # We know the tdiff was large last time, but that might have been a time that chorus was printed.
+                    # we should have loaded the word when first not in chorus into what_last_whale_said_array
+                    # we do want to print if the last whale was in chorus before.
+                    self.what_last_whale_said += " " + line['text']
+                    self.what_last_whale_said_array.append(line['text'])
+
+                else: # not in a chorus, not previously in a chorus, and the whale is different.
+                    if self.previous_whale_name and self.what_last_whale_said: # and, last whale said something, and not first entry
+                        f.write(self.what_last_whale_said + ".\n")
+                    self.what_last_whale_said = f"Whale {line['whale']}: {line['text']}"
+                    self.what_last_whale_said_array = [line['text']]
+            self.previously_in_chorus = False
+
+        # we want to split up vocalizations that are a long time apart in text dialogue.
+        if time_diff > max_diff and not np.isnan(time_diff) and not time_diff == np.inf:
+            # this cannot be a chorus, as time_diff is high. So it would have printed.
+            # Also print past vocalizations of the same whale (which otherwise would be skipped) because its a long pause.
+            # we don't want to print this entry though, it needs to be printed after the pause (tdiff is prev - current time)
+            if len(self.what_last_whale_said_array) > 1:
+                f.write(f"Whale {self.previous_whale_name}: " + " ".join(self.what_last_whale_said_array[:-1]) + ".\n")
+                # previous_whale_name = ""  # empty as there is no previous, it's the start of a conversation
+                self.what_last_whale_said = f"Whale {line['whale']}: {line['text']}"
+                self.what_last_whale_said_array = [line['text']]
+
+            print_time_no_vocalizations(time_diff,f)
+
+        self.previous_whale_name = line["whale"]
+        self.previous_whale_utterance = line["text"]
+        self.last_timestamp = this_timestamp
+
+    def close(self):
+        f = self.f
         # After the loop, check if there's an unprocessed chorus
-        if len(chorus_whales_data.keys()) > 0:
-            print_chorus(chorus_whales_data, f)
+        if len(self.chorus_whales_data.keys()) > 0:
+            print_chorus(self.chorus_whales_data, f)
 
         # Remember to write the last whale's sayings in each dialogue to the file
-        f.write(what_last_whale_said + ".\n\n")
+        f.write(self.what_last_whale_said + ".\n\n")
 
         # an extra newline before filenames to indicate significant separation
         f.write("\n")
+
+
+def write_dialogue(dialogue, f):
+    """
+    Writes the dialogue of one recording, grouping codas spoken effectively simultaneously into choruses and
+    printing the long pauses.
+    """
+    writer = DialogueWriter(dialogue['file'], f)
+    for line in dialogue['dialogue']:
+        writer.add(line)
+    writer.close()
+
+
+def render_recording(recording, thresholds):
+    """
+    The text of one recording (a DataFrame of its rows of the augmented csv), from parsing to the written dialogue.
+    """
+    name = recording['File'].iloc[0]
+    with stage('parse', rows=len(recording)):
+        book, words = parse_recording(recording)
+    with stage('rubato', rows=len(book)):
+        dialogue = build_dialogue(name, book, words, thresholds)
+    f = io.StringIO()
+    with stage('chorus', rows=len(book)):
+        write_dialogue(dialogue, f)
+    return f.getvalue()
+
+
+def renderer_hash(modules=(click_times, coda_index, rubato)):
+    """
+    Hash of the source of this script and of the modules it renders with.
+    """
+    h = hashlib.sha1()
+    for path in [__file__] + [module.__file__ for module in modules]:
+        with open(path, 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()[:16]
+
+
+class FragmentStore:
+    """
+    Rendered text of each recording, kept between runs for the incremental mode (--incremental).
+
+    Each fragment is saved as <folder>/<recording>-<hash>.txt, where the hash covers the recording's rows of the
+    csv, the rendering parameters and the source of the rendering code (renderer_hash), so a recording whose rows
+    were added or changed gets a new hash and is re-rendered, as is every recording after the code changed, while
+    unchanged recordings are read back from their fragment. manifest.json lists the recordings
+    of the last run, in order, with their hash.
+    """
+
+    def __init__(self, folder=FRAGMENTS_DIR):
+        self.folder = folder
+        self.manifest = []
+        self.num_rendered = 0
+        self.renderer = renderer_hash()
+        os.makedirs(folder, exist_ok=True)
+
+    def key(self, recording, thresholds):
+        h = hashlib.sha1()
+        h.update(repr((self.renderer, list(recording.columns), tuple(thresholds), max_diff)).encode())
+        h.update(pd.util.hash_pandas_object(recording, index=False).to_numpy().tobytes())
+        return h.hexdigest()[:16]
+
+    def path(self, name, key):
+        return os.path.join(self.folder, f"{name}-{key}.txt")
+
+    def get(self, name, key):
+        self.manifest.append({'file': name, 'hash': key})
+        if not os.path.exists(self.path(name, key)):
+            return None
+        with open(self.path(name, key)) as f:
+            return f.read()
+
+    def put(self, name, key, text):
+        self.num_rendered += 1
+        with open(self.path(name, key), 'w') as f:
+            f.write(text)
+
+    def save_manifest(self):
+        """
+        Write the manifest and remove the fragments no recording of this run uses anymore.
+        """
+        with open(os.path.join(self.folder, 'manifest.json'), 'w') as f:
+            json.dump({'recordings': self.manifest}, f, indent=1)
+        in_use = {os.path.basename(self.path(entry['file'], entry['hash'])) for entry in self.manifest}
+        for file_name in os.listdir(self.folder):
+            if file_name.endswith('.txt') and file_name not in in_use:
+                os.remove(os.path.join(self.folder, file_name))
+
+
+def render_recordings(recordings, thresholds, workers=1, fragments=None, profiler=None):
+    """
+    Yields the text of each recording, in the order of recordings. With more than one worker the recordings are
+    rendered in a process pool, keeping at most a few recordings per worker in flight so memory stays flat.
+    With a FragmentStore, recordings that did not change since the last run are read back instead of rendered.
+    With a profiler, the stages run in the workers are merged into it.
+    """
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    max_in_flight = 4 * workers
+    # (name, key, text or future) of each recording, in order
+    in_flight = deque()
+
+    def finish(name, key, text):
+        if isinstance(text, Future):
+            text = text.result()
+            if profiler is not None:
+                text, stages = text
+                profiler.merge(stages)
+            if fragments is not None:
+                fragments.put(name, key, text)
+        return text
+
+    try:
+        for recording in recordings:
+            name = recording['File'].iloc[0]
+            key = None
+            text = None
+            if fragments is not None:
+                key = fragments.key(recording, thresholds)
+                text = fragments.get(name, key)
+            if text is None:
+                if pool is None:
+                    text = render_recording(recording, thresholds)
+                    if fragments is not None:
+                        fragments.put(name, key, text)
+                elif profiler is not None:
+                    text = pool.submit(profiled, render_recording, recording, thresholds)
+                else:
+                    text = pool.submit(render_recording, recording, thresholds)
+            in_flight.append((name, key, text))
+
+            # hand back everything already done at the front of the queue, and wait once too many are in flight
+            while in_flight and (not isinstance(in_flight[0][2], Future) or len(in_flight) >= max_in_flight):
+                yield finish(*in_flight.popleft())
+        while in_flight:
+            yield finish(*in_flight.popleft())
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--source', default=AUGMENTED_CSV, help='augmented coda csv')
+    parser.add_argument('--destination', default=DIALOGUES_TXT)
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('--chunksize', type=int, default=100000, help='number of csv rows read at a time')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only re-render recordings whose rows changed since the last incremental run')
+    parser.add_argument('--fragments', default=FRAGMENTS_DIR, help='folder of the rendered recordings (--incremental)')
+    parser.add_argument('--rubato-thresholds', default=None,
+                        help='rubato thresholds fitted by rubato.py (../data/rubato_thresholds.json), '
+                             'instead of the original ones')
+    parser.add_argument('--profile', default=None, help='save the per stage statistics to this json file')
+    parser.add_argument('--profiler', choices=PROFILERS, default='none',
+                        help='also profile the whole run with cProfile or the sampling profiler (with --profile)')
+    args = parser.parse_args()
+
+    profiler = Profiler(args.profiler).start() if args.profile is not None else None
+
+    # Rubato thresholds: the 25th and 75th percentiles of the duration deltas, as originally fitted. rubato.py fits
+    # them on the current data (saved to ../data/rubato_thresholds.json), used with --rubato-thresholds.
+    thresholds = DEFAULT_THRESHOLDS
+    if args.rubato_thresholds is not None:
+        thresholds = load_thresholds(args.rubato_thresholds)
+
+    fragments = FragmentStore(args.fragments) if args.incremental else None
+
+    recordings = timed(iter_recordings(args.source, args.chunksize), 'load')
+    # written next to the destination and then moved over it, so a failed run leaves the previous file in place
+    with open(args.destination + '.tmp', 'w') as f:
+        for text in render_recordings(recordings, thresholds, args.workers, fragments, profiler):
+            with stage('write', rows=text.count('\n')):
+                f.write(text)
+    os.replace(args.destination + '.tmp', args.destination)
+
+    if fragments is not None:
+        fragments.save_manifest()
+        print(f"Re-rendered {fragments.num_rendered} of {len(fragments.manifest)} recordings")
+
+    if profiler is not None:
+        profiler.stop().write(args.profile, workers=args.workers, incremental=args.incremental)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""
+Information capacity of the coda system, measured from the data.
+
+6-information-capacity works out bit rates from constants: the number of possible symbols (18*5*3*2), an average
+exchange of 20 codas and an average coda of 0.916 s, i.e. it assumes every symbol is equally likely and independent.
+Here the n-gram statistics of the actual coda sequences are counted and their entropy estimated:
+
+- H_n: block entropy of the n-grams (bits), plug-in and with the Miller-Madow bias correction (K - 1) / (2 N ln 2),
+  K the number of distinct n-grams and N the number of n-grams observed
+- h_n = H_n - H_(n-1): entropy of a coda given the n - 1 before it (bits per coda), the entropy rate as n grows
+- bits/s: h_n divided by the mean coda duration (as bit_rate_1coda of the notebook), and h_n times the number of
+  codas per second of conversation
+
+The sequences are the codas of each conversation in order of time ('conversation', all whales interleaved) or of
+each whale within a conversation ('whale'). Symbols are the coda tokens of tokens.py (rubato + rhythm, tempo and
+ornament). Each n-gram is packed into one integer (base vocabulary size, exact while it fits in 63 bits, otherwise a
+multiplicative hash modulo 2^64), and counted with np.unique, so no python object is created per n-gram, and n-grams
+never cross the end of a sequence.
+
+    python information_capacity.py --max-n 4
+    python information_capacity.py --max-n 4 --streams whale
+"""
+
+import argparse
+
+import numpy as np
+
+from coda_data import iter_recordings
+from generate_whale_dialogue_txt_with_proper_timings import AUGMENTED_CSV
+from rubato import DEFAULT_THRESHOLDS, load_thresholds
+from tokens import CODA_STRINGS, FIRST_CODA, recording_codas
+
+
+MAX_N = 4
+
+# Odd 64 bit multipliers of the n-gram hash, when the exact packing doesn't fit
+HASH_MULTIPLIERS = np.random.default_rng(0).integers(1, 2**63, size=64, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+
+
+def coda_sequences(source=AUGMENTED_CSV, streams='conversation', thresholds=DEFAULT_THRESHOLDS, chunksize=100000):
+    """
+    The coda symbols (0 to len(CODA_STRINGS) - 1) of all the sequences one after the other, with the sequence id,
+    start time and duration of each coda. Sequences are the conversations, or with streams='whale' the codas of each
+    whale of each conversation.
+    """
+    symbols, sequence, times, durations = [], [], [], []
+    num_sequences = 0
+    for recording in iter_recordings(source, chunksize):
+        whales, t, d, codas = recording_codas(recording, thresholds)
+        if streams == 'whale':
+            order = np.argsort(whales, kind='stable')
+            _, ids = np.unique(whales[order], return_inverse=True)
+        else:
+            order = np.arange(len(whales))
+            ids = np.zeros(len(whales), dtype=np.int64)
+        symbols.append(codas[order] - FIRST_CODA)
+        sequence.append(num_sequences + ids)
+        times.append(t[order])
+        durations.append(d[order])
+        num_sequences += ids.max() + 1
+    return np.concatenate(symbols), np.concatenate(sequence), np.concatenate(times), np.concatenate(durations)
+
+
+def ngram_codes(symbols, sequence, n, vocabulary_size=len(CODA_STRINGS)):
+    """
+    One integer per n-gram starting at each position where the n codas belong to the same sequence.
+    """
+    symbols = np.asarray(symbols, dtype=np.uint64)
+    sequence = np.asarray(sequence)
+    num = len(symbols) - n + 1
+    if num <= 0:
+        return np.zeros(0, dtype=np.uint64)
+    valid = sequence[:num] == sequence[n - 1:]
+
+    exact = n * np.log2(vocabulary_size) < 63
+    codes = np.zeros(num, dtype=np.uint64)
+    for k in range(n):
+        if exact:
+            codes = codes * np.uint64(vocabulary_size) + symbols[k:k + num]
+        else:
+            # wraps around modulo 2^64
+            codes = codes * HASH_MULTIPLIERS[k % len(HASH_MULTIPLIERS)] + symbols[k:k + num] + np.uint64(1)
+    return codes[valid]
+
+
+def entropy(counts):
+    """
+    Plug-in and Miller-Madow corrected entropy (bits) of a distribution given by its counts.
+    """
+    counts = np.asarray(counts, dtype=np.float64)
+    total = counts.sum()
+    if total == 0:
+        return 0.0, 0.0
+    p = counts / total
+    plug_in = float(-np.sum(p * np.log2(p)))
+    return plug_in, plug_in + (len(counts) - 1) / (2 * total * np.log(2))
+
+
+def ngram_entropies(symbols, sequence, max_n=MAX_N):
+    """
+    For n = 1 to max_n: number of n-grams, number of distinct n-grams, plug-in and corrected block entropies H_n.
+    """
+    rows = []
+    for n in range(1, max_n + 1):
+        _, counts = np.unique(ngram_codes(symbols, sequence, n), return_counts=True)
+        plug_in, corrected = entropy(counts)
+        rows.append({'n': n, 'ngrams': int(counts.sum()), 'distinct': len(counts), 'H': plug_in,
+                     'H_corrected': corrected})
+    return rows
+
+
+def capacity(symbols, sequence, times, durations, max_n=MAX_N):
+    """
+    The n-gram table of ngram_entropies, with the conditional entropies h_n (bits per coda) and the bit rates.
+    """
+    rows = ngram_entropies(symbols, sequence, max_n)
+    mean_duration = float(np.mean(durations))
+    # time from the first to the end of the last coda of each sequence
+    first = np.r_[True, sequence[1:] != sequence[:-1]]
+    last = np.r_[sequence[1:] != sequence[:-1], True]
+    span = np.sum(times[last] + durations[last] - times[first])
+    codas_per_second = len(symbols) / span
+
+    previous = {'H': 0.0, 'H_corrected': 0.0}
+    for row in rows:
+        row['h'] = row['H'] - previous['H']
+        row['h_corrected'] = row['H_corrected'] - previous['H_corrected']
+        row['bits_per_second_of_coda'] = row['h_corrected'] / mean_duration
+        row['bits_per_second_of_conversation'] = row['h_corrected'] * codas_per_second
+        previous = row
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--source', default=AUGMENTED_CSV, help='augmented coda csv')
+    parser.add_argument('--streams', choices=['conversation', 'whale'], default='conversation')
+    parser.add_argument('--max-n', type=int, default=MAX_N)
+    parser.add_argument('--rubato-thresholds', default=None,
+                        help='rubato thresholds fitted by rubato.py (../data/rubato_thresholds.json), '
+                             'instead of the original ones')
+    args = parser.parse_args()
+
+    thresholds = DEFAULT_THRESHOLDS if args.rubato_thresholds is None else load_thresholds(args.rubato_thresholds)
+    symbols, sequence, times, durations = coda_sequences(args.source, args.streams, thresholds)
+    print(f"{len(symbols)} codas in {sequence.max() + 1} sequences, {len(np.unique(symbols))} distinct symbols "
+          f"of {len(CODA_STRINGS)} (uniform: {np.log2(len(CODA_STRINGS)):.3f} bits), "
+          f"mean coda duration {np.mean(durations):.3f} s")
+    print(f"{'n':>2} {'n-grams':>8} {'distinct':>8} {'H_n':>7} {'H_n corr':>8} {'h_n':>7} {'h_n corr':>8} "
+          f"{'bits/s coda':>11} {'bits/s conv':>11}")
+    for row in capacity(symbols, sequence, times, durations, args.max_n):
+        print(f"{row['n']:>2} {row['ngrams']:>8} {row['distinct']:>8} {row['H']:>7.3f} {row['H_corrected']:>8.3f} "
+              f"{row['h']:>7.3f} {row['h_corrected']:>8.3f} {row['bits_per_second_of_coda']:>11.3f} "
+              f"{row['bits_per_second_of_conversation']:>11.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+"""
+Stage level instrumentation of the pipelines (augmentation and dialogue scripts), enabled with --profile.
+
+The scripts mark their stages with
+
+    with stage('rubato', rows=len(book)):
+        ...
+    for chunk in timed(pd.read_csv(source, chunksize=chunksize), 'load'):   # time spent producing each item
+        ...
+
+which cost nothing unless a Profiler has been started. A started profiler adds up, per stage, the wall time, the
+number of calls and of rows (hence the throughput), the net number of memory blocks python allocated, and the peak
+resident memory of the process when the stage ended. Optionally the whole run is also profiled with cProfile
+(function level, deterministic) or a sampling profiler (a SIGPROF timer recording the call stack every few
+milliseconds, cheap enough for long runs). The report is one json document:
+
+    python add_tempo_rubato_rhythm_ornament_to_datasets.py --profile profile.json
+    python generate_whale_dialogue_txt_with_proper_timings.py --workers 1 --profile profile.json --profiler sample
+
+Stages run in worker processes are recorded by a profiler of each worker (profiled), whose statistics are sent back
+with the result and merged into the report of the main process. Their peak_rss_mb is then the largest peak of a
+worker, and the cProfile and sampling profiles only cover the main process.
+"""
+
+import cProfile
+import json
+import platform
+import pstats
+import resource
+import signal
+import sys
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+
+PROFILERS = ['none', 'cprofile', 'sample']
+
+# Interval of the sampling profiler (seconds) and number of functions / stacks kept in the report
+SAMPLE_INTERVAL = 0.005
+TOP = 40
+
+# The profiler the stages report to, None when profiling is off
+ACTIVE = None
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    scale = 2**20 if sys.platform == 'darwin' else 2**10
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+
+class Profiler:
+    """
+    Per stage statistics of a run, and the optional cProfile / sampling profile of the whole run.
+    """
+
+    def __init__(self, profiler='none'):
+        assert profiler in PROFILERS, profiler
+        self.profiler = profiler
+        self.stages = {}
+        self.samples = Counter()
+        self.cprofile = None
+        self.start_time = None
+        self.seconds = None
+
+    def start(self):
+        global ACTIVE
+        ACTIVE = self
+        self.start_time = time.perf_counter()
+        if self.profiler == 'cprofile':
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+        elif self.profiler == 'sample':
+            signal.signal(signal.SIGPROF, self._sample)
+            signal.setitimer(signal.ITIMER_PROF, SAMPLE_INTERVAL, SAMPLE_INTERVAL)
+        return self
+
+    def stop(self):
+        global ACTIVE
+        if self.profiler == 'cprofile':
+            self.cprofile.disable()
+        elif self.profiler == 'sample':
+            signal.setitimer(signal.ITIMER_PROF, 0, 0)
+            signal.signal(signal.SIGPROF, signal.SIG_DFL)
+        self.seconds = time.perf_counter() - self.start_time
+        ACTIVE = None
+        return self
+
+    def _sample(self, signum, frame):
+        stack = []
+        while frame is not None:
+            stack.append(f"{frame.f_code.co_name} ({frame.f_code.co_filename.split('/')[-1]}:{frame.f_lineno})")
+            frame = frame.f_back
+        self.samples[';'.join(reversed(stack))] += 1
+
+    def entry(self, name):
+        return self.stages.setdefault(name, {'seconds': 0.0, 'calls': 0, 'rows': 0, 'allocated_blocks': 0,
+                                             'peak_rss_mb': 0.0})
+
+    def record(self, name, seconds, rows, blocks):
+        entry = self.entry(name)
+        entry['seconds'] += seconds
+        entry['calls'] += 1
+        entry['rows'] += rows
+        entry['allocated_blocks'] += blocks
+        entry['peak_rss_mb'] = max(entry['peak_rss_mb'], peak_rss_mb())
+
+    def merge(self, stages):
+        """
+        Add the stage statistics of another profiler (of a worker process, see profiled) to these.
+        """
+        for name, other in stages.items():
+            entry = self.entry(name)
+            for key in ['seconds', 'calls', 'rows', 'allocated_blocks']:
+                entry[key] += other[key]
+            entry['peak_rss_mb'] = max(entry['peak_rss_mb'], other['peak_rss_mb'])
+
+    def report(self, **info):
+        stages = {}
+        for name, entry in self.stages.items():
+            stages[name] = dict(entry, rows_per_second=entry['rows'] / entry['seconds'] if entry['seconds'] else None)
+        report = {
+            'argv': sys.argv,
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'seconds': self.seconds,
+            'peak_rss_mb': peak_rss_mb(),
+            'stages': stages,
+            **info,
+        }
+        if self.cprofile is not None:
+            stats = pstats.Stats(self.cprofile)
+            functions = sorted(stats.stats.items(), key=lambda item: -item[1][3])[:TOP]
+            report['cprofile'] = [
+                {'function': f"{name} ({filename.split('/')[-1]}:{line})", 'calls': calls, 'tottime': tottime,
+                 'cumtime': cumtime}
+                for (filename, line, name), (_, calls, tottime, cumtime, _) in functions]
+        if self.profiler == 'sample':
+            total = sum(self.samples.values())
+            report['samples'] = {
+                'interval': SAMPLE_INTERVAL,
+                'total': total,
+                'stacks': [{'stack': stack, 'count': count} for stack, count in self.samples.most_common(TOP)],
+            }
+        return report
+
+    def write(self, path, **info):
+        with open(path, 'w') as f:
+            json.dump(self.report(**info), f, indent=1)
+
+
+def profiled(function, *args):
+    """
+    function(*args) with the stages it runs recorded by a profiler of its own, for running in a worker process.
+    Returns (result, stage statistics), the statistics to be merged into the profiler of the main process.
+    """
+    profiler = Profiler().start()
+    try:
+        result = function(*args)
+    finally:
+        profiler.stop()
+    return result, profiler.stages
+
+
+@contextmanager
+def stage(name, rows=0):
+    """
+    Count the time spent in the with block towards the stage name of the active profiler (if any).
+    """
+    if ACTIVE is None:
+        yield
+        return
+    blocks = sys.getallocatedblocks()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        ACTIVE.record(name, time.perf_counter() - start, rows, sys.getallocatedblocks() - blocks)
+
+
+def timed(iterable, name):
+    """
+    Iterate over iterable, counting the time spent producing each item (and its length, as rows) towards the stage
+    name of the active profiler. Just the iterable itself when profiling is off.
+    """
+    if ACTIVE is None:
+        yield from iterable
+        return
+    iterator = iter(iterable)
+    while True:
+        blocks = sys.getallocatedblocks()
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        ACTIVE.record(name, time.perf_counter() - start, len(item) if hasattr(item, '__len__') else 1,
+                      sys.getallocatedblocks() - blocks)
+        yield item
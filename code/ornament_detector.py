@@ -0,0 +1,180 @@
+"""
+Ornament (extra click) detection from the ICIs, so codas of newly ingested recordings get an ornament flag without
+the hand curated ornaments.p.
+
+5-ornament compares the last two ICIs of each coda, (last ICI - penultimate ICI) / penultimate ICI, one row at a
+time, and finds it distributed differently for ornamented codas. On its own that ratio separates ornamented codas
+poorly, an ornament being an extra click added to a coda the whale also makes without it: as 5-ornament does when
+comparing ornamented codas to their neighbours, a coda is also checked for a coda of the same whale less than
+NEIGHBOUR_WINDOW seconds before or after it with one click less. Features of every coda are computed in one pass
+over the ICI matrix (the typed columns of coda_data.py):
+
+- last_ici, penultimate_ici and ratio = (last_ici - penultimate_ici) / penultimate_ici (NaN below 3 clicks)
+- relative_last: the last ICI over the mean of the other ICIs
+- shorter_neighbour: a coda of the same whale within NEIGHBOUR_WINDOW seconds has one click less
+
+A coda is flagged as ornamented when it has a shorter neighbour and its ratio is above the threshold. The threshold
+is fitted on the ornaments.p labels (the one with the best F1 score on a grid) and saved to
+../data/ornament_threshold.json, which the augmentation script reads with --detect-ornaments.
+
+    python ornament_detector.py --fit          # fit the threshold on ornaments.p, save it and print the agreement
+    python ornament_detector.py --output ornaments.npy
+"""
+
+import argparse
+import json
+import os
+import pickle
+
+import numpy as np
+
+from coda_data import DATA_DIR, DIALOGUES_CSV, RECORDING_NAME_LENGTH, iter_recordings, load_dialogues
+from coda_index import same_whale_neighbours
+
+
+ORNAMENT_JSON = os.path.join(DATA_DIR, 'ornament_threshold.json')
+ORNAMENTS_PICKLE = os.path.join(DATA_DIR, 'ornaments.p')
+
+# Fitted on ornaments.p (python ornament_detector.py --fit)
+DEFAULT_THRESHOLD = -0.01
+# Seconds between an ornamented coda and the same coda without the ornament (as in 5-ornament)
+NEIGHBOUR_WINDOW = 8
+THRESHOLD_GRID = np.round(np.arange(-1, 2, 0.01), 2)
+
+
+def ornament_features(icis, n_clicks, file_codes, whale_id, TsTo, window=NEIGHBOUR_WINDOW):
+    """
+    The features of every coda (see the module docstring), as a dict of arrays. Neighbours are looked for within
+    window seconds (np.inf for catalogs without times, TsTo being then just the order of the codas).
+    """
+    icis = np.asarray(icis, dtype=np.float64)
+    n_clicks = np.asarray(n_clicks)
+    TsTo = np.asarray(TsTo, dtype=np.float64)
+    rows = np.arange(len(n_clicks))
+    has_two = n_clicks >= 3
+
+    last = np.where(n_clicks >= 2, icis[rows, np.maximum(n_clicks - 2, 0)], np.nan)
+    penultimate = np.where(has_two, icis[rows, np.maximum(n_clicks - 3, 0)], np.nan)
+    others = np.where(has_two, (icis.sum(axis=1) - last) / np.maximum(n_clicks - 2, 1), np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = (last - penultimate) / penultimate
+        relative_last = last / others
+
+    next_ids, previous_ids = same_whale_neighbours(file_codes, whale_id, TsTo)
+    shorter_neighbour = np.zeros(len(n_clicks), dtype=bool)
+    for ids in [next_ids, previous_ids]:
+        j = np.maximum(ids, 0)
+        shorter_neighbour |= (ids >= 0) & (np.abs(TsTo[j] - TsTo) < window) & (n_clicks[j] == n_clicks - 1)
+
+    return {
+        'last_ici': last,
+        'penultimate_ici': penultimate,
+        'ratio': ratio,
+        'relative_last': relative_last,
+        'shorter_neighbour': shorter_neighbour,
+    }
+
+
+def detect_ornaments(features, threshold=DEFAULT_THRESHOLD):
+    """
+    Ornament flag of every coda (uint8, 1 if ornamented), as ornaments.p holds them.
+    """
+    with np.errstate(invalid='ignore'):
+        return (features['shorter_neighbour'] & (features['ratio'] > threshold)).astype(np.uint8)
+
+
+def scores(features, labels, thresholds=THRESHOLD_GRID):
+    """
+    (true positives, predicted positives, F1) of detect_ornaments at every threshold, against the labels.
+    Counted with binary searches over the sorted ratios of the candidate codas, not one detection per threshold.
+    """
+    labels = np.asarray(labels) == 1
+    candidates = features['shorter_neighbour'] & ~np.isnan(features['ratio'])
+    ratios = np.sort(features['ratio'][candidates])
+    labelled = np.sort(features['ratio'][candidates & labels])
+    predicted = len(ratios) - np.searchsorted(ratios, thresholds, side='right')
+    true_positives = len(labelled) - np.searchsorted(labelled, thresholds, side='right')
+    f1 = 2 * true_positives / np.maximum(predicted + labels.sum(), 1)
+    return true_positives, predicted, f1
+
+
+def fit_threshold(features, labels, thresholds=THRESHOLD_GRID):
+    """
+    The threshold of the grid with the best F1 score against the labels.
+    """
+    _, _, f1 = scores(features, labels, thresholds)
+    return float(thresholds[np.argmax(f1)])
+
+
+def save_threshold(threshold, path=ORNAMENT_JSON, **info):
+    with open(path, 'w') as f:
+        json.dump({'threshold': threshold, 'neighbour_window': NEIGHBOUR_WINDOW, **info}, f, indent=2)
+
+
+def load_threshold(path=ORNAMENT_JSON):
+    """
+    The threshold saved by save_threshold, or DEFAULT_THRESHOLD if there is no such file.
+    """
+    if not os.path.exists(path):
+        return DEFAULT_THRESHOLD
+    with open(path) as f:
+        return json.load(f)['threshold']
+
+
+def catalog_features(columns):
+    """
+    ornament_features of the typed columns of sperm-whale-dialogues.csv (coda_data.load_dialogues).
+    """
+    return ornament_features(columns['ICI'], columns['nClicks'], columns['File'], columns['Whale'],
+                             columns['TsTo'])
+
+
+def stream_ornaments(source, threshold=DEFAULT_THRESHOLD, chunksize=100000):
+    """
+    detect_ornaments of a coda csv too large to load whole, read in blocks of chunksize rows and handled one
+    recording (REC[:6]) at a time: the neighbours of a coda are in its recording, so the flags are the same as for
+    the whole catalog. Returns the flags of all the codas, in the order of the csv.
+    """
+    flags = []
+    for recording in iter_recordings(source, chunksize, key='REC', n_chars=RECORDING_NAME_LENGTH):
+        icis = recording[[c for c in recording.columns if c.startswith('ICI')]].to_numpy(dtype=np.float32)
+        features = ornament_features(icis, recording['nClicks'].to_numpy(), np.zeros(len(recording), dtype=int),
+                                     recording['Whale'].to_numpy(), recording['TsTo'].to_numpy())
+        flags.append(detect_ornaments(features, threshold))
+    return np.concatenate(flags) if flags else np.zeros(0, dtype=np.uint8)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--source', default=DIALOGUES_CSV, help='coda csv (sperm-whale-dialogues.csv format)')
+    parser.add_argument('--fit', action='store_true', help='fit the threshold on the labels and save it')
+    parser.add_argument('--labels', default=ORNAMENTS_PICKLE, help='ornament labels of the source (to fit / compare)')
+    parser.add_argument('--threshold', default=ORNAMENT_JSON, help='threshold file')
+    parser.add_argument('--output', default=None, help='save the flags to this .npy file')
+    args = parser.parse_args()
+
+    features = catalog_features(load_dialogues(args.source))
+    labels = None
+    if os.path.exists(args.labels):
+        labels = np.asarray(pickle.load(open(args.labels, "rb")))
+
+    if args.fit:
+        threshold = fit_threshold(features, labels)
+        save_threshold(threshold, args.threshold, source=os.path.basename(args.source))
+        print(f"Saved threshold {threshold} to {args.threshold}")
+    else:
+        threshold = load_threshold(args.threshold)
+
+    flags = detect_ornaments(features, threshold)
+    print(f"{flags.sum()} of {len(flags)} codas ornamented (ratio > {threshold} with a shorter neighbour)")
+    if labels is not None:
+        true_positives = int(np.sum((flags == 1) & (labels == 1)))
+        print(f"{true_positives} of the {int(labels.sum())} labelled ornaments found, "
+              f"{int(flags.sum()) - true_positives} other codas flagged, "
+              f"agreement {np.mean(flags == labels):.3f}")
+    if args.output is not None:
+        np.save(args.output, flags)
+
+
+if __name__ == '__main__':
+    main()
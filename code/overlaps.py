@@ -0,0 +1,132 @@
+"""
+Interval overlap index: every pair of codas of a recording whose [TsTo, TsTo + Duration] intervals overlap.
+
+interrupted(i) (augmentation script, 4-rubato) only compares coda i with row i + 1, and the dialogue script only
+puts two codas in a chorus when they are adjacent rows less than 0.5 s apart, so overlaps between three or more
+whales, or with a coda further down the rows, are missed. Here the intervals are sorted by (recording, start) and
+swept once: the codas overlapping interval i from the right are exactly those sorted after it whose start is at most
+its end, found with a binary search, so all k overlapping pairs come out in O(n log n + k) as two index arrays.
+
+Example:
+    first, second = overlapping_pairs(columns['File'], columns['TsTo'], columns['TsTo'] + columns['Duration'])
+    first, second = between_whales(first, second, columns['Whale'])      # interruptions
+    chorus = overlap_groups(columns['File'], columns['TsTo'], columns['TsTo'] + CHORUS_WINDOW, open_end=True)
+
+    python overlaps.py   # overlap statistics of sperm-whale-dialogues.csv
+"""
+
+import argparse
+
+import numpy as np
+
+from coda_data import DIALOGUES_CSV, load_dialogues
+
+
+# Codas starting less than this many seconds apart are said in chorus (dialogue script)
+CHORUS_WINDOW = 0.5
+
+
+def sorted_intervals(group, start):
+    """
+    The coda ids sorted by (group, start), and where each group starts and ends in that order.
+    """
+    group = np.asarray(group)
+    order = np.lexsort((np.asarray(start), group))
+    sorted_group = group[order]
+    new_group = np.flatnonzero(np.r_[True, sorted_group[1:] != sorted_group[:-1]])
+    return order, new_group, np.append(new_group[1:], len(order))
+
+
+def overlapping_pairs(group, start, end, open_end=False):
+    """
+    All pairs (first, second) of codas of the same group (recording) where second starts within the interval of
+    first: start[first] <= start[second] <= end[first] (< end[first] with open_end). first comes before second in
+    order of start time (row order for ties). Returns two int64 arrays of coda ids, sorted by first.
+    """
+    start = np.asarray(start, dtype=np.float64)
+    end = np.asarray(end, dtype=np.float64)
+    order, group_starts, group_ends = sorted_intervals(group, start)
+    sorted_start = start[order]
+
+    # position (in sorted order) past the last coda starting within each interval, one search per group
+    stop = np.empty(len(order), dtype=np.int64)
+    side = 'left' if open_end else 'right'
+    for a, b in zip(group_starts, group_ends):
+        stop[a:b] = a + np.searchsorted(sorted_start[a:b], end[order[a:b]], side=side)
+    counts = np.maximum(stop - np.arange(len(order)) - 1, 0)
+
+    first = np.repeat(np.arange(len(order)), counts)
+    offsets = np.arange(len(first)) - np.repeat(np.cumsum(counts) - counts, counts)
+    second = first + 1 + offsets
+    return order[first], order[second]
+
+
+def between_whales(first, second, whale_id):
+    """
+    Keep only the pairs of codas of different whales.
+    """
+    whale_id = np.asarray(whale_id)
+    different = whale_id[first] != whale_id[second]
+    return first[different], second[different]
+
+
+def first_overlapping(first, second, n):
+    """
+    For each of the n codas, the earliest coda starting within its interval, -1 if there is none (what interrupted()
+    returns, but not limited to the next row).
+    """
+    result = np.full(n, -1, dtype=np.int64)
+    # pairs are sorted by first, and by start of second within each first, so the first entry of each is the earliest
+    is_first = np.r_[True, first[1:] != first[:-1]] if len(first) else np.zeros(0, dtype=bool)
+    result[first[is_first]] = second[is_first]
+    return result
+
+
+def overlap_groups(group, start, end, open_end=False):
+    """
+    Group id of every coda, codas being in the same group when they are linked by a chain of overlapping intervals
+    within a recording (e.g. a chorus of several whales). Groups are numbered in order of (recording, start).
+    """
+    start = np.asarray(start, dtype=np.float64)
+    end = np.asarray(end, dtype=np.float64)
+    order, group_starts, group_ends = sorted_intervals(group, start)
+
+    # a coda opens a new group when it starts after the end of every earlier interval of its recording
+    reach = np.empty(len(order))
+    for a, b in zip(group_starts, group_ends):
+        reach[a:b] = np.maximum.accumulate(end[order[a:b]])
+    sorted_start = start[order]
+    if open_end:
+        new = np.r_[True, sorted_start[1:] >= reach[:-1]]
+    else:
+        new = np.r_[True, sorted_start[1:] > reach[:-1]]
+    new[group_starts] = True
+
+    ids = np.empty(len(order), dtype=np.int64)
+    ids[order] = np.cumsum(new) - 1
+    return ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--source', default=DIALOGUES_CSV, help='coda csv (sperm-whale-dialogues.csv format)')
+    args = parser.parse_args()
+
+    columns = load_dialogues(args.source)
+    file_codes = columns['File']
+    ts_to = columns['TsTo']
+    whale_id = columns['Whale']
+
+    first, second = overlapping_pairs(file_codes, ts_to, ts_to + columns['Duration'])
+    first, second = between_whales(first, second, whale_id)
+    adjacent = np.count_nonzero(second == first + 1)
+    print(f"{len(first)} overlapping pairs of codas of different whales, {len(first) - adjacent} not on adjacent rows")
+
+    chorus = overlap_groups(file_codes, ts_to, ts_to + CHORUS_WINDOW, open_end=True)
+    # number of distinct whales in each group
+    num_whales = np.bincount(np.unique(np.stack([chorus, whale_id], axis=1), axis=0)[:, 0])
+    print(f"{np.count_nonzero(num_whales > 1)} choruses, {np.count_nonzero(num_whales > 2)} of three or more whales")
+
+
+if __name__ == '__main__':
+    main()
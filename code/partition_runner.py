@@ -0,0 +1,232 @@
+"""
+Tempo, rhythm, rubato and ornament analyses of every partition of DominicaCodas.csv (by clan and unit, or year), in
+a process pool, collected into one table.
+
+2-tempo and 3-rhythm keep the EC1 codas with python loops, so checking the findings for another clan, unit or year
+means editing and re-running each notebook. Here the catalog is parsed once into the typed column cache of
+coda_data.py (and the click matrix of click_times.py), and each worker process memory maps those .npy files: the
+columns sit once in the page cache, shared by all the workers, and nothing is copied or pickled per partition but
+its position in a sorted order of the codas. The codas are sorted once by the partition keys, so each partition is a
+contiguous slice of that order instead of a rescan of the catalog.
+
+For each partition (and the whole catalog, on the first row):
+    tempo      the tempo boundaries of the durations (tempo_model.py, the 4 deepest density minima)
+    rhythm     the number of rhythms, the most common one and its share, and the mean distance of the rhythm means to
+               the ones of the whole catalog (rhythm_types.py)
+    rubato     duration deltas between consecutive codas of the same identified whale (IDN) on the same day, of the
+               same rhythm and tempo (rubato.py), their quartiles and the share within the rubato thresholds.
+               DominicaCodas.csv has no times, so there is no maximum gap between the codas.
+    ornament   the median ratio of the last two ICIs and the share of codas flagged by ornament_detector.py, again
+               with neighbours taken among consecutive codas of the same whale on the same day
+
+    python partition_runner.py                              # by clan and unit
+    python partition_runner.py --by Clan Year --workers 4 --output partitions.csv
+"""
+
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from click_times import CLICK_CACHE_DIR, load_click_matrix
+from coda_data import CACHE_DIR, DOMINICA_CSV, load_dominica
+from coda_index import same_whale_neighbours
+from ornament_detector import DEFAULT_THRESHOLD, detect_ornaments, ornament_features
+from rhythm_types import CODA_TYPE_RHYTHMS, rhythm_types
+from rubato import DEFAULT_THRESHOLDS, durations_without_ornament, fit_thresholds, load_thresholds, rubato_deltas
+from tempo_model import DEFAULT_BOUNDARIES, assign_tempos, fit_boundaries
+
+
+NUM_TEMPOS = len(DEFAULT_BOUNDARIES) + 1
+PARTITION_KEYS = ['Clan', 'Unit', 'Year']
+
+# The catalog as seen by a worker process, set by init_worker
+CATALOG = {}
+
+
+def partition_key(columns, name):
+    """
+    (codes, categories) of a partition key. Year comes from the dd/mm/yyyy dates.
+    """
+    if name == 'Year':
+        years, remap = np.unique(np.array([date[-4:] for date in columns['Date_categories']]), return_inverse=True)
+        return remap[columns['Date']], years
+    return np.asarray(columns[name]), columns[name + '_categories']
+
+
+def partitions(columns, keys):
+    """
+    The codas sorted by the keys, and the partitions as (labels, start, stop) slices of that order.
+    """
+    codes = [partition_key(columns, name) for name in keys]
+    order = np.lexsort([c for c, _ in codes[::-1]])
+    sorted_codes = np.stack([c[order] for c, _ in codes])
+    starts = np.flatnonzero(np.r_[True, (sorted_codes[:, 1:] != sorted_codes[:, :-1]).any(axis=0)])
+    stops = np.r_[starts[1:], len(order)]
+    labels = [tuple(str(categories[sorted_codes[k, start]]) for k, (_, categories) in enumerate(codes))
+              for start in starts]
+    return order, list(zip(labels, starts, stops))
+
+
+def whale_ids(columns, rows):
+    """
+    The IDN code of each coda, unidentified whales (IDN 0) each getting an id of their own, so they never are the
+    same whale as another coda.
+    """
+    unknown = np.searchsorted(columns['IDN_categories'], '0')
+    idn = np.asarray(columns['IDN'])[rows]
+    return np.where(idn == unknown, -1 - np.arange(len(rows)), idn)
+
+
+def partition_ornaments(columns, rows):
+    """
+    Ornament features and flags of the codas rows (in catalog order), neighbours on the same day.
+    """
+    features = ornament_features(columns['ICI'][rows], columns['nClicks'][rows], columns['Date'][rows],
+                                 whale_ids(columns, rows), np.arange(len(rows)), window=np.inf)
+    return features, detect_ornaments(features, CATALOG['ornament_threshold'])
+
+
+def analyse_tempo(columns, clicks, rows):
+    boundaries = fit_boundaries(columns['Duration'][rows], num_tempos=NUM_TEMPOS)
+    return {f'tempo_boundary_{k + 1}': boundaries[k] if k < len(boundaries) else np.nan
+            for k in range(NUM_TEMPOS - 1)}
+
+
+def analyse_rhythm(columns, clicks, rows):
+    result = rhythm_types(columns, clicks, rows=rows)
+    reference = CATALOG['reference_rhythms']
+    counts = result['rhythm_counts']
+    if len(counts) == 0:
+        return {'rhythms': 0, 'top_rhythm': -1, 'top_rhythm_share': np.nan, 'rhythm_distance': np.nan}
+
+    # mean absolute difference of the click positions, over the rhythms with the same number of clicks as overall
+    shared = np.isin(result['rhythm_ids'], reference['rhythm_ids'])
+    k = np.searchsorted(reference['rhythm_ids'], result['rhythm_ids'][shared])
+    same_length = result['rhythm_n_clicks'][shared] == reference['rhythm_n_clicks'][k]
+    differences = np.abs(result['rhythm_means'][shared][same_length] - reference['rhythm_means'][k[same_length]])
+    return {
+        'rhythms': len(counts),
+        'top_rhythm': int(result['rhythm_ids'][np.argmax(counts)]),
+        'top_rhythm_share': counts.max() / counts.sum(),
+        'rhythm_distance': np.nanmean(differences) if same_length.any() else np.nan,
+    }
+
+
+def analyse_rubato(columns, clicks, rows):
+    _, ornamented = partition_ornaments(columns, rows)
+    _, previous_ids = same_whale_neighbours(columns['Date'][rows], whale_ids(columns, rows))
+    durations = durations_without_ornament(clicks['click_times'][rows], clicks['n_clicks'][rows], ornamented)
+    rhythms = CATALOG['type_rhythm'][columns['CodaType'][rows]]
+    tempos = assign_tempos(columns['Duration'][rows])
+    previous_ids = np.where(rhythms >= 0, previous_ids, -1)
+    deltas = rubato_deltas(previous_ids, np.zeros(len(rows)), durations, rhythms, tempos)
+    deltas = deltas[~np.isnan(deltas)]
+    if len(deltas) == 0:
+        return {'rubato_pairs': 0, 'rubato_q25': np.nan, 'rubato_q75': np.nan, 'rubato_constant_share': np.nan}
+    q25, q75 = fit_thresholds(deltas)
+    low, high = CATALOG['rubato_thresholds']
+    return {
+        'rubato_pairs': len(deltas),
+        'rubato_q25': q25,
+        'rubato_q75': q75,
+        'rubato_constant_share': np.mean((deltas >= low) & (deltas < high)),
+    }
+
+
+def analyse_ornament(columns, clicks, rows):
+    features, flags = partition_ornaments(columns, rows)
+    ratio = features['ratio'][~np.isnan(features['ratio'])]
+    return {
+        'ornament_ratio_median': np.median(ratio) if len(ratio) else np.nan,
+        'ornament_share': flags.mean(),
+    }
+
+
+ANALYSES = {
+    'tempo': analyse_tempo,
+    'rhythm': analyse_rhythm,
+    'rubato': analyse_rubato,
+    'ornament': analyse_ornament,
+}
+
+
+def init_worker(source, cache_dir, click_cache_dir, order, ornament_threshold=DEFAULT_THRESHOLD,
+                rubato_thresholds=DEFAULT_THRESHOLDS):
+    """
+    Memory map the cached catalog in this process (nothing is read until used) and precompute what every partition
+    compares to.
+    """
+    columns = load_dominica(source, cache_dir=cache_dir)
+    clicks = load_click_matrix(source, load_dominica, click_cache_dir)
+    CATALOG.update(
+        columns=columns,
+        clicks=clicks,
+        order=order,
+        ornament_threshold=ornament_threshold,
+        rubato_thresholds=rubato_thresholds,
+        type_rhythm=np.array([CODA_TYPE_RHYTHMS.get(t, -1) for t in columns['CodaType_categories']]),
+        reference_rhythms=rhythm_types(columns, clicks),
+    )
+
+
+def run_partition(task):
+    """
+    The analyses of one partition (labels, start, stop of the sorted order), as a row of the table.
+    """
+    labels, start, stop, analyses = task
+    columns, clicks = CATALOG['columns'], CATALOG['clicks']
+    rows = np.sort(CATALOG['order'][start:stop])
+    row = dict(labels, codas=len(rows))
+    for name in analyses:
+        row.update(ANALYSES[name](columns, clicks, rows))
+    return row
+
+
+def run(source=DOMINICA_CSV, keys=('Clan', 'Unit'), analyses=tuple(ANALYSES), workers=1, cache_dir=CACHE_DIR,
+        click_cache_dir=CLICK_CACHE_DIR, ornament_threshold=DEFAULT_THRESHOLD, rubato_thresholds=DEFAULT_THRESHOLDS):
+    """
+    The table of the analyses of the whole catalog and of every partition by keys, one row each.
+    """
+    # parse into the caches once here, the workers only map them
+    columns = load_dominica(source, cache_dir=cache_dir)
+    load_click_matrix(source, load_dominica, click_cache_dir)
+    order, slices = partitions(columns, list(keys))
+
+    everything = {name: 'all' for name in keys}
+    tasks = [(everything, 0, len(order), analyses)] + \
+            [(dict(zip(keys, labels)), start, stop, analyses) for labels, start, stop in slices]
+    initargs = (source, cache_dir, click_cache_dir, order, ornament_threshold, rubato_thresholds)
+    if workers <= 1:
+        init_worker(*initargs)
+        rows = [run_partition(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=initargs) as pool:
+            rows = list(pool.map(run_partition, tasks))
+    return pd.DataFrame(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--source', default=DOMINICA_CSV, help='coda csv (DominicaCodas.csv format)')
+    parser.add_argument('--by', nargs='+', choices=PARTITION_KEYS, default=['Clan', 'Unit'])
+    parser.add_argument('--analyses', nargs='+', choices=list(ANALYSES), default=list(ANALYSES))
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('--output', default=None, help='also save the table to this csv file')
+    parser.add_argument('--rubato-thresholds', default=None,
+                        help='rubato thresholds fitted by rubato.py (../data/rubato_thresholds.json), '
+                             'instead of the original ones')
+    args = parser.parse_args()
+
+    thresholds = DEFAULT_THRESHOLDS if args.rubato_thresholds is None else load_thresholds(args.rubato_thresholds)
+    table = run(args.source, args.by, args.analyses, args.workers, rubato_thresholds=thresholds)
+    with pd.option_context('display.width', 200, 'display.max_columns', None, 'display.precision', 3):
+        print(table.to_string(index=False))
+    if args.output is not None:
+        table.to_csv(args.output, index=False)
+
+
+if __name__ == '__main__':
+    main()
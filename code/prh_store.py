@@ -0,0 +1,212 @@
+"""
+Behavioral (PRH) sensor store: pitch, roll and heading of the tagged whale, for looking up its posture at the time
+of each coda.
+
+The behaviour cell of 4-rubato reloads the PRH .mat file of a recording with scipy.io.loadmat every time the
+recording changes, inside a loop over 14 window offsets w, and reads A[int((tsto - w) * fs)] one coda at a time.
+Here each .mat file is converted once into a memory mapped (samples, channels) array plus its sampling rate, cached
+next to the typed coda columns (coda_data.load_columns, keyed by the hash of the .mat file). A lookup takes the
+recording and time of all codas and all the window offsets at once and returns the (codas, windows, channels)
+tensor of sensor readings, and batch_spearman correlates a variable with every (window, channel) of it in one go.
+
+The PRH files are available from the authors upon request (../data/PRH_all/PRH, as in 4-rubato). Without them,
+write_synthetic_prh makes .mat files of the same layout for the recordings of the catalog:
+
+    python prh_store.py               # rubato of whale 1 against pitch, roll and heading, as in 4-rubato
+    python prh_store.py --synthetic   # same, on synthetic PRH files
+"""
+
+import argparse
+import os
+import tempfile
+
+import numpy as np
+from scipy.io import loadmat, savemat
+from scipy.stats import rankdata, t as t_distribution
+
+from coda_data import CACHE_DIR, DATA_DIR, DIALOGUES_CSV, categorical_values, load_columns, load_dialogues
+from coda_index import same_whale_neighbours
+
+
+PRH_DIR = os.path.join(DATA_DIR, 'PRH_all', 'PRH')
+PRH_CACHE_DIR = os.path.join(CACHE_DIR, 'prh')
+
+CHANNELS = ('pitch', 'roll', 'head')
+
+# Offsets (seconds) before the start of a coda at which the sensors are read (4-rubato)
+WINDOWS = (0, 0.25, 0.5, 0.75, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10)
+
+# Consecutive codas further apart than this (seconds) are not paired for the rubato (4-rubato)
+MAX_GAP = 10
+
+
+def recording_of_prh(path):
+    """
+    The recording (REC[:6], e.g. sw061b) a PRH file belongs to, from characters 5 to 9 of its name.
+    """
+    return 'sw' + os.path.basename(path)[5:9]
+
+
+def parse_prh(path, channels=CHANNELS):
+    """
+    Read a PRH .mat file into {'sensors': (samples, channels) float64, 'fs': sampling rate (Hz)}.
+    """
+    x = loadmat(path)
+    return {
+        'sensors': np.concatenate([np.asarray(x[c], dtype=np.float64).reshape(len(x[c]), -1) for c in channels], 1),
+        'fs': np.asarray(x['fs'], dtype=np.float64).reshape(-1)[:1],
+    }
+
+
+class SensorStore:
+    """
+    The PRH files of a folder, by recording. Each file is converted on first use and memory mapped afterwards.
+    When a recording has several files, the first in name order is used. 4-rubato takes the first one os.listdir
+    lists, an order that depends on the file system, so the two only agree when there is a single file.
+    """
+
+    def __init__(self, folder=PRH_DIR, cache_dir=PRH_CACHE_DIR):
+        if not os.path.isdir(folder):
+            raise FileNotFoundError(f"No PRH folder {folder} (the PRH files are available from the authors upon "
+                                    f"request, or use --synthetic)")
+        self.cache_dir = cache_dir
+        self.paths = {}
+        for file_name in sorted(f for f in os.listdir(folder) if f.endswith('.mat')):
+            self.paths.setdefault(recording_of_prh(file_name), os.path.join(folder, file_name))
+        self.arrays = {}
+
+    def __contains__(self, recording):
+        return recording in self.paths
+
+    def __getitem__(self, recording):
+        if recording not in self.arrays:
+            self.arrays[recording] = load_columns(self.paths[recording], parse_prh, self.cache_dir)
+        return self.arrays[recording]
+
+    def lookup(self, recordings, times, windows=WINDOWS):
+        """
+        Sensor readings at times - w for every coda (recording name and time) and window offset w, as a
+        (codas, windows, channels) float64 tensor: A[int((t - w) * fs)] of 4-rubato. NaN for codas of recordings
+        without a PRH file, or when t - w falls outside the recording.
+        """
+        recordings = np.asarray(recordings)
+        times = np.asarray(times, dtype=np.float64)
+        windows = np.asarray(windows, dtype=np.float64)
+        result = np.full((len(times), len(windows), len(CHANNELS)), np.nan)
+
+        names, inverse = np.unique(recordings, return_inverse=True)
+        for r, name in enumerate(names):
+            if name not in self:
+                continue
+            arrays = self[name]
+            sensors = arrays['sensors']
+            codas = np.flatnonzero(inverse == r)
+            # int() of 4-rubato truncates towards zero
+            samples = np.trunc((times[codas, None] - windows[None, :]) * arrays['fs'][0]).astype(np.int64)
+            inside = (samples >= 0) & (samples < len(sensors))
+            readings = np.full(samples.shape + (sensors.shape[1],), np.nan)
+            readings[inside] = sensors[samples[inside]]
+            result[codas] = readings
+        return result
+
+
+def batch_spearman(x, y):
+    """
+    Spearman correlation of x (n,) with every column y[:, ...] of y (n, ...), and its two sided p-value (from the
+    t distribution, as scipy.stats.spearmanr). Each column is correlated over its own rows where neither x nor it is
+    NaN, as spearmanr of that column alone with nan_policy='omit'.
+    Returns (coefficients, p_values), both of shape y.shape[1:].
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    flat = y.reshape(len(y), -1)
+    valid = ~np.isnan(x)[:, None] & ~np.isnan(flat)
+    n = valid.sum(axis=0)
+
+    # ranks within each column's valid rows, NaN elsewhere
+    rx = rankdata(np.where(valid, x[:, None], np.nan), axis=0, nan_policy='omit')
+    ry = rankdata(np.where(valid, flat, np.nan), axis=0, nan_policy='omit')
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rx = np.where(valid, rx - np.nanmean(rx, axis=0), 0)
+        ry = np.where(valid, ry - np.nanmean(ry, axis=0), 0)
+        coefficients = (rx * ry).sum(axis=0) / np.sqrt((rx * rx).sum(axis=0) * (ry * ry).sum(axis=0))
+        coefficients = np.clip(coefficients, -1, 1)
+        statistic = coefficients * np.sqrt((n - 2) / ((1 - coefficients) * (1 + coefficients)))
+    p_values = 2 * t_distribution.sf(np.abs(statistic), n - 2)
+    return coefficients.reshape(y.shape[1:]), p_values.reshape(y.shape[1:])
+
+
+def rubato_pairs(columns, whale=1, max_gap=MAX_GAP):
+    """
+    The pairs of 4-rubato: each coda of the whale and the next coda of the same whale in the same recording (in row
+    order), when it starts less than max_gap seconds later. Returns (current, next) coda ids.
+    """
+    next_ids, _ = same_whale_neighbours(columns['File'], columns['Whale'])
+    ts_to = np.asarray(columns['TsTo'])
+    current = np.flatnonzero((np.asarray(columns['Whale']) == whale) & (next_ids >= 0))
+    nex = next_ids[current]
+    close = ts_to[nex] - ts_to[current] < max_gap
+    return current[close], nex[close]
+
+
+def rubato_behaviour(columns, store, whale=1, windows=WINDOWS, max_gap=MAX_GAP):
+    """
+    Spearman correlation of the rubato (duration of the next coda - duration of the current one) with the sensor
+    readings at the start of the next coda, for every window offset and channel. Returns (coefficients, p_values,
+    number of pairs), coefficients and p_values of shape (windows, channels).
+    """
+    current, nex = rubato_pairs(columns, whale, max_gap)
+    durations = np.asarray(columns['Duration'])
+    rho = durations[nex] - durations[current]
+    sensors = store.lookup(categorical_values(columns, 'File')[nex], np.asarray(columns['TsTo'])[nex], windows)
+    coefficients, p_values = batch_spearman(rho, sensors)
+    return coefficients, p_values, len(rho)
+
+
+def write_synthetic_prh(folder, recordings, durations, fs=5.0, seed=0):
+    """
+    Write a PRH .mat file (fs, pitch, roll and head as column vectors) of random smooth readings for each
+    recording, durations[i] seconds long, named so that recording_of_prh maps it back to its recording.
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    for recording, duration in zip(recordings, durations):
+        n = int(np.ceil(duration * fs)) + 1
+        # random walks, a posture changing slowly over time
+        readings = np.cumsum(rng.normal(scale=0.01, size=(n, len(CHANNELS))), axis=0)
+        path = os.path.join(folder, f"prh__{recording[2:6]}.mat")
+        savemat(path, {'fs': np.array([[fs]]), **{c: readings[:, [k]] for k, c in enumerate(CHANNELS)}})
+        paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--source', default=DIALOGUES_CSV, help='coda csv (sperm-whale-dialogues.csv format)')
+    parser.add_argument('--prh-dir', default=PRH_DIR, help='folder of the PRH .mat files')
+    parser.add_argument('--synthetic', action='store_true', help='use synthetic PRH files instead')
+    parser.add_argument('--whale', type=int, default=1)
+    args = parser.parse_args()
+
+    columns = load_dialogues(args.source)
+    with tempfile.TemporaryDirectory() as folder:
+        cache_dir = PRH_CACHE_DIR
+        if args.synthetic:
+            recordings = columns['File_categories']
+            durations = np.zeros(len(recordings))
+            np.maximum.at(durations, columns['File'], np.asarray(columns['TsTo']) + columns['Duration'])
+            write_synthetic_prh(folder, recordings, durations + max(WINDOWS))
+            args.prh_dir = folder
+            cache_dir = os.path.join(folder, 'cache')
+
+        store = SensorStore(args.prh_dir, cache_dir)
+        coefficients, p_values, n = rubato_behaviour(columns, store, args.whale)
+
+    print(f"Rubato of whale {args.whale} against {', '.join(CHANNELS)} ({n} pairs)")
+    for w, coefficient, p in zip(WINDOWS, coefficients, p_values):
+        print(f"window {w:>5}: " + "  ".join(f"{c} {r:+.4f} (p={q:.4f})" for c, r, q in zip(CHANNELS, coefficient, p)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""
+Batched permutation and bootstrap tests.
+
+The null hypotheses of notebooks 4-rubato and 5-ornament are run as 10,000 iteration python loops (random.randint per
+element, random.shuffle plus a mean per iteration), and compute_quantile sorts the null distribution and scans it.
+Here all the resamples of a chunk are drawn at once as an index matrix (one row per resample) with a seeded numpy
+Generator, the statistic is computed on the whole matrix, and p-values come from a searchsorted on the sorted null
+distribution. Chunks are sized to stay within max_bytes of memory and can be spread over several processes. Each
+chunk gets its own seed spawned from the main seed, so the result is the same whatever the number of workers.
+
+Example (tempo drift of 4-rubato, against durations drawn from codas of the same rhythm and tempo):
+    null = bucket_null(drift_durations, drift_keys, all_durations, all_keys, n_resamples=100000, seed=0)
+    compute_quantile(np.mean(np.abs(difference_of_times)), null)
+
+Example (ornament test of 5-ornament, difference of the means of two groups):
+    null = permutation_null(mse_neighbour, mse_self, n_resamples=100000, seed=0)
+    1 - compute_quantile(t_obs, null)
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+
+
+# Upper bound on the memory used by the index matrix of one chunk of resamples
+MAX_BYTES = 64 * 2**20
+
+
+def chunk_sizes(n_resamples, n_per_resample, max_bytes=MAX_BYTES):
+    """
+    Split n_resamples in chunks whose (chunk, n_per_resample) int64 index matrix fits in max_bytes.
+    """
+    size = max(1, min(n_resamples, max_bytes // (8 * max(1, n_per_resample))))
+    sizes = [size] * (n_resamples // size)
+    if n_resamples % size:
+        sizes.append(n_resamples % size)
+    return sizes
+
+
+def resample(statistic, n_resamples, n_per_resample, seed=0, workers=1, max_bytes=MAX_BYTES):
+    """
+    The null distribution of n_resamples statistics. statistic(rng, size) draws size resamples with the
+    numpy Generator rng and returns their statistics as an array. It must be picklable (a module level function or
+    a functools.partial of one) to run over several worker processes.
+    """
+    sizes = chunk_sizes(n_resamples, n_per_resample, max_bytes)
+    rngs = [np.random.default_rng(s) for s in np.random.SeedSequence(seed).spawn(len(sizes))]
+    if workers <= 1:
+        return np.concatenate([statistic(rng, size) for rng, size in zip(rngs, sizes)])
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return np.concatenate(list(pool.map(statistic, rngs, sizes)))
+
+
+def _bucket_statistic(rng, size, reference, offsets, counts, pool_values):
+    """
+    mean(|reference - draw|) for size resamples, each draw coming from the pool of the reference's bucket.
+    offsets / counts give where the bucket of each reference starts in pool_values and how many values it holds.
+    """
+    draws = offsets + (rng.random((size, len(reference))) * counts).astype(np.int64)
+    return np.mean(np.abs(reference - pool_values[draws]), axis=1)
+
+
+def bucket_null(reference, reference_keys, pool_values, pool_keys, n_resamples=10000, seed=0, workers=1,
+                max_bytes=MAX_BYTES):
+    """
+    Null distribution of mean(|reference - draw|), where each draw is picked uniformly from the pool values sharing
+    the reference's key (e.g. the durations of all codas of the same f"{rhythm}-{tempo}" bucket).
+    Every reference key must appear among the pool keys.
+    """
+    reference = np.asarray(reference, dtype=np.float64)
+    pool_values = np.asarray(pool_values, dtype=np.float64)
+    pool_keys = np.asarray(pool_keys)
+
+    # group the pool by key, so each bucket is a contiguous range of the sorted values
+    order = np.argsort(pool_keys, kind='stable')
+    keys, starts, counts = np.unique(pool_keys[order], return_index=True, return_counts=True)
+    bucket = np.searchsorted(keys, np.asarray(reference_keys))
+    assert np.all(keys[np.minimum(bucket, len(keys) - 1)] == reference_keys), "reference key missing from the pool"
+
+    statistic = partial(_bucket_statistic, reference=reference, offsets=starts[bucket], counts=counts[bucket],
+                        pool_values=pool_values[order])
+    return resample(statistic, n_resamples, len(reference), seed, workers, max_bytes)
+
+
+def _permutation_statistic(rng, size, values, n_x):
+    """
+    mean(y) - mean(x) for size random splits of values into x (n_x values) and y (the rest).
+    """
+    shuffled = rng.permuted(np.broadcast_to(values, (size, len(values))), axis=1)
+    return shuffled[:, n_x:].mean(axis=1) - shuffled[:, :n_x].mean(axis=1)
+
+
+def permutation_null(x, y, n_resamples=10000, seed=0, workers=1, max_bytes=MAX_BYTES):
+    """
+    Null distribution of mean(y) - mean(x) when the labels of the pooled values are shuffled.
+    """
+    values = np.concatenate([np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)])
+    statistic = partial(_permutation_statistic, values=values, n_x=len(x))
+    return resample(statistic, n_resamples, len(values), seed, workers, max_bytes)
+
+
+def compute_quantile(value, data):
+    """
+    Same as compute_quantile of the notebooks: (position + 1) / len(data), where position is the index of the first
+    sorted value >= value (len(data) if there is none). Found with a binary search instead of a linear scan.
+    """
+    sorted_data = np.sort(np.asarray(data))
+    position = np.searchsorted(sorted_data, value, side='left')
+    return (position + 1) / len(sorted_data)
+
+
+def p_value(observed, null, alternative='greater'):
+    """
+    Monte Carlo p-value of the observed statistic against its null distribution, (count + 1) / (n + 1) where count
+    is the number of null statistics at least as extreme ('greater', 'less' or 'two-sided').
+    """
+    sorted_null = np.sort(np.asarray(null))
+    n = len(sorted_null)
+    greater = n - np.searchsorted(sorted_null, observed, side='left')
+    less = np.searchsorted(sorted_null, observed, side='right')
+    if alternative == 'greater':
+        count = greater
+    elif alternative == 'less':
+        count = less
+    else:
+        count = min(2 * min(greater, less), n)
+    return (count + 1) / (n + 1)
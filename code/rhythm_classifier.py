@@ -0,0 +1,92 @@
+"""
+Nearest mean coda classifier: assigns each coda to the rhythm whose mean coda (mean_codas.p) is closest.
+
+In 5-ornament every coda loops over all of mean_codas, computes an MSE only for the mean codas with the same number
+of clicks and keeps the minimum. Here the mean codas are grouped by number of clicks into one matrix per click count,
+and all the codas of a given click count are compared to all the mean codas of that count in one broadcasted
+operation (in chunks of codas, to bound memory). Codas are described by their relative click positions
+(t_k - t_1) / (t_n - t_1), as in return_relative of the notebooks, read from the cached click matrix of
+click_times.py when labelling a whole catalog.
+
+Example:
+    cluster_ids, distances = classify(columns['ICI'], columns['nClicks'], load_mean_codas())
+
+    python rhythm_classifier.py   # rhythm of every coda of sperm-whale-dialogues.csv
+"""
+
+import argparse
+import os
+import pickle
+
+import numpy as np
+
+from click_times import load_click_matrix, relative_click_positions
+from coda_data import DATA_DIR, DIALOGUES_CSV
+
+
+MEAN_CODAS_PICKLE = os.path.join(DATA_DIR, 'mean_codas.p')
+
+# Number of codas compared at once (the distance matrix of a chunk is chunk_size x number of mean codas)
+CHUNK_SIZE = 100000
+
+
+def load_mean_codas(path=MEAN_CODAS_PICKLE):
+    return pickle.load(open(path, "rb"))
+
+
+def bucket_centroids(mean_codas):
+    """
+    Group the mean codas by length (number of clicks): {length: (cluster ids, (k, length) matrix of mean codas)}.
+    """
+    buckets = {}
+    for length in sorted({len(coda) for coda in mean_codas}):
+        ids = np.array([j for j, coda in enumerate(mean_codas) if len(coda) == length])
+        buckets[length] = (ids, np.array([mean_codas[j] for j in ids], dtype=np.float64))
+    return buckets
+
+
+def classify_positions(positions, n_clicks, mean_codas, chunk_size=CHUNK_SIZE):
+    """
+    Nearest mean coda of each coda given its relative click positions (see click_times.py).
+    Returns (cluster_ids, distances): the index in mean_codas and the MSE to it, -1 and NaN for codas with no mean
+    coda of the same number of clicks (or of zero duration).
+    """
+    n_clicks = np.asarray(n_clicks)
+    cluster_ids = np.full(len(n_clicks), -1, dtype=np.int64)
+    distances = np.full(len(n_clicks), np.nan)
+
+    for length, (ids, centroids) in bucket_centroids(mean_codas).items():
+        codas = np.flatnonzero(n_clicks == length)
+        for start in range(0, len(codas), chunk_size):
+            chunk = codas[start:start + chunk_size]
+            mse = np.mean((positions[chunk, None, :length] - centroids[None, :, :]) ** 2, axis=2)
+            valid = ~np.isnan(mse).any(axis=1)
+            best = np.argmin(np.where(np.isnan(mse), np.inf, mse), axis=1)
+            cluster_ids[chunk[valid]] = ids[best[valid]]
+            distances[chunk[valid]] = mse[valid, best[valid]]
+    return cluster_ids, distances
+
+
+def classify(icis, n_clicks, mean_codas, chunk_size=CHUNK_SIZE):
+    """
+    Nearest mean coda of each coda given its ICIs and number of clicks. Pass n_clicks - 1 to leave out the
+    ornament click of ornamented codas, as 5-ornament does.
+    """
+    return classify_positions(relative_click_positions(icis, n_clicks), n_clicks, mean_codas, chunk_size)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--source', default=DIALOGUES_CSV, help='coda csv (sperm-whale-dialogues.csv format)')
+    parser.add_argument('--destination', default=None, help='save the cluster ids and distances to this .npz file')
+    args = parser.parse_args()
+
+    clicks = load_click_matrix(args.source)
+    cluster_ids, distances = classify_positions(clicks['positions'], clicks['n_clicks'], load_mean_codas())
+    print(f"Assigned a rhythm to {np.count_nonzero(cluster_ids >= 0)} of {len(cluster_ids)} codas")
+    if args.destination is not None:
+        np.savez(args.destination, cluster_ids=cluster_ids, distances=distances)
+
+
+if __name__ == '__main__':
+    main()
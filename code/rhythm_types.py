@@ -0,0 +1,209 @@
+"""
+Mean coda of each coda type and rhythm, from DominicaCodas.csv.
+
+3-rhythm builds mean_codas by looping over every coda type and rescanning the whole csv for each one, only keeping
+codas with the same length as the last one appended. Here the relative click positions of every coda (cached click
+matrix of click_times.py) are summed per (coda type, number of clicks) group in a single pass, which gives the mean,
+variance and count of each group. Each coda type keeps its most common number of clicks, and the rhythms pool the
+coda types they are made of (CODA_TYPE_RHYTHMS, the "rhythm" dict of 3-rhythm; NOISE types have rhythm -1).
+
+Pooling differs from 3-rhythm for the rhythms of several coda types (1+31/1+32, 4R1/4R2, 5R1-3, 7D1/7D2, 8D/8R):
+3-rhythm averages a single one of them, the first met in the iteration order of a set, so the pooled means are
+not those of mean_codas.p (rhythm 4: [0, .552, .790, 1] pooled, [0, .476, .752, 1] from 1+31 alone). With
+--mean-codas-types (MEAN_CODAS_TYPES, the coda types mean_codas.p was made from) each rhythm only averages the
+given coda types, which reproduces mean_codas.p.
+
+The result is saved as a versioned .npz artifact (see save_rhythm_types for its contents), regenerated with:
+
+    python rhythm_types.py                        # codas of the EC1 clan, as in 3-rhythm
+    python rhythm_types.py --clans EC1 EC2 --units A F
+    python rhythm_types.py --mean-codas-types     # the means of mean_codas.p
+"""
+
+import argparse
+import os
+import pickle
+
+import numpy as np
+
+from click_times import load_click_matrix
+from coda_data import DATA_DIR, DOMINICA_CSV, categorical_values, file_hash, load_dominica
+
+
+FORMAT_VERSION = 1
+RHYTHM_TYPES_NPZ = os.path.join(DATA_DIR, f'rhythm_types_v{FORMAT_VERSION}.npz')
+
+# Rhythm of each coda type (3-rhythm), -1 for noise
+CODA_TYPE_RHYTHMS = {
+    '1+1+3': 5, '1+31': 4, '1+32': 4, '10R': 16, '10i': 17, '2+3': 7, '3D': 0, '3R': 1, '4D': 2, '4R1': 3,
+    '4R2': 3, '5R1': 6, '5R2': 6, '5R3': 6, '6R': 8, '6i': 9, '7D1': 10, '7D2': 10, '7i': 11, '8D': 12, '8R': 12,
+    '8i': 13, '9R': 14, '9i': 15,
+    '1-NOISE': -1, '2-NOISE': -1, '3-NOISE': -1, '4-NOISE': -1, '5-NOISE': -1, '6-NOISE': -1, '7-NOISE': -1,
+    '8-NOISE': -1, '9-NOISE': -1, '10-NOISE': -1,
+}
+
+# The coda type 3-rhythm averaged for each rhythm of several coda types, when it made mean_codas.p
+MEAN_CODAS_TYPES = ('1+31', '4R2', '5R2', '7D1', '8R')
+
+
+def group_sums(group, positions, num_groups):
+    """
+    Count, sum and sum of squares of the positions of each group, one bincount per click.
+    """
+    counts = np.bincount(group, minlength=num_groups)
+    sums = np.zeros((num_groups, positions.shape[1]))
+    squares = np.zeros((num_groups, positions.shape[1]))
+    for k in range(positions.shape[1]):
+        sums[:, k] = np.bincount(group, weights=positions[:, k], minlength=num_groups)
+        squares[:, k] = np.bincount(group, weights=positions[:, k] ** 2, minlength=num_groups)
+    return counts, sums, squares
+
+
+def mean_and_variance(counts, sums, squares, n_clicks):
+    """
+    Mean and variance of each group from its sums, NaN beyond its number of clicks (or if it is empty).
+    """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = sums / counts[:, None]
+        variances = np.maximum(squares / counts[:, None] - means ** 2, 0)
+    beyond = np.arange(sums.shape[1])[None, :] >= np.asarray(n_clicks)[:, None]
+    means[beyond] = np.nan
+    variances[beyond] = np.nan
+    return means, variances
+
+
+def rhythm_types(columns, clicks, selected=None, coda_type_rhythms=CODA_TYPE_RHYTHMS, rhythm_coda_types=None,
+                 rows=None):
+    """
+    Per coda type and per rhythm means, variances and counts of the relative click positions.
+
+    columns: typed columns of DominicaCodas.csv (coda_data.load_dominica), clicks: its click matrix
+    (click_times.load_click_matrix), selected: optional boolean mask of the codas to use (e.g. a clan), rows:
+    optional ids of the codas to use, the only rows read from the (memory mapped) click matrix.
+    Codas of zero duration are left out. A rhythm pools all its coda types, or with rhythm_coda_types (e.g.
+    MEAN_CODAS_TYPES) only those of them listed there, if any.
+    """
+    coda_types = columns['CodaType_categories']
+    rows = slice(None) if rows is None else np.asarray(rows)
+    positions = np.asarray(clicks['positions'][rows], dtype=np.float64)
+    n_clicks = np.asarray(clicks['n_clicks'][rows])
+    max_clicks = positions.shape[1]
+
+    keep = ~np.isnan(positions).any(axis=1)
+    if selected is not None:
+        keep &= np.asarray(selected)[rows]
+    positions = positions[keep]
+    group = np.asarray(columns['CodaType'][rows])[keep] * (max_clicks + 1) + n_clicks[keep]
+
+    # one pass over the codas: statistics of every (coda type, number of clicks) group
+    num_groups = len(coda_types) * (max_clicks + 1)
+    counts, sums, squares = group_sums(group, positions, num_groups)
+    counts = counts.reshape(len(coda_types), max_clicks + 1)
+    sums = sums.reshape(len(coda_types), max_clicks + 1, max_clicks)
+    squares = squares.reshape(len(coda_types), max_clicks + 1, max_clicks)
+
+    # each coda type keeps its most common number of clicks
+    type_n_clicks = np.argmax(counts, axis=1)
+    rows = np.arange(len(coda_types))
+    type_counts = counts[rows, type_n_clicks]
+    type_sums = sums[rows, type_n_clicks]
+    type_squares = squares[rows, type_n_clicks]
+    type_means, type_variances = mean_and_variance(type_counts, type_sums, type_squares, type_n_clicks)
+    type_rhythm = np.array([coda_type_rhythms.get(t, -1) for t in coda_types])
+
+    # the coda types pooled into their rhythm: all, or the listed ones for the rhythms that have some
+    pooled = np.ones(len(coda_types), dtype=bool)
+    if rhythm_coda_types is not None:
+        listed = np.isin(coda_types, list(rhythm_coda_types))
+        for r in np.unique(type_rhythm[listed]):
+            pooled[type_rhythm == r] = listed[type_rhythm == r]
+    members = [(type_rhythm == r) & pooled for r in range(type_rhythm.max(initial=-1) + 1)]
+
+    # each rhythm pools its coda types, with the number of clicks most common among them
+    rhythm_ids = np.unique(type_rhythm[(type_rhythm >= 0) & pooled & (type_counts > 0)])
+    rhythm_n_clicks = np.array([np.argmax(counts[members[r]].sum(axis=0)) for r in rhythm_ids], dtype=int)
+    rhythm_counts = np.array([counts[members[r], n].sum() for r, n in zip(rhythm_ids, rhythm_n_clicks)])
+    rhythm_sums = np.array([sums[members[r], n].sum(axis=0) for r, n in zip(rhythm_ids, rhythm_n_clicks)])
+    rhythm_squares = np.array([squares[members[r], n].sum(axis=0) for r, n in zip(rhythm_ids, rhythm_n_clicks)])
+    rhythm_means, rhythm_variances = mean_and_variance(rhythm_counts, rhythm_sums, rhythm_squares, rhythm_n_clicks)
+
+    return {
+        'coda_types': coda_types,
+        'type_rhythm': type_rhythm,
+        'type_n_clicks': type_n_clicks,
+        'type_counts': type_counts,
+        'type_means': type_means,
+        'type_variances': type_variances,
+        'rhythm_ids': rhythm_ids,
+        'rhythm_n_clicks': rhythm_n_clicks,
+        'rhythm_counts': rhythm_counts,
+        'rhythm_means': rhythm_means,
+        'rhythm_variances': rhythm_variances,
+    }
+
+
+def save_rhythm_types(path, result, source, clans, units):
+    """
+    Save the result of rhythm_types as an uncompressed .npz (no pickled objects) holding:
+
+    format_version    int, FORMAT_VERSION
+    source_hash       str, coda_data.file_hash of the csv the means were computed from
+    clans, units      str arrays, the clans and units used (empty for all)
+    coda_types        (T,) str, every coda type of the csv
+    type_rhythm       (T,) int, rhythm of each coda type, -1 for noise
+    type_n_clicks     (T,) int, most common number of clicks of each coda type
+    type_counts       (T,) int, number of codas of each type with that number of clicks
+    type_means        (T, max clicks) float, mean relative click positions, NaN padded
+    type_variances    (T, max clicks) float, their variance
+    rhythm_ids        (R,) int, the rhythms present
+    rhythm_n_clicks, rhythm_counts, rhythm_means, rhythm_variances: the same per rhythm
+    """
+    np.savez(path, format_version=FORMAT_VERSION, source_hash=file_hash(source),
+             clans=np.array(clans, dtype=str), units=np.array(units, dtype=str), **result)
+
+
+def load_rhythm_types(path=RHYTHM_TYPES_NPZ):
+    artifact = dict(np.load(path, allow_pickle=False))
+    assert int(artifact['format_version']) == FORMAT_VERSION, f"{path} has format version {artifact['format_version']}"
+    return artifact
+
+
+def mean_codas_of(artifact):
+    """
+    The rhythm means as a list of arrays, one per rhythm in order of rhythm id (the format of mean_codas.p,
+    although mean_codas.p lists the rhythms in a different order).
+    """
+    return [means[:n] for means, n in zip(artifact['rhythm_means'], artifact['rhythm_n_clicks'])]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--source', default=DOMINICA_CSV)
+    parser.add_argument('--destination', default=RHYTHM_TYPES_NPZ)
+    parser.add_argument('--clans', nargs='*', default=['EC1'], help='clans to use (none for all)')
+    parser.add_argument('--units', nargs='*', default=[], help='units to use (none for all)')
+    parser.add_argument('--mean-codas-types', action='store_true',
+                        help='average only the coda types of MEAN_CODAS_TYPES for their rhythms, as mean_codas.p')
+    parser.add_argument('--pickle', default=None, help='also write the rhythm means as a mean_codas.p style pickle')
+    args = parser.parse_args()
+
+    columns = load_dominica(args.source)
+    clicks = load_click_matrix(args.source, load_dominica)
+    selected = np.ones(len(columns['CodaType']), dtype=bool)
+    if args.clans:
+        selected &= np.isin(categorical_values(columns, 'Clan'), args.clans)
+    if args.units:
+        selected &= np.isin(categorical_values(columns, 'Unit'), args.units)
+
+    result = rhythm_types(columns, clicks, selected,
+                          rhythm_coda_types=MEAN_CODAS_TYPES if args.mean_codas_types else None)
+    save_rhythm_types(args.destination, result, args.source, args.clans, args.units)
+    if args.pickle is not None:
+        pickle.dump(mean_codas_of(result), open(args.pickle, "wb"))
+
+    print(f"{len(result['rhythm_ids'])} rhythms from {int(result['type_counts'].sum())} codas "
+          f"of {np.count_nonzero(result['type_counts'])} coda types, saved to {args.destination}")
+
+
+if __name__ == '__main__':
+    main()
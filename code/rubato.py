@@ -0,0 +1,204 @@
+"""
+Rubato: the change in duration between consecutive codas of the same whale, within the same rhythm and tempo.
+
+Given the codas of a recording, the duration deltas of all consecutive same-whale pairs are computed at once, with
+the ornament click left out of the duration of ornamented codas (click_times[-2] instead of click_times[-1]).
+The deltas are then split in three categories by their 25th and 75th percentile:
+
+    delta < 25th percentile                        decreasing  "\\"
+    25th percentile <= delta < 75th percentile      constant    "-"
+    75th percentile <= delta                        increasing  "/"
+
+The percentiles are fitted from the data, either exactly (fit_thresholds, all deltas in memory) or with a
+mergeable streaming sketch (QuantileSketch) for catalogs that don't fit in memory. Fitted thresholds are saved as
+a small json file, so refitting on new data is one cheap pass. The scripts labelling rubato use them in place of
+DEFAULT_THRESHOLDS only when given the file (--rubato-thresholds):
+
+    python rubato.py                    # exact fit on ../data/sperm-whale-dialogues_augmented.csv
+    python rubato.py --chunksize 100000 # streaming fit, reading the csv in blocks of rows
+"""
+
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from click_times import click_times_from_icis
+from coda_data import DATA_DIR, iter_recordings
+from coda_index import same_whale_neighbours
+
+
+THRESHOLDS_JSON = os.path.join(DATA_DIR, 'rubato_thresholds.json')
+AUGMENTED_CSV = os.path.join(DATA_DIR, 'sperm-whale-dialogues_augmented.csv')
+
+# The thresholds originally hard-coded in the dialogue script (25th and 75th percentile of the deltas at the time).
+# Used unless fitted thresholds are given with --rubato-thresholds.
+DEFAULT_THRESHOLDS = (-0.021416925000000087, 0.018462550000000105)
+
+QUANTILES = (25, 75)
+
+# Consecutive codas further apart than this (seconds) don't get a rubato
+MAX_GAP = 10
+
+RUBATO_SYMBOLS = np.array(["\\", "-", "/"])
+NO_RUBATO = " "
+
+def durations_without_ornament(click_times, n_clicks, ornamented):
+    """
+    Duration of each coda from its padded click times, ignoring the last click if it is just an ornament.
+    """
+    n_clicks = np.asarray(n_clicks)
+    last = np.where(np.asarray(ornamented, dtype=bool), n_clicks - 2, n_clicks - 1)
+    rows = np.arange(len(n_clicks))
+    return np.where(last >= 0, click_times[rows, np.maximum(last, 0)], 0.0)
+
+
+def overlap_durations(first, second, durations, ornamented):
+    """
+    Durations of the pairs of overlapping codas (first, second) of overlaps.overlapping_pairs where neither is
+    ornamented, as two arrays, for comparing the duration of a coda with the one of the coda interrupting it (4-rubato).
+    """
+    ornamented = np.asarray(ornamented, dtype=bool)
+    durations = np.asarray(durations)
+    keep = ~ornamented[first] & ~ornamented[second]
+    return durations[first[keep]], durations[second[keep]]
+
+
+def rubato_deltas(previous_ids, t_init, durations, rhythms, tempos, max_gap=MAX_GAP):
+    """
+    Duration delta between each coda and the previous coda of the same whale (previous_ids, see coda_index.py).
+    NaN where there is no previous coda, it is more than max_gap seconds earlier, or its rhythm or tempo differs.
+
+    The supplement to the paper defines rubato as change of duration within the same tempo and rhythm class.
+    """
+    previous_ids = np.asarray(previous_ids)
+    t_init = np.asarray(t_init, dtype=np.float64)
+    durations = np.asarray(durations, dtype=np.float64)
+    rhythms = np.asarray(rhythms)
+    tempos = np.asarray(tempos)
+
+    p = np.maximum(previous_ids, 0)
+    has_rubato = (previous_ids >= 0) & (t_init - t_init[p] <= max_gap) & \
+                 (rhythms == rhythms[p]) & (tempos == tempos[p])
+    return np.where(has_rubato, durations - durations[p], np.nan)
+
+
+def fit_thresholds(deltas, quantiles=QUANTILES):
+    """
+    Exact percentiles of the deltas (NaNs, i.e. codas without rubato, are ignored).
+    """
+    deltas = np.asarray(deltas, dtype=np.float64)
+    return tuple(np.percentile(deltas[~np.isnan(deltas)], quantiles).tolist())
+
+
+def categorize_rubato(deltas, thresholds=DEFAULT_THRESHOLDS):
+    """
+    Rubato symbol of each delta: "\\" decreasing, "-" constant, "/" increasing, " " where the delta is NaN.
+    """
+    deltas = np.asarray(deltas, dtype=np.float64)
+    categories = np.digitize(deltas, thresholds)
+    return np.where(np.isnan(deltas), NO_RUBATO, RUBATO_SYMBOLS[np.minimum(categories, 2)])
+
+
+class QuantileSketch:
+    """
+    Mergeable streaming quantile sketch: a fixed-width histogram over [low, high], values outside are clamped to
+    the edges. Memory is fixed by the number of bins, whatever the number of values, and a quantile is placed within
+    the bin holding it, so it is as precise as the bin width (and the spacing of the data around it) allows.
+    Two sketches with the same bins can be merged, so partial sketches of separate chunks / processes add up to the
+    sketch of the whole catalog.
+    """
+
+    def __init__(self, low=-1.0, high=1.0, bin_width=1e-5):
+        self.low = low
+        self.high = high
+        self.bin_width = bin_width
+        self.counts = np.zeros(int(round((high - low) / bin_width)), dtype=np.int64)
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        bins = np.clip(((values - self.low) / self.bin_width).astype(np.int64), 0, len(self.counts) - 1)
+        self.counts += np.bincount(bins, minlength=len(self.counts))
+        return self
+
+    def merge(self, other):
+        assert (self.low, self.high, len(self.counts)) == (other.low, other.high, len(other.counts))
+        self.counts += other.counts
+        return self
+
+    def quantile(self, q):
+        """
+        The q-th percentile (0-100), interpolating linearly within the bin it falls in.
+        """
+        cumulative = np.cumsum(self.counts)
+        if cumulative[-1] == 0:
+            raise ValueError("quantile of an empty sketch")
+        rank = q / 100 * cumulative[-1]
+        b = min(int(np.searchsorted(cumulative, rank)), len(self.counts) - 1)
+        below = cumulative[b] - self.counts[b]
+        fraction = (rank - below) / self.counts[b] if self.counts[b] > 0 else 0.5
+        return float(self.low + (b + fraction) * self.bin_width)
+
+    def thresholds(self, quantiles=QUANTILES):
+        return tuple(self.quantile(q) for q in quantiles)
+
+
+def save_thresholds(thresholds, path=THRESHOLDS_JSON, **info):
+    with open(path, 'w') as f:
+        json.dump({'thresholds': list(thresholds), 'quantiles': list(QUANTILES), **info}, f, indent=2)
+
+
+def load_thresholds(path=THRESHOLDS_JSON):
+    """
+    The thresholds saved by save_thresholds, or DEFAULT_THRESHOLDS if there is no such file.
+    """
+    if not os.path.exists(path):
+        return DEFAULT_THRESHOLDS
+    with open(path) as f:
+        return tuple(json.load(f)['thresholds'])
+
+
+def recording_deltas(df):
+    """
+    Rubato deltas of the codas of an augmented csv DataFrame (columns ICI*, Whale, TsTo, Rhythm, Tempo,
+    Extra Click and File), in their order in time within each recording.
+    """
+    icis = df[[c for c in df.columns if c.startswith('ICI')]].to_numpy(dtype=np.float64)
+    click_times, n_clicks = click_times_from_icis(icis)
+    ornamented = df['Extra Click'].to_numpy() == 1
+    durations = durations_without_ornament(click_times, n_clicks, ornamented)
+    t_init = df['TsTo'].to_numpy(dtype=np.float64)
+    _, previous_ids = same_whale_neighbours(df['File'].to_numpy(dtype=str), df['Whale'].to_numpy(), t_init)
+    return rubato_deltas(previous_ids, t_init, durations, df['Rhythm'].to_numpy(), df['Tempo'].to_numpy())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--source', default=AUGMENTED_CSV, help='augmented coda csv')
+    parser.add_argument('--destination', default=THRESHOLDS_JSON)
+    parser.add_argument('--chunksize', type=int, default=None,
+                        help='fit with the streaming sketch, reading this many rows at a time')
+    args = parser.parse_args()
+
+    if args.chunksize is None:
+        deltas = recording_deltas(pd.read_csv(args.source))
+        thresholds = fit_thresholds(deltas)
+        n = int(np.count_nonzero(~np.isnan(deltas)))
+        method = 'exact'
+    else:
+        sketch = QuantileSketch()
+        for recording in iter_recordings(args.source, args.chunksize):
+            sketch.update(recording_deltas(recording))
+        thresholds = sketch.thresholds()
+        n = int(sketch.counts.sum())
+        method = 'sketch'
+
+    save_thresholds(thresholds, args.destination, method=method, num_deltas=n, source=os.path.basename(args.source))
+    print(f"Rubato thresholds ({method}, {n} deltas): {thresholds}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+Conversation blocks: runs of codas with no silence of gap seconds or more between consecutive codas.
+
+5-ornament builds its blocks twice: per whale, by walking the chain of same-whale codas (getNextCoda) and removing
+each coda from a python list of the remaining ones (O(n^2)), with a gap of 8 s, and across whales, walking the codas
+in order with a gap of 12 s. The dialogue script prints a pause after max_diff = 10 s. Here the codas are sorted
+once by (recording, whale if per whale, TsTo), the time to the previous coda comes from one np.diff, and a whole list
+of gaps is compared against it at once, giving a (codas x gaps) matrix of block breaks. Block ids are its cumulative
+sum, and each block is a contiguous range of the sorted codas, described by its (start, end) positions.
+
+Example:
+    order, bounds = block_bounds(columns['File'], columns['TsTo'], [8, 12], columns['Whale'])
+    starts, ends = bounds[0]              # blocks of the 8 s gap, per whale
+    first_block = order[starts[0]:ends[0]]
+
+    python segmentation.py --gaps 2 4 8 12 16 --per-whale   # number and size of blocks for each gap
+"""
+
+import argparse
+
+import numpy as np
+
+from coda_data import DIALOGUES_CSV, load_dialogues
+
+
+# Gaps (seconds) of the two segmentations of 5-ornament: per whale (ornament position) and across whales
+# (interruptions)
+WHALE_BLOCK_GAP = 8
+CONVERSATION_BLOCK_GAP = 12
+
+
+def block_breaks(file_codes, t, gaps, whale_id=None):
+    """
+    Sort the codas by (file, whale if given, t) and mark, for every gap, the codas that start a new block: the first
+    coda of each file (and whale), and the codas starting gap seconds or more after the previous one.
+    Returns (order, breaks): the sorted coda ids and the (codas, gaps) boolean matrix of breaks in that order.
+    """
+    file_codes = np.asarray(file_codes)
+    t = np.asarray(t, dtype=np.float64)
+    gaps = np.atleast_1d(np.asarray(gaps, dtype=np.float64))
+
+    keys = (t, file_codes) if whale_id is None else (t, np.asarray(whale_id), file_codes)
+    order = np.lexsort(keys)
+    new_group = np.ones(len(order), dtype=bool)
+    for key in keys[1:]:
+        new_group[1:] &= key[order][1:] == key[order][:-1]
+    new_group = ~new_group
+    new_group[:1] = True
+
+    silence = np.diff(t[order], prepend=-np.inf)
+    breaks = new_group[:, None] | (silence[:, None] >= gaps[None, :])
+    return order, breaks
+
+
+def block_ids(file_codes, t, gaps, whale_id=None):
+    """
+    Block of every coda (in row order) for each gap, as a (codas, gaps) int64 matrix, or (codas,) for a single gap.
+    Blocks are numbered from 0 in order of (file, whale, time).
+    """
+    order, breaks = block_breaks(file_codes, t, gaps, whale_id)
+    ids = np.empty(breaks.shape, dtype=np.int64)
+    ids[order] = np.cumsum(breaks, axis=0) - 1
+    return ids[:, 0] if np.ndim(gaps) == 0 else ids
+
+
+def block_bounds(file_codes, t, gaps, whale_id=None):
+    """
+    The blocks of each gap as (starts, ends) arrays of positions in order, end excluded: block k of a gap holds the
+    codas order[starts[k]:ends[k]]. Returns (order, bounds), bounds holding one (starts, ends) pair per gap.
+    """
+    order, breaks = block_breaks(file_codes, t, gaps, whale_id)
+    bounds = []
+    for column in breaks.T:
+        starts = np.flatnonzero(column)
+        bounds.append((starts, np.append(starts[1:], len(order))[:len(starts)]))
+    return order, bounds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--source', default=DIALOGUES_CSV, help='coda csv (sperm-whale-dialogues.csv format)')
+    parser.add_argument('--gaps', type=float, nargs='+', default=[WHALE_BLOCK_GAP, CONVERSATION_BLOCK_GAP])
+    parser.add_argument('--per-whale', action='store_true', help='blocks of a single whale, as for ornaments')
+    args = parser.parse_args()
+
+    columns = load_dialogues(args.source)
+    whale_id = columns['Whale'] if args.per_whale else None
+    order, bounds = block_bounds(columns['File'], columns['TsTo'], args.gaps, whale_id)
+    for gap, (starts, ends) in zip(args.gaps, bounds):
+        sizes = ends - starts
+        print(f"gap {gap:g} s: {len(starts)} blocks, {np.mean(sizes):.2f} codas per block on average, "
+              f"{np.count_nonzero(sizes > 1)} with more than one coda")
+
+
+if __name__ == '__main__':
+    main()
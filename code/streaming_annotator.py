@@ -0,0 +1,483 @@
+"""
+Streaming annotator: labels codas as they come in and writes the dialogue live, instead of augmenting a finished csv
+and rendering whale_dialogues.txt afterwards.
+
+Codas are read one at a time, as csv rows in the sperm-whale-dialogues.csv format (REC, nClicks, Duration, ICI1 to
+ICI28, Whale, TsTo, optionally followed by Rhythm and Ornament columns, a header line changes the columns) or as json
+lines ({"REC": ..., "Whale": ..., "TsTo": ..., "ICIs": [...]}, same optional keys), from stdin, a socket, a file being
+appended to, or a replay of an existing csv standing in for a live detector:
+
+    python streaming_annotator.py --replay ../data/sperm-whale-dialogues.csv --speed 10
+    tail -f detections.csv | python streaming_annotator.py --tokens codas.tsv
+    python streaming_annotator.py --listen 127.0.0.1:7000 --dialogue live_dialogues.txt --stats 5
+    python streaming_annotator.py --follow detections.csv
+
+Each coda gets its tempo (tempo_model.py boundaries), rhythm and ornament (the Rhythm / Ornament columns when the
+feed has them, as the replay does from rhythms.p and ornaments.p, otherwise the nearest mean coda of
+rhythm_classifier.py, and no ornament) and its ConstructedString, then its rubato from the previous coda of the same
+whale in the recording, and goes through the chorus / pause state machine of the dialogue script (DialogueWriter).
+Per recording, codas wait in a small reorder buffer so they are handled in order of TsTo: a coda is released once a
+coda more than --lateness seconds later (recording time) has come in, or once it has waited --max-latency seconds
+(wall time), whichever comes first. A coda arriving after a later one was released can't be put back in order, it
+is counted as late and left out. A recording is closed when the feed moves on to another one (unless
+--interleaved), after --idle-timeout seconds without codas, or at the end of the feed (ctrl-c or kill end the
+socket and --follow feeds). Replaying the csv this way writes the same text as whale_dialogues.txt (with
+--interleaved, the lines of the recordings open at the same time are mixed in the output).
+
+--tokens gets one tab separated line per coda as soon as it is labelled: recording, time from the first coda, whale,
+ConstructedString, rubato. Turns of the dialogue are written once they end (the next whale speaks, or a pause).
+
+The reader and the annotator are separate tasks joined by a bounded queue (--queue-size): when the annotator falls
+behind, the reader waits (and stops reading the socket, so the sender is slowed down too). The counters (codas
+received and annotated, late codas, queue depth, time the reader spent blocked, latency from reading a coda to
+writing its token, throughput) are written to stderr as json every --stats seconds and at the end.
+"""
+
+import argparse
+import asyncio
+import heapq
+import json
+import pickle
+import signal
+import sys
+import time
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+from add_tempo_rubato_rhythm_ornament_to_datasets import ORNAMENTS_PICKLE, RHYTHMS_PICKLE, construct_strings
+from click_times import click_times_from_icis
+from coda_data import RECORDING_NAME_LENGTH
+from generate_whale_dialogue_txt_with_proper_timings import DialogueWriter
+from rhythm_classifier import classify, load_mean_codas
+from rubato import DEFAULT_THRESHOLDS, categorize_rubato, durations_without_ornament, load_thresholds, rubato_deltas
+from rubato import NO_RUBATO
+from tempo_model import DEFAULT_BOUNDARIES, assign_tempos, load_boundaries
+
+
+NUM_ICIS = 28
+CSV_COLUMNS = ['REC', 'nClicks', 'Duration'] + [f'ICI{k}' for k in range(1, NUM_ICIS + 1)] + \
+              ['Whale', 'TsTo', 'Rhythm', 'Ornament']
+
+# Reorder window (seconds of recording time), latency bound (wall seconds) and idle time closing a recording
+LATENESS = 2.0
+MAX_LATENCY = 1.0
+IDLE_TIMEOUT = 60.0
+QUEUE_SIZE = 1000
+
+
+def parse_line(line, columns=CSV_COLUMNS):
+    """
+    The coda of a line of the feed, as a dict (recording, whale, time, duration, icis, n_clicks, rhythm, ornament,
+    the last two None when the feed doesn't have them). None for blank lines.
+    """
+    line = line.strip()
+    if not line:
+        return None
+    if line.startswith('{'):
+        fields = json.loads(line)
+        icis = fields['ICIs'] if 'ICIs' in fields else [fields.get(f'ICI{k}', 0) for k in range(1, NUM_ICIS + 1)]
+    else:
+        fields = dict(zip(columns, line.split(',')))
+        icis = [fields.get(f'ICI{k}', 0) for k in range(1, NUM_ICIS + 1)]
+    icis = np.array(icis, dtype=np.float64)
+    return {
+        'recording': fields['REC'][:RECORDING_NAME_LENGTH],
+        'whale': int(fields['Whale']),
+        'time': float(fields['TsTo']),
+        'duration': float(fields['Duration']) if fields.get('Duration', '') != '' else float(icis.sum()),
+        'icis': icis,
+        'n_clicks': int(fields['nClicks']) if fields.get('nClicks', '') != '' else int(np.count_nonzero(icis)) + 1,
+        'rhythm': int(fields['Rhythm']) if fields.get('Rhythm', '') != '' else None,
+        'ornament': int(fields['Ornament']) if fields.get('Ornament', '') != '' else None,
+    }
+
+
+class RecordingState:
+    """
+    What the annotator keeps of an open recording: the reorder buffer, the time of the first coda, the last coda of
+    each whale (for the rubato) and the dialogue state machine.
+    """
+
+    def __init__(self, name, dialogue_out):
+        self.name = name
+        # heap of (time, arrival number, coda), and the (received, arrival number) of its codas in order of arrival,
+        # including codas already released (not in pending anymore), which are skipped when they reach the front
+        self.buffer = []
+        self.arrivals = deque()
+        self.pending = set()
+        self.newest = -np.inf
+        self.released = -np.inf
+        self.time_origin = None
+        # whale -> (time, duration without ornament, rhythm, tempo) of its last coda
+        self.previous = {}
+        self.writer = DialogueWriter(name, dialogue_out)
+        self.last_seen = time.monotonic()
+
+
+class StreamingAnnotator:
+    """
+    Labels codas one at a time (add), keeping the state of each open recording, and writes the tokens and the
+    dialogue as they are known.
+    """
+
+    def __init__(self, thresholds, boundaries, mean_codas=None, tokens_out=None, dialogue_out=None,
+                 lateness=LATENESS, max_latency=MAX_LATENCY, interleaved=False):
+        self.thresholds = thresholds
+        self.boundaries = np.asarray(boundaries)
+        self.mean_codas = mean_codas
+        self.tokens_out = tokens_out
+        self.dialogue_out = dialogue_out
+        self.lateness = lateness
+        self.max_latency = max_latency
+        self.interleaved = interleaved
+        self.states = {}
+        self.num_arrived = 0
+        self.counters = {'annotated': 0, 'late': 0, 'recordings': 0, 'latency_sum': 0.0, 'latency_max': 0.0}
+
+    def add(self, coda):
+        coda.setdefault('received', time.monotonic())
+        state = self.states.get(coda['recording'])
+        if state is None:
+            if not self.interleaved:
+                self.close_all()
+            state = self.states[coda['recording']] = RecordingState(coda['recording'], self.dialogue_out)
+            self.counters['recordings'] += 1
+        state.last_seen = coda['received']
+
+        if coda['time'] < state.released:
+            self.counters['late'] += 1
+            return
+        heapq.heappush(state.buffer, (coda['time'], self.num_arrived, coda))
+        state.arrivals.append((coda['received'], self.num_arrived))
+        state.pending.add(self.num_arrived)
+        self.num_arrived += 1
+        state.newest = max(state.newest, coda['time'])
+        while state.buffer and state.buffer[0][0] < state.newest - self.lateness:
+            self.release(state)
+        self.flush_outputs()
+
+    def release(self, state):
+        """
+        Annotate the earliest coda of the reorder buffer.
+        """
+        _, number, coda = heapq.heappop(state.buffer)
+        state.pending.discard(number)
+        self.annotate(state, coda)
+
+    def annotate(self, state, coda):
+        """
+        Label a coda released from the reorder buffer and feed it to the dialogue.
+        """
+        icis = coda['icis'][None, :]
+        ornament = 0 if coda['ornament'] is None else coda['ornament']
+        rhythm = coda['rhythm']
+        if rhythm is None:
+            rhythm = int(classify(icis, [coda['n_clicks'] - ornament], self.mean_codas)[0][0])
+        tempo = int(assign_tempos(coda['duration'], self.boundaries))
+        word = str(construct_strings(rhythm, ornament, tempo))
+
+        # as assign_rubato of the dialogue script does for a whole recording
+        click_times, _ = click_times_from_icis(icis)
+        num_clicks = np.count_nonzero(click_times, axis=1) + 1
+        duration = float(durations_without_ornament(click_times, num_clicks, [word[0].isupper()])[0])
+        if state.time_origin is None:
+            state.time_origin = coda['time']
+        t = coda['time'] - state.time_origin
+        rubato = NO_RUBATO
+        previous = state.previous.get(coda['whale'])
+        if previous is not None:
+            deltas = rubato_deltas([-1, 0], [previous[0], t], [previous[1], duration], [previous[2], rhythm],
+                                   [previous[3], tempo])
+            rubato = str(categorize_rubato(deltas[1:], self.thresholds)[0])
+        state.previous[coda['whale']] = (t, duration, rhythm, tempo)
+        state.released = coda['time']
+
+        state.writer.add({'whale': coda['whale'], 'text': rubato + word, 'timestamp': t})
+        if self.tokens_out is not None:
+            self.tokens_out.write(f"{state.name}\t{t:.4f}\t{coda['whale']}\t{word}\t{rubato}\n")
+        latency = time.monotonic() - coda['received']
+        self.counters['annotated'] += 1
+        self.counters['latency_sum'] += latency
+        self.counters['latency_max'] = max(self.counters['latency_max'], latency)
+
+    def flush_stale(self, now=None):
+        """
+        Release the codas that have waited more than max_latency in a reorder buffer (with the earlier ones).
+        """
+        now = time.monotonic() if now is None else now
+        for state in self.states.values():
+            while state.arrivals:
+                received, number = state.arrivals[0]
+                if number not in state.pending:
+                    state.arrivals.popleft()
+                elif now - received > self.max_latency:
+                    self.release(state)
+                else:
+                    break
+        self.flush_outputs()
+
+    def close(self, name):
+        state = self.states.pop(name)
+        while state.buffer:
+            self.release(state)
+        state.writer.close()
+        self.flush_outputs()
+
+    def close_all(self):
+        for name in list(self.states):
+            self.close(name)
+
+    def close_idle(self, idle_timeout, now=None):
+        now = time.monotonic() if now is None else now
+        for name in [name for name, state in self.states.items() if now - state.last_seen > idle_timeout]:
+            self.close(name)
+
+    def flush_outputs(self):
+        for out in [self.tokens_out, self.dialogue_out]:
+            if out is not None:
+                out.flush()
+
+
+class Feed:
+    """
+    The bounded queue between the readers and the annotator, with its backpressure counters.
+    """
+
+    def __init__(self, queue_size=QUEUE_SIZE):
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.counters = {'received': 0, 'queue_max': 0, 'blocked_seconds': 0.0, 'parse_errors': 0}
+
+    async def put(self, coda):
+        start = time.monotonic()
+        await self.queue.put(coda)
+        self.counters['blocked_seconds'] += time.monotonic() - start
+        self.counters['received'] += 1
+        self.counters['queue_max'] = max(self.counters['queue_max'], self.queue.qsize())
+
+    async def put_lines(self, reader):
+        """
+        Parse the lines of an asyncio StreamReader into the queue, until it ends.
+        """
+        columns = CSV_COLUMNS
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            line = line.decode()
+            if line.startswith('REC,'):
+                columns = line.strip().split(',')
+                continue
+            try:
+                coda = parse_line(line, columns)
+            except (ValueError, KeyError):
+                self.counters['parse_errors'] += 1
+                continue
+            if coda is not None:
+                await self.put(coda)
+
+
+async def read_stdin(feed):
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+    await feed.put_lines(reader)
+
+
+async def read_socket(feed, address):
+    """
+    Serve forever on host:port (or unix:path), each connection sending lines of codas.
+    """
+    async def handle(reader, writer):
+        await feed.put_lines(reader)
+        writer.close()
+
+    if address.startswith('unix:'):
+        server = await asyncio.start_unix_server(handle, address[len('unix:'):])
+    else:
+        host, port = address.rsplit(':', 1)
+        server = await asyncio.start_server(handle, host, int(port))
+    async with server:
+        await server.serve_forever()
+
+
+async def follow_file(feed, path, poll=0.1):
+    """
+    Read the lines of a file and then the lines appended to it, as tail -f does, forever.
+    """
+    columns = CSV_COLUMNS
+    partial = ''
+    with open(path) as f:
+        while True:
+            line = f.readline()
+            if not line.endswith('\n'):
+                # nothing new, or a line still being written
+                partial += line
+                await asyncio.sleep(poll)
+                continue
+            line, partial = partial + line, ''
+            if line.startswith('REC,'):
+                columns = line.strip().split(',')
+                continue
+            try:
+                coda = parse_line(line, columns)
+            except (ValueError, KeyError):
+                feed.counters['parse_errors'] += 1
+                continue
+            if coda is not None:
+                await feed.put(coda)
+
+
+async def replay_csv(feed, path, speed=0.0, rhythms_path=RHYTHMS_PICKLE, ornaments_path=ORNAMENTS_PICKLE,
+                     chunksize=10000):
+    """
+    Feed the codas of a sperm-whale-dialogues.csv style file as a detector would, with their rhythm and ornament
+    labels. With a speed, codas are spaced out in time as in the recording, speed times faster, otherwise they
+    are sent as fast as the annotator takes them.
+    """
+    rhythms = np.asarray(pickle.load(open(rhythms_path, "rb")))
+    ornaments = np.asarray(pickle.load(open(ornaments_path, "rb")))
+    ici_names = [f'ICI{k}' for k in range(1, NUM_ICIS + 1)]
+    row = 0
+    previous = None
+    for chunk in pd.read_csv(path, chunksize=chunksize):
+        recordings = chunk['REC'].str[:RECORDING_NAME_LENGTH].to_numpy(dtype=str)
+        icis = chunk[ici_names].to_numpy(dtype=np.float64)
+        columns = {name: chunk[name].to_numpy() for name in ['nClicks', 'Duration', 'Whale', 'TsTo']}
+        for i in range(len(chunk)):
+            coda = {
+                'recording': recordings[i],
+                'whale': int(columns['Whale'][i]),
+                'time': float(columns['TsTo'][i]),
+                'duration': float(columns['Duration'][i]),
+                'icis': icis[i],
+                'n_clicks': int(columns['nClicks'][i]),
+                'rhythm': int(rhythms[row]),
+                'ornament': int(ornaments[row]),
+            }
+            if speed > 0 and previous is not None and previous['recording'] == coda['recording']:
+                await asyncio.sleep(max(coda['time'] - previous['time'], 0) / speed)
+            await feed.put(coda)
+            previous = coda
+            row += 1
+
+
+async def annotate_feed(feed, annotator):
+    while True:
+        coda = await feed.queue.get()
+        if coda is None:
+            break
+        annotator.add(coda)
+        # let the reader run even when the queue never empties
+        await asyncio.sleep(0)
+    annotator.close_all()
+
+
+def statistics(feed, annotator, start):
+    counters = dict(feed.counters, **annotator.counters)
+    annotated = counters.pop('annotated')
+    latency_sum = counters.pop('latency_sum')
+    seconds = time.monotonic() - start
+    return dict(counters, annotated=annotated, queue=feed.queue.qsize(),
+                latency_mean=latency_sum / annotated if annotated else None, seconds=seconds,
+                codas_per_second=annotated / seconds if seconds > 0 else None)
+
+
+async def run(source, annotator, queue_size=QUEUE_SIZE, idle_timeout=IDLE_TIMEOUT, stats_interval=None,
+              stats_out=sys.stderr):
+    """
+    Read the codas of source (a coroutine function of the feed) and annotate them until the source ends.
+    Returns the final counters.
+    """
+    feed = Feed(queue_size)
+    start = time.monotonic()
+
+    async def tick():
+        # releases the codas that waited too long and closes the idle recordings, between codas
+        last_stats = time.monotonic()
+        while True:
+            await asyncio.sleep(min(annotator.max_latency / 10, 0.1))
+            annotator.flush_stale()
+            annotator.close_idle(idle_timeout)
+            if stats_interval is not None and time.monotonic() - last_stats >= stats_interval:
+                last_stats = time.monotonic()
+                stats_out.write(json.dumps(statistics(feed, annotator, start)) + '\n')
+                stats_out.flush()
+
+    consumer = asyncio.create_task(annotate_feed(feed, annotator))
+    ticker = asyncio.create_task(tick())
+    reader = asyncio.create_task(source(feed))
+    # on ctrl-c or kill, stop reading but annotate what was read and close the recordings
+    loop = asyncio.get_running_loop()
+    for signum in [signal.SIGINT, signal.SIGTERM]:
+        loop.add_signal_handler(signum, reader.cancel)
+    try:
+        await reader
+    except asyncio.CancelledError:
+        pass
+    try:
+        await feed.queue.put(None)
+        await consumer
+    finally:
+        ticker.cancel()
+        for signum in [signal.SIGINT, signal.SIGTERM]:
+            loop.remove_signal_handler(signum)
+    return statistics(feed, annotator, start)
+
+
+def open_output(path):
+    if path is None:
+        return None
+    return sys.stdout if path == '-' else open(path, 'w')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sources = parser.add_mutually_exclusive_group()
+    sources.add_argument('--replay', default=None, help='replay the codas of this csv')
+    sources.add_argument('--listen', default=None, help='read codas from connections to host:port or unix:path')
+    sources.add_argument('--follow', default=None, help='read codas appended to this file')
+    parser.add_argument('--speed', type=float, default=0.0,
+                        help='replay speed relative to the recordings (0: as fast as possible)')
+    parser.add_argument('--rhythms', default=RHYTHMS_PICKLE, help='rhythm labels of the replayed csv')
+    parser.add_argument('--ornaments', default=ORNAMENTS_PICKLE, help='ornament labels of the replayed csv')
+    parser.add_argument('--dialogue', default='-', help="dialogue output ('-' for stdout)")
+    parser.add_argument('--tokens', default=None, help="labelled codas output ('-' for stdout)")
+    parser.add_argument('--tempo-boundaries', default=None,
+                        help='tempo boundaries fitted by tempo_model.py, instead of the 2-tempo ones')
+    parser.add_argument('--rubato-thresholds', default=None,
+                        help='rubato thresholds fitted by rubato.py (../data/rubato_thresholds.json), '
+                             'instead of the original ones')
+    parser.add_argument('--lateness', type=float, default=LATENESS,
+                        help='seconds of recording time a coda waits for earlier codas')
+    parser.add_argument('--max-latency', type=float, default=MAX_LATENCY,
+                        help='wall seconds after which a waiting coda is labelled anyway')
+    parser.add_argument('--idle-timeout', type=float, default=IDLE_TIMEOUT,
+                        help='wall seconds without codas after which a recording is closed')
+    parser.add_argument('--interleaved', action='store_true',
+                        help="keep the other recordings open when codas of a new recording come in")
+    parser.add_argument('--queue-size', type=int, default=QUEUE_SIZE)
+    parser.add_argument('--stats', type=float, default=None, help='write the counters every this many seconds')
+    args = parser.parse_args()
+
+    boundaries = DEFAULT_BOUNDARIES if args.tempo_boundaries is None else load_boundaries(args.tempo_boundaries)
+    thresholds = DEFAULT_THRESHOLDS if args.rubato_thresholds is None else load_thresholds(args.rubato_thresholds)
+    annotator = StreamingAnnotator(thresholds, boundaries, load_mean_codas(),
+                                   open_output(args.tokens), open_output(args.dialogue), args.lateness,
+                                   args.max_latency, args.interleaved)
+    if args.replay is not None:
+        source = lambda feed: replay_csv(feed, args.replay, args.speed, args.rhythms, args.ornaments)
+    elif args.listen is not None:
+        source = lambda feed: read_socket(feed, args.listen)
+    elif args.follow is not None:
+        source = lambda feed: follow_file(feed, args.follow)
+    else:
+        source = read_stdin
+
+    counters = asyncio.run(run(source, annotator, args.queue_size, args.idle_timeout, args.stats))
+    sys.stderr.write(json.dumps(counters) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""
+Synthetic coda catalogs, for running the pipeline on more data than the real catalogs hold.
+
+A catalog scale times the size of sperm-whale-dialogues.csv is made of recordings copied from the real ones: each
+synthetic recording takes a real recording as template and keeps its whales, the order of their turns and the time
+between its codas (so the overlaps and choruses are alike), with the ICIs of every coda and its start time slightly
+jittered. The rhythm and ornament labels of the template codas are written along (rhythms.p / ornaments.p format),
+so the augmentation script can run on the synthetic csv. A DominicaCodas.csv style catalog is made by drawing codas
+with replacement from the real one, again with jittered ICIs.
+
+    python synthetic_catalog.py --scale 100 --destination /tmp/synthetic
+"""
+
+import argparse
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+
+from add_tempo_rubato_rhythm_ornament_to_datasets import ORNAMENTS_PICKLE, RHYTHMS_PICKLE
+from coda_data import DIALOGUES_CSV, DOMINICA_CSV, RECORDING_NAME_LENGTH
+
+
+# Standard deviation of the log of the multiplicative ICI jitter, and of the start time jitter (seconds)
+ICI_JITTER = 0.03
+TIME_JITTER = 0.02
+
+
+def recording_name(k):
+    """
+    A 6 character recording name (REC[:6]) for synthetic recording k, e.g. sy000a.
+    """
+    digits = np.base_repr(k, 36).lower().rjust(RECORDING_NAME_LENGTH - 2, '0')
+    assert len(digits) == RECORDING_NAME_LENGTH - 2, f"too many recordings ({k})"
+    return 'sy' + digits
+
+
+def jitter_icis(icis, rng):
+    """
+    Multiply every non zero ICI by a random factor close to 1.
+    """
+    return np.where(icis > 0, icis * np.exp(rng.normal(scale=ICI_JITTER, size=icis.shape)), 0.0)
+
+
+def synthetic_dialogues(scale, seed=0, source=DIALOGUES_CSV, rhythms_path=RHYTHMS_PICKLE,
+                        ornaments_path=ORNAMENTS_PICKLE):
+    """
+    A synthetic sperm-whale-dialogues.csv of about scale times the size of source, as (DataFrame, rhythms, ornaments).
+    """
+    rng = np.random.default_rng(seed)
+    df = pd.read_csv(source)
+    rhythms = np.asarray(pickle.load(open(rhythms_path, "rb")))
+    ornaments = np.asarray(pickle.load(open(ornaments_path, "rb")))
+    ici_names = [c for c in df.columns if c.startswith('ICI')]
+
+    # rows of each real recording, in order of appearance
+    recordings = df['REC'].str[:RECORDING_NAME_LENGTH]
+    _, first_row, template_of_row = np.unique(recordings.to_numpy(dtype=str), return_index=True, return_inverse=True)
+    templates = [np.flatnonzero(template_of_row == t) for t in np.argsort(first_row)]
+
+    # whole recordings are copied until the catalog reaches scale times the rows of the source
+    rows, names = [], []
+    total = 0
+    k = 0
+    while total < scale * len(df):
+        template = templates[k % len(templates)]
+        rows.append(template)
+        names.append(np.full(len(template), recording_name(k)))
+        total += len(template)
+        k += 1
+    rows = np.concatenate(rows)
+    names = np.concatenate(names)
+
+    out = df.iloc[rows].reset_index(drop=True)
+    icis = jitter_icis(out[ici_names].to_numpy(dtype=np.float64), rng)
+    out[ici_names] = icis
+    out['Duration'] = icis.sum(axis=1)
+    out['TsTo'] = np.maximum(out['TsTo'].to_numpy() + rng.normal(scale=TIME_JITTER, size=len(out)), 0)
+    out['REC'] = names + out['REC'].str[RECORDING_NAME_LENGTH:].to_numpy(dtype=str)
+    return out, rhythms[rows], ornaments[rows]
+
+
+def synthetic_dominica(scale, seed=0, source=DOMINICA_CSV):
+    """
+    A synthetic DominicaCodas.csv of scale times the size of source, codas drawn with replacement.
+    """
+    rng = np.random.default_rng(seed)
+    df = pd.read_csv(source, encoding='utf-8-sig')
+    ici_names = [c for c in df.columns if c.startswith('ICI')]
+    out = df.iloc[rng.integers(0, len(df), size=int(scale * len(df)))].reset_index(drop=True)
+    icis = jitter_icis(out[ici_names].to_numpy(dtype=np.float64), rng)
+    out[ici_names] = icis
+    out['Duration'] = icis.sum(axis=1)
+    out['codaNUM2018'] = np.arange(1, len(out) + 1)
+    return out
+
+
+def write_catalog(folder, scale, seed=0):
+    """
+    Write the synthetic sperm-whale-dialogues.csv (with its rhythms.p and ornaments.p) and DominicaCodas.csv into
+    folder, under the same names as the real ones. Returns their paths.
+    """
+    os.makedirs(folder, exist_ok=True)
+    paths = {name: os.path.join(folder, os.path.basename(path)) for name, path in [
+        ('dialogues', DIALOGUES_CSV), ('dominica', DOMINICA_CSV), ('rhythms', RHYTHMS_PICKLE),
+        ('ornaments', ORNAMENTS_PICKLE)]}
+
+    dialogues, rhythms, ornaments = synthetic_dialogues(scale, seed)
+    dialogues.to_csv(paths['dialogues'], index=False)
+    pickle.dump(rhythms.tolist(), open(paths['rhythms'], "wb"))
+    pickle.dump(ornaments.tolist(), open(paths['ornaments'], "wb"))
+    synthetic_dominica(scale, seed).to_csv(paths['dominica'], index=False, encoding='utf-8-sig')
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', type=float, default=10, help='size relative to the real catalogs')
+    parser.add_argument('--destination', required=True, help='folder of the synthetic catalogs')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    paths = write_catalog(args.destination, args.scale, args.seed)
+    for name, path in paths.items():
+        print(f"{name}: {path}")
+
+
+if __name__ == '__main__':
+    main()
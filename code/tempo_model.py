@@ -0,0 +1,148 @@
+"""
+Tempo model: the coda duration boundaries between the tempo categories.
+
+2-tempo finds them as the local minima of a gaussian kernel density estimate of the durations of the EC1 clan
+(sklearn KernelDensity.score_samples over a 0.01 s grid, bandwidth 0.035 s), which gave the 0.45 / 0.61 / 0.93 / 1.08
+boundaries hard-coded in return_tempo. Scoring every grid point against every duration is O(n x grid); here the
+durations are linearly binned onto a fine regular grid and the bin counts convolved with the gaussian kernel through
+an FFT, which is O(n + grid log grid) and within a fraction of a bin of the exact estimate for any number of codas. The
+default grid is the 0.01 s one of 2-tempo, on which the EC1 codas give back exactly its boundaries; a finer grid
+(--step 0.001) moves them by a few milliseconds (0.45 / 0.61 / 0.931 / 1.078).
+
+The fitted boundaries are saved as a small json file, which the augmentation script and the streaming annotator use
+in place of the 2-tempo constants only when given it (--tempo-boundaries):
+
+    python tempo_model.py                    # codas of the EC1 clan of ../data/DominicaCodas.csv, as in 2-tempo
+    python tempo_model.py --clans            # all clans
+"""
+
+import argparse
+import json
+import os
+
+import numpy as np
+
+from coda_data import DATA_DIR, DOMINICA_CSV, categorical_values, load_dominica
+
+
+TEMPO_JSON = os.path.join(DATA_DIR, 'tempo_boundaries.json')
+
+# The boundaries found in 2-tempo, used when no fitted boundaries have been saved
+DEFAULT_BOUNDARIES = (0.45, 0.61, 0.93, 1.08)
+
+# Kernel bandwidth and range of durations (seconds) of 2-tempo, durations outside the range are annotation mistakes
+BANDWIDTH = 0.035
+MIN_DURATION = 0.1
+MAX_DURATION = 1.75
+
+# Bin width of the grid the density is estimated on (the grid of 2-tempo)
+GRID_STEP = 0.01
+
+
+def binned_kde(x, bandwidth=BANDWIDTH, low=MIN_DURATION, high=MAX_DURATION, step=GRID_STEP):
+    """
+    Gaussian kernel density of x on the regular grid low, low + step, ..., high. Returns (grid, density).
+    """
+    x = np.asarray(x, dtype=np.float64)
+    # pad the grid by 4 bandwidths on each side, so the mass of the values near the edges isn't folded back in
+    pad = int(np.ceil(4 * bandwidth / step))
+    num_bins = int(round((high - low) / step)) + 1
+    origin = low - pad * step
+    size = num_bins + 2 * pad
+
+    # linear binning: each value splits its weight between the two grid points around it
+    position = (x - origin) / step
+    left = np.floor(position).astype(np.int64)
+    weight = position - left
+    inside = (left >= 0) & (left < size - 1)
+    counts = np.bincount(left[inside], weights=1 - weight[inside], minlength=size)
+    counts += np.bincount(left[inside] + 1, weights=weight[inside], minlength=size)
+
+    # circular convolution with the kernel, zero padded to twice the length so it doesn't wrap around
+    lags = np.arange(2 * size)
+    lags = np.minimum(lags, 2 * size - lags) * step
+    kernel = np.exp(-0.5 * (lags / bandwidth) ** 2)
+    kernel /= bandwidth * np.sqrt(2 * np.pi) * max(len(x), 1)
+    density = np.fft.irfft(np.fft.rfft(counts, 2 * size) * np.fft.rfft(kernel), 2 * size)[:size]
+
+    grid = origin + np.arange(size) * step
+    return grid[pad:pad + num_bins], np.maximum(density[pad:pad + num_bins], 0)
+
+
+def density_minima(grid, density, tolerance=1e-9):
+    """
+    The grid points where the density is a strict local minimum (argrelextrema(density, np.less) of 2-tempo).
+    Minima below tolerance times the maximum density are left out: far from any duration the FFT convolution leaves
+    round-off ripples (~1e-15) that would otherwise count as minima.
+    """
+    interior = (density[1:-1] < density[:-2]) & (density[1:-1] < density[2:])
+    interior &= density[1:-1] > tolerance * density.max()
+    return grid[1:-1][interior]
+
+
+def fit_boundaries(durations, bandwidth=BANDWIDTH, low=MIN_DURATION, high=MAX_DURATION, step=GRID_STEP,
+                   num_tempos=None):
+    """
+    Tempo boundaries of the durations: the minima of their density. With num_tempos, only the num_tempos - 1 deepest
+    minima (lowest density) are kept.
+    """
+    durations = np.asarray(durations, dtype=np.float64)
+    durations = durations[(durations > low) & (durations < high)]
+    grid, density = binned_kde(durations, bandwidth, low, high, step)
+    minima = density_minima(grid, density)
+    if num_tempos is not None and len(minima) > num_tempos - 1:
+        depth = np.interp(minima, grid, density)
+        minima = np.sort(minima[np.argsort(depth, kind='stable')[:num_tempos - 1]])
+    # grid points, without the round-off of origin + k * step
+    return tuple(round(float(b), 10) for b in minima)
+
+
+def assign_tempos(durations, boundaries=DEFAULT_BOUNDARIES):
+    """
+    Tempo category of each duration, 0 (shortest) to len(boundaries) (longest).
+    """
+    return np.digitize(durations, boundaries)
+
+
+def save_boundaries(boundaries, path=TEMPO_JSON, **info):
+    with open(path, 'w') as f:
+        json.dump({'boundaries': list(boundaries), 'bandwidth': BANDWIDTH, **info}, f, indent=2)
+
+
+def load_boundaries(path=TEMPO_JSON):
+    """
+    The boundaries saved by save_boundaries, or DEFAULT_BOUNDARIES if there is no such file.
+    """
+    if not os.path.exists(path):
+        return DEFAULT_BOUNDARIES
+    with open(path) as f:
+        return tuple(json.load(f)['boundaries'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--source', default=DOMINICA_CSV, help='coda csv (DominicaCodas.csv format)')
+    parser.add_argument('--destination', default=TEMPO_JSON)
+    parser.add_argument('--clans', nargs='*', default=['EC1'], help='clans to use (none for all)')
+    parser.add_argument('--units', nargs='*', default=[], help='units to use (none for all)')
+    parser.add_argument('--bandwidth', type=float, default=BANDWIDTH)
+    parser.add_argument('--step', type=float, default=GRID_STEP, help='bin width of the density grid (seconds)')
+    parser.add_argument('--num-tempos', type=int, default=None, help='keep only the deepest num_tempos - 1 minima')
+    args = parser.parse_args()
+
+    columns = load_dominica(args.source)
+    selected = np.ones(len(columns['Duration']), dtype=bool)
+    if args.clans:
+        selected &= np.isin(categorical_values(columns, 'Clan'), args.clans)
+    if args.units:
+        selected &= np.isin(categorical_values(columns, 'Unit'), args.units)
+
+    boundaries = fit_boundaries(columns['Duration'][selected], args.bandwidth, step=args.step,
+                                num_tempos=args.num_tempos)
+    save_boundaries(boundaries, args.destination, step=args.step, num_codas=int(selected.sum()), clans=args.clans,
+                    units=args.units, source=os.path.basename(args.source))
+    print(f"Tempo boundaries ({int(selected.sum())} codas): {[round(b, 3) for b in boundaries]}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+"""
+Binary token stream of the conversations, for training sequence models without re-tokenizing text every epoch.
+
+Each recording of the augmented csv becomes one conversation of integer tokens, built like whale_dialogues.txt
+(codas in order of time, with the rubato of the dialogue script):
+
+    <bos>  [<pause>] [<chorus>] <whale k> <coda> ...  <eos>
+
+<pause> comes before a coda starting more than max_diff seconds after the previous one, <chorus> before a coda of
+another whale starting less than CHORUS_WINDOW seconds after the previous one (as the dialogue script groups
+choruses), <whale k> is the whale number and <coda> is the word (rhythm letter, capitalized if ornamented, and tempo
+digit) with its rubato symbol in front, e.g. "/d3". The vocabulary has every combination, whether it occurs or not.
+
+The export is a folder holding:
+    tokens.u16     all the conversations one after the other, raw little endian uint16 (memory map it)
+    offsets.npy    int64 (conversations + 1,), conversation c is tokens[offsets[c]:offsets[c + 1]]
+    names.npy      the recording name of each conversation
+    vocab.json     the token strings, in order of id, and the format version
+
+    python tokens.py                   # export ../data/tokens from the augmented csv
+    python tokens.py --decode 0        # print the first conversation back as tokens
+"""
+
+import argparse
+import json
+import os
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from add_tempo_rubato_rhythm_ornament_to_datasets import WORD_TABLE
+from coda_data import DATA_DIR, iter_recordings
+from generate_whale_dialogue_txt_with_proper_timings import AUGMENTED_CSV, build_dialogue, max_diff, parse_recording
+from overlaps import CHORUS_WINDOW
+from rubato import DEFAULT_THRESHOLDS, NO_RUBATO, RUBATO_SYMBOLS, load_thresholds
+
+
+FORMAT_VERSION = 1
+TOKENS_DIR = os.path.join(DATA_DIR, 'tokens')
+
+PAD, BOS, EOS, PAUSE, CHORUS = range(5)
+SPECIAL_TOKENS = ['<pad>', '<bos>', '<eos>', '<pause>', '<chorus>']
+MAX_WHALES = 32
+FIRST_WHALE = len(SPECIAL_TOKENS)
+FIRST_CODA = FIRST_WHALE + MAX_WHALES
+
+
+def build_vocabulary():
+    """
+    Token strings in order of id: the special tokens, <whale 1> to <whale MAX_WHALES>, then every rubato + word.
+    """
+    whales = [f'<whale {k}>' for k in range(1, MAX_WHALES + 1)]
+    rubatos = np.r_[[NO_RUBATO], RUBATO_SYMBOLS]
+    codas = np.char.add(rubatos[:, None], np.sort(WORD_TABLE.ravel())[None, :]).ravel()
+    return SPECIAL_TOKENS + whales + codas.tolist()
+
+
+VOCABULARY = build_vocabulary()
+CODA_STRINGS = np.array(VOCABULARY[FIRST_CODA:])
+CODA_ORDER = np.argsort(CODA_STRINGS)
+assert len(VOCABULARY) < 2**16
+
+
+def coda_ids(texts):
+    """
+    Token id of each coda text (rubato symbol + word), with one binary search.
+    """
+    texts = np.asarray(texts, dtype=CODA_STRINGS.dtype)
+    positions = np.minimum(np.searchsorted(CODA_STRINGS[CODA_ORDER], texts), len(CODA_STRINGS) - 1)
+    ids = CODA_ORDER[positions]
+    assert np.all(CODA_STRINGS[ids] == texts), "coda outside the vocabulary"
+    return FIRST_CODA + ids
+
+
+def recording_codas(recording, thresholds):
+    """
+    The codas of one recording (its rows of the augmented csv) in order of time, as in whale_dialogues.txt:
+    (whales, times, durations, coda token ids). times are counted from the first coda, durations are the time of the
+    last click.
+    """
+    name = recording['File'].iloc[0]
+    book, words = parse_recording(recording)
+    lines = build_dialogue(name, book, words, thresholds)['dialogue']
+    whales = np.array([line['whale'] for line in lines])
+    times = np.array([line['timestamp'] for line in lines])
+    durations = book[:,2:42].max(axis=1)
+    return whales, times, durations, coda_ids([line['text'] for line in lines])
+
+
+def tokenize_recording(recording, thresholds):
+    """
+    The tokens of one recording (its rows of the augmented csv), as a uint16 array.
+    """
+    whales, times, _, codas = recording_codas(recording, thresholds)
+    assert whales.min() >= 1 and whales.max() <= MAX_WHALES
+
+    time_diff = np.diff(times, prepend=-np.inf)
+    pause = time_diff > max_diff
+    pause[0] = False
+    chorus = (time_diff < CHORUS_WINDOW) & (whales != np.r_[0, whales[:-1]])
+
+    # 4 slots per coda (pause, chorus, whale, coda), the unused ones dropped
+    slots = np.stack([np.where(pause, PAUSE, -1), np.where(chorus, CHORUS, -1), FIRST_WHALE + whales - 1, codas],
+                     axis=1).ravel()
+    return np.r_[BOS, slots[slots >= 0], EOS].astype(np.uint16)
+
+
+def export_tokens(source=AUGMENTED_CSV, folder=TOKENS_DIR, thresholds=DEFAULT_THRESHOLDS, chunksize=100000):
+    """
+    Tokenize every recording of the augmented csv into folder (see the module docstring), streaming the csv
+    one recording at a time. Returns the offsets.
+    """
+    os.makedirs(folder, exist_ok=True)
+    offsets = [0]
+    names = []
+    with open(os.path.join(folder, 'tokens.u16.tmp'), 'wb') as f:
+        for recording in iter_recordings(source, chunksize):
+            ids = tokenize_recording(recording, thresholds)
+            f.write(ids.astype('<u2').tobytes())
+            offsets.append(offsets[-1] + len(ids))
+            names.append(recording['File'].iloc[0])
+    os.replace(os.path.join(folder, 'tokens.u16.tmp'), os.path.join(folder, 'tokens.u16'))
+    np.save(os.path.join(folder, 'offsets.npy'), np.array(offsets, dtype=np.int64))
+    np.save(os.path.join(folder, 'names.npy'), np.array(names, dtype=str))
+    with open(os.path.join(folder, 'vocab.json'), 'w') as f:
+        json.dump({'format_version': FORMAT_VERSION, 'tokens': VOCABULARY}, f, indent=0)
+    return np.array(offsets)
+
+
+def load_tokens(folder=TOKENS_DIR):
+    """
+    (tokens, offsets, names, vocabulary) of an export, the tokens memory mapped.
+    """
+    with open(os.path.join(folder, 'vocab.json')) as f:
+        vocab = json.load(f)
+    assert vocab['format_version'] == FORMAT_VERSION, f"{folder} has format version {vocab['format_version']}"
+    tokens = np.memmap(os.path.join(folder, 'tokens.u16'), dtype='<u2', mode='r')
+    offsets = np.load(os.path.join(folder, 'offsets.npy'))
+    names = np.load(os.path.join(folder, 'names.npy'))
+    return tokens, offsets, names, vocab['tokens']
+
+
+def decode(ids, vocabulary=VOCABULARY):
+    return [vocabulary[i] for i in ids]
+
+
+def window_starts(offsets, window, stride=1, within_conversations=True):
+    """
+    Start of every window of window + 1 tokens (inputs and the targets shifted by one), stride tokens apart.
+    Within conversations, windows never cross the end of a conversation (shorter conversations are left out).
+    """
+    if not within_conversations:
+        return np.arange(0, offsets[-1] - window, stride)
+    starts = [np.arange(a, b - window, stride) for a, b in zip(offsets[:-1], offsets[1:])]
+    return np.concatenate(starts) if starts else np.zeros(0, dtype=np.int64)
+
+
+def iter_batches(tokens, offsets, window, batch_size, stride=1, within_conversations=True, seed=None):
+    """
+    Yields (inputs, targets) batches of (batch_size, window) token windows, targets being the inputs shifted by one.
+
+    The windows are rows of a sliding window view of the memory mapped tokens, so nothing is decoded. With evenly
+    spaced windows (within_conversations=False, no seed) each batch is itself a strided view and nothing is copied
+    either, otherwise (windows within conversations, or shuffled with a seed) each batch is gathered into a new array.
+    """
+    windows = sliding_window_view(tokens, window + 1)
+    starts = window_starts(offsets, window, stride, within_conversations)
+    if seed is not None:
+        starts = np.random.default_rng(seed).permutation(starts)
+    evenly_spaced = seed is None and not within_conversations
+
+    for b in range(0, len(starts), batch_size):
+        if evenly_spaced:
+            batch = windows[starts[b]:starts[min(b + batch_size, len(starts)) - 1] + 1:stride]
+        else:
+            batch = windows[starts[b:b + batch_size]]
+        yield batch[:, :-1], batch[:, 1:]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--source', default=AUGMENTED_CSV, help='augmented coda csv')
+    parser.add_argument('--destination', default=TOKENS_DIR, help='export folder')
+    parser.add_argument('--rubato-thresholds', default=None,
+                        help='rubato thresholds fitted by rubato.py (../data/rubato_thresholds.json), '
+                             'instead of the original ones')
+    parser.add_argument('--decode', type=int, default=None, help='print this conversation of the export instead')
+    args = parser.parse_args()
+
+    if args.decode is not None:
+        tokens, offsets, names, vocab = load_tokens(args.destination)
+        print(names[args.decode] + ': ' + ' '.join(decode(tokens[offsets[args.decode]:offsets[args.decode + 1]],
+                                                          vocab)))
+        return
+
+    thresholds = DEFAULT_THRESHOLDS if args.rubato_thresholds is None else load_thresholds(args.rubato_thresholds)
+    offsets = export_tokens(args.source, args.destination, thresholds)
+    print(f"{len(offsets) - 1} conversations, {offsets[-1]} tokens, vocabulary of {len(VOCABULARY)}")
+
+
+if __name__ == '__main__':
+    main()
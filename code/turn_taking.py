@@ -0,0 +1,204 @@
+"""
+Turn taking statistics: the gaps between successive codas of a recording, labelled by who spoke before and after.
+
+7-supplementary-extra computes response times three times over (all, same whale, other whale), each a loop over
+the rows comparing REC[:6] and parsing TsTo, and the tempo drift cell of 4-rubato scans up to 4 rows ahead of every
+coda for the next coda of the same whale. Here the codas are sorted once by (recording, TsTo), and the k-th next
+coda of every coda (k = 1 to window) is read off that order, giving a (codas, window) matrix of successors, -1
+past the end of the recording. Everything else is array operations on it:
+
+- transitions: every (coda, k-th successor) pair with its gap, lag k and whales, as flat arrays (k = 1: the
+  response times of 7-supplementary-extra; self transitions are the same whale speaking again)
+- gap_histograms: histogram of the gaps of all, self and other whale transitions
+- transition_matrix: number of transitions (or mean gap) from each whale to each whale, overall or per recording
+- first_match: the first successor satisfying a condition (e.g. same whale, within 6 s, as 4-rubato)
+
+Example:
+    successors = lookahead(columns['File'], columns['TsTo'], window=4)
+    pairs = transitions(columns['File'], columns['TsTo'], columns['Whale'], max_gap=MAX_RESPONSE)
+    counts, bins = gap_histograms(pairs)
+
+    python turn_taking.py                  # response times and whale to whale transitions
+    python turn_taking.py --window 4 --max-gap 30
+"""
+
+import argparse
+
+import numpy as np
+
+from coda_data import DIALOGUES_CSV, categorical_values, load_dialogues
+
+
+# Longest gap counted as a response (seconds, 7-supplementary-extra), and the bins of its histograms
+MAX_RESPONSE = 30
+RESPONSE_BINS = np.arange(-0.1, 20, 0.1)
+
+# Look-ahead of the tempo drift of 4-rubato: next coda of the same whale within 4 codas and 6 s, with less than 3
+# clicks of difference
+DRIFT_WINDOW = 4
+DRIFT_MAX_GAP = 6
+DRIFT_MAX_CLICK_DIFFERENCE = 3
+
+
+def lookahead(file_codes, t, window=1):
+    """
+    The 1st to window-th next coda of every coda in its recording, in order of t, as an (n, window) int64 matrix of
+    coda ids: successors[i, k - 1] is the k-th coda after coda i, -1 past the end of the recording.
+    Ties in t keep their row order.
+    """
+    file_codes = np.asarray(file_codes)
+    t = np.asarray(t, dtype=np.float64)
+    n = len(t)
+    order = np.lexsort((t, file_codes))
+    position = np.empty(n, dtype=np.int64)
+    position[order] = np.arange(n)
+
+    successors = np.full((n, window), -1, dtype=np.int64)
+    for k in range(1, window + 1):
+        ahead = position + k
+        j = order[np.minimum(ahead, n - 1)]
+        same_file = (ahead < n) & (file_codes[j] == file_codes)
+        successors[:, k - 1] = np.where(same_file, j, -1)
+    return successors
+
+
+def transitions(file_codes, t, whale_id, window=1, max_gap=np.inf, successors=None):
+    """
+    Every pair (coda, its k-th successor) for k = 1 to window with a gap below max_gap, as a dict of flat arrays:
+    first, second (coda ids), lag (k), gap (seconds), from_whale, to_whale and self (same whale).
+    """
+    t = np.asarray(t, dtype=np.float64)
+    whale_id = np.asarray(whale_id)
+    if successors is None:
+        successors = lookahead(file_codes, t, window)
+    first, column = np.nonzero(successors >= 0)
+    second = successors[first, column]
+    gap = t[second] - t[first]
+    keep = gap < max_gap
+    first, second, gap = first[keep], second[keep], gap[keep]
+    return {
+        'first': first,
+        'second': second,
+        'lag': column[keep] + 1,
+        'gap': gap,
+        'from_whale': whale_id[first],
+        'to_whale': whale_id[second],
+        'self': whale_id[first] == whale_id[second],
+    }
+
+
+def gap_histograms(pairs, bins=RESPONSE_BINS, lag=1):
+    """
+    Histograms of the gaps of the pairs of the given lag: {'all', 'self', 'other': counts}, and the bin edges.
+    Gaps beyond the last bin (19.9 s for RESPONSE_BINS) are not counted, as in plt.hist of 7-supplementary-extra.
+
+    With transitions(..., max_gap=MAX_RESPONSE) these are the histograms of the three response time loops of
+    7-supplementary-extra. Their range(2, ...) starts at the first pair of codas because my_data holds the csv
+    header in row 0 (genfromtxt); the same loop over the data rows alone would skip the first pair, one count less
+    in 'all' and 'self'.
+    """
+    of_lag = pairs['lag'] == lag
+    gaps = pairs['gap'][of_lag]
+    same = pairs['self'][of_lag]
+    histograms = {
+        'all': np.histogram(gaps, bins)[0],
+        'self': np.histogram(gaps[same], bins)[0],
+        'other': np.histogram(gaps[~same], bins)[0],
+    }
+    return histograms, bins
+
+
+def transition_matrix(pairs, num_whales=None, file_codes=None, statistic='count', lag=1):
+    """
+    (whales, whales) matrix of the transitions of the given lag from whale a (row) to whale b (column), counted or
+    with their mean gap (statistic='mean_gap', NaN where there is none). With the file code of every coda, one
+    matrix per recording, as a (files, whales, whales) array. Whale numbers index the matrix directly.
+    """
+    of_lag = pairs['lag'] == lag
+    a, b = pairs['from_whale'][of_lag], pairs['to_whale'][of_lag]
+    num_whales = int(max(a.max(initial=0), b.max(initial=0))) + 1 if num_whales is None else num_whales
+    cell = a * num_whales + b
+    shape = (num_whales, num_whales)
+    if file_codes is not None:
+        files = np.asarray(file_codes)[pairs['first'][of_lag]]
+        num_files = int(np.max(file_codes)) + 1
+        cell = files * num_whales ** 2 + cell
+        shape = (num_files, num_whales, num_whales)
+
+    size = int(np.prod(shape))
+    counts = np.bincount(cell, minlength=size)
+    if statistic == 'count':
+        return counts.reshape(shape)
+    sums = np.bincount(cell, weights=pairs['gap'][of_lag], minlength=size)
+    with np.errstate(invalid='ignore'):
+        return (sums / counts).reshape(shape)
+
+
+def first_match(successors, match):
+    """
+    The first successor of every coda for which match (a boolean matrix shaped as successors) holds, -1 if none.
+    """
+    match = match & (successors >= 0)
+    column = np.argmax(match, axis=1)
+    rows = np.arange(len(successors))
+    return np.where(match[rows, column], successors[rows, column], -1)
+
+
+def drift_pairs(columns, extra_click, window=DRIFT_WINDOW, max_gap=DRIFT_MAX_GAP,
+                max_click_difference=DRIFT_MAX_CLICK_DIFFERENCE):
+    """
+    The codas of the tempo drift of 4-rubato and the next coda of the same whale they are compared to (within window
+    codas and max_gap seconds, with less than max_click_difference clicks of difference), -1 if none, and the
+    durations of both without the ornament click, as (next_ids, durations).
+    """
+    t = np.asarray(columns['TsTo'])
+    n_clicks = np.asarray(columns['nClicks'])
+    whale_id = np.asarray(columns['Whale'])
+    successors = lookahead(columns['File'], t, window)
+    j = np.maximum(successors, 0)
+    match = (whale_id[j] == whale_id[:, None]) & (t[j] - t[:, None] < max_gap) & \
+            (np.abs(n_clicks[j] - n_clicks[:, None]) < max_click_difference)
+    next_ids = first_match(successors, match)
+
+    # the last ICI of an ornamented coda is the ornament (as rubato.durations_without_ornament; the cell of 4-rubato
+    # reads column nClicks + 2, the padding after the last ICI, so subtracts nothing)
+    rows = np.arange(len(t))
+    last_ici = np.asarray(columns['ICI'], dtype=np.float64)[rows, np.maximum(n_clicks - 2, 0)]
+    durations = np.asarray(columns['Duration']) - np.where(np.asarray(extra_click) > 0, last_ici, 0)
+    return next_ids, durations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--source', default=DIALOGUES_CSV, help='coda csv (sperm-whale-dialogues.csv format)')
+    parser.add_argument('--window', type=int, default=1, help='look this many codas ahead')
+    parser.add_argument('--max-gap', type=float, default=MAX_RESPONSE)
+    parser.add_argument('--output', default=None, help='save the transitions and histograms to this .npz file')
+    args = parser.parse_args()
+
+    columns = load_dialogues(args.source)
+    pairs = transitions(columns['File'], columns['TsTo'], columns['Whale'], args.window, args.max_gap)
+    for lag in range(1, args.window + 1):
+        of_lag = pairs['lag'] == lag
+        print(f"{lag} coda(s) ahead: {of_lag.sum()} transitions below {args.max_gap} s")
+        for name, keep in [('all', of_lag), ('self', of_lag & pairs['self']), ('other', of_lag & ~pairs['self'])]:
+            gaps = pairs['gap'][keep]
+            if len(gaps):
+                print(f"  {name:<6} {len(gaps):>6}  median {np.median(gaps):6.2f} s  "
+                      f"quartiles {np.percentile(gaps, 25):6.2f} {np.percentile(gaps, 75):6.2f} s")
+
+    matrix = transition_matrix(pairs)
+    whales = np.flatnonzero(matrix.sum(axis=0) + matrix.sum(axis=1))
+    print("Transitions from whale (rows) to whale (columns), next coda:")
+    print('      ' + ''.join(f"{w:>7}" for w in whales))
+    for a in whales:
+        print(f"{a:>6}" + ''.join(f"{matrix[a, b]:>7}" for b in whales))
+
+    if args.output is not None:
+        histograms, bins = gap_histograms(pairs)
+        np.savez(args.output, bins=bins, **pairs, **{f'histogram_{k}': v for k, v in histograms.items()},
+                 files=categorical_values(columns, 'File')[pairs['first']])
+
+
+if __name__ == '__main__':
+    main()
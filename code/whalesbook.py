@@ -0,0 +1,287 @@
+"""
+The whalesbook: exchange plots of every recording, 4 panels of 3 minutes per page (see 1-exchange-plot).
+
+Each panel shows the codas of one audio file against time: a tick per click at the bottom, a dot per click at
+(time, position in the coda), and lines linking each coda to the next one of the same whale when they are alike
+(similar number of clicks and duration, less than max_diff seconds apart).
+
+1-exchange-plot draws all of this with one ax.plot call per click and per link inside nested python loops, and
+saves every page as a vector pdf. Here the layout of the whole book (which panel each coda falls on) is worked out
+first, then each page is drawn with one LineCollection for the ticks, one scatter for the dots and one
+LineCollection for the links per panel, and the pages are rendered in parallel worker processes. Pages can be
+rasterized (--rasterize, or --format png) to keep the files small, and a manifest of the hash of each page's codas
+lets later runs skip the pages that did not change:
+
+    python whalesbook.py                        # ../whalesbook_rendered/page_*.pdf, as in 1-exchange-plot
+    python whalesbook.py --format png --dpi 20  # quick look at new recordings
+"""
+
+import argparse
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection
+import numpy as np
+
+from click_times import click_times_from_icis
+from coda_data import DATA_DIR, DIALOGUES_CSV, RECORDING_NAME_LENGTH, load_dialogues, prefix_categorical
+from coda_index import same_whale_neighbours
+
+
+# Not ../whalesbook, which holds the pages of the published book
+WHALESBOOK_DIR = os.path.join(DATA_DIR, '..', 'whalesbook_rendered')
+MANIFEST = 'manifest.json'
+
+# Number of characters of REC naming the audio file of a panel, e.g. sw061b001_124 -> sw061b001
+AUDIO_FILE_NAME_LENGTH = 9
+
+# CODA grouping parameters:
+max_diff = 15 # Max time difference otherwise disconnect
+max_click_diff = 2 # Max  difference in the number of clicks, otherwise disconnect
+max_duration_diff = 0.2 # Max difference in the duration (time of the last common click), otherwise disconnect
+# visualization parameters:
+duration_page = 60*3 # seconds for the horizontal axis
+average_ICI = 0.2
+duration_coda = 8*average_ICI # seconds for the vertical axis
+left_margin_per_subplot = .1 # number of seconds
+colour_chart = ['r','orange','steelblue','seagreen','y','m','c','#A2142F','#4DBEEE','#7E2F8E','#77AC30','#D95319','#0072BD']
+number_of_subplots_per_page = 4
+
+
+def layout(columns):
+    """
+    Place every coda of the catalog on a panel, as 1-exchange-plot does. Codas are grouped by audio file (REC[:9],
+    in order of first appearance) and sorted by time within each file. Times are counted from the first coda of the
+    recording (REC[:6]). A new panel starts with every audio file and whenever a coda starts more than duration_page
+    seconds after the start of the current panel.
+
+    Returns the codas in plotting order ('whale', 'time', 'click_times', 'n_clicks', 'panel' and 'next', the
+    position of the next coda of the same whale in the same audio file or -1) and the panels ('panel_origin',
+    the time at the left edge of each panel, and 'panel_title').
+    """
+    audio_files, audio_file_names = prefix_categorical(columns, 'REC', AUDIO_FILE_NAME_LENGTH)
+    whale = np.asarray(columns['Whale'])
+    ts_to = np.asarray(columns['TsTo'])
+    click_times, n_clicks = click_times_from_icis(columns['ICI'])
+
+    # audio files in order of first appearance in the csv, codas sorted by time within each
+    _, first_row = np.unique(audio_files, return_index=True)
+    rank = np.empty(len(first_row), dtype=np.int64)
+    rank[np.argsort(first_row)] = np.arange(len(first_row))
+    order = np.lexsort((ts_to, rank[audio_files]))
+    audio_files = audio_files[order]
+
+    # time origin: start of the first coda of the recording's first audio file
+    recording_names = audio_file_names.astype(f'U{RECORDING_NAME_LENGTH}')[audio_files]
+    new_file = np.r_[True, audio_files[1:] != audio_files[:-1]]
+    new_recording = new_file & np.r_[True, recording_names[1:] != recording_names[:-1]]
+    time_origin = ts_to[order][new_recording][np.cumsum(new_recording) - 1]
+    time = ts_to[order] - time_origin
+
+    panel = np.empty(len(order), dtype=np.int64)
+    panel_origin = []
+    panel_title = []
+    for i in range(len(order)):
+        if new_file[i] or time[i] - panel_origin[-1] > duration_page:
+            panel_origin.append(time[i] - left_margin_per_subplot)
+            panel_title.append(audio_file_names[audio_files[i]])
+        panel[i] = len(panel_origin) - 1
+
+    next_ids, _ = same_whale_neighbours(audio_files, whale[order])
+    return {
+        'whale': whale[order],
+        'time': time,
+        'click_times': click_times[order],
+        'n_clicks': n_clicks[order],
+        'panel': panel,
+        'next': next_ids,
+        'panel_origin': np.array(panel_origin),
+        'panel_title': np.array(panel_title),
+    }
+
+
+def links(book, codas):
+    """
+    The link segments from each of the given codas (positions in the book) to the next coda of the same whale,
+    when they are alike: at most max_click_diff clicks apart in length, starting less than max_diff seconds apart,
+    with their last common click less than max_duration_diff seconds apart. Each link joins the clicks of the two
+    codas one by one, from the second click to the last common one.
+    Returns (coda, next coda, click) index arrays, one entry per segment.
+    """
+    nex = book['next'][codas]
+    codas, nex = codas[nex >= 0], nex[nex >= 0]
+    n_clicks = book['n_clicks']
+    common = np.minimum(n_clicks[codas], n_clicks[nex]) - 1
+    click_times = book['click_times']
+    alike = (np.abs(n_clicks[codas] - n_clicks[nex]) <= max_click_diff) & \
+            (book['time'][nex] - book['time'][codas] < max_diff) & \
+            (np.abs(click_times[nex, common] - click_times[codas, common]) < max_duration_diff)
+    codas, nex, common = codas[alike], nex[alike], common[alike]
+
+    clicks = np.arange(1, click_times.shape[1])
+    use = clicks[None, :] <= common[:, None]
+    rows, cols = np.nonzero(use)
+    return codas[rows], nex[rows], clicks[cols]
+
+
+def page_contents(book, page):
+    """
+    Everything drawn on a page, as plain arrays (small enough to send to a worker process and to hash).
+    """
+    first_panel = page * number_of_subplots_per_page
+    panels = np.arange(first_panel, min(first_panel + number_of_subplots_per_page, len(book['panel_origin'])))
+    codas = np.flatnonzero((book['panel'] >= panels[0]) & (book['panel'] <= panels[-1]))
+    origin = book['panel_origin'][book['panel'][codas]]
+
+    # one entry per click of the page
+    coda_of_click, click = np.nonzero(np.arange(book['click_times'].shape[1])[None, :] < book['n_clicks'][codas, None])
+    click_y = book['click_times'][codas[coda_of_click], click]
+    click_x = book['time'][codas[coda_of_click]] + click_y - origin[coda_of_click]
+
+    # one entry per link segment, drawn on the panel of the coda it starts from
+    start, end, link_click = links(book, codas)
+    start_origin = book['panel_origin'][book['panel'][start]]
+    link_y0 = book['click_times'][start, link_click]
+    link_y1 = book['click_times'][end, link_click]
+
+    return {
+        'panel_origin': book['panel_origin'][panels],
+        'panel_title': book['panel_title'][panels],
+        'click_slot': book['panel'][codas[coda_of_click]] - first_panel,
+        'click_x': click_x,
+        'click_y': click_y,
+        'click_whale': book['whale'][codas[coda_of_click]],
+        'link_slot': book['panel'][start] - first_panel,
+        'link_x0': book['time'][start] + link_y0 - start_origin,
+        'link_x1': book['time'][end] + link_y1 - start_origin,
+        'link_y0': link_y0,
+        'link_y1': link_y1,
+        'link_whale': book['whale'][start],
+    }
+
+
+def page_hash(contents, options):
+    h = hashlib.sha1()
+    h.update(repr(sorted(options.items())).encode())
+    for name in sorted(contents):
+        h.update(name.encode())
+        h.update(np.ascontiguousarray(contents[name]).tobytes())
+    return h.hexdigest()[:16]
+
+
+def draw_panel(ax, origin, title):
+    """
+    The axes of a panel, as in 1-exchange-plot.
+    """
+    ax.set_frame_on(False)
+    ax.set_ylim(-.23,duration_coda+average_ICI/2)
+    ax.set_xlim(0,duration_page)
+    ax.set_yticks(np.arange(0, duration_coda, step=average_ICI))
+    ax.set_yticklabels(np.round(np.arange(0, duration_coda, step=average_ICI),1))
+    ax.set_xticks(np.arange(0, duration_page+1, step=60)) # horizontal axis, units are minutes
+    ax.set_xticklabels(((np.arange(0, duration_page+1, step=60)+origin)/60).astype(int))
+    ax.hlines(np.arange(0, duration_coda, step=average_ICI), 0, duration_page, colors='silver', linewidth=1)
+    ax.vlines(np.arange(0, duration_page+1, step=5), -.3, -0.2, colors='k', linestyles='solid')
+    ax.hlines([-0.2, -0.1], 0, duration_page, linewidth=10)
+    ax.set_title(title,  {'fontsize':64})
+    ax.tick_params(axis="x", labelsize=64)
+    ax.tick_params(axis="y", labelsize=64)
+
+
+def render_page(contents, path, dpi=None, rasterize=False):
+    """
+    Draw a page (page_contents) and save it to path, in the format given by its extension.
+    """
+    colours = np.array(colour_chart)
+    fig, ax = plt.subplots(number_of_subplots_per_page, 1, figsize=(100,25*number_of_subplots_per_page))
+    for slot in range(number_of_subplots_per_page):
+        if slot >= len(contents['panel_origin']):
+            ax[slot].set_axis_off()
+            continue
+        draw_panel(ax[slot], contents['panel_origin'][slot], contents['panel_title'][slot])
+
+        on_panel = contents['click_slot'] == slot
+        x = contents['click_x'][on_panel]
+        y = contents['click_y'][on_panel]
+        c = colours[contents['click_whale'][on_panel] % len(colours)]
+        # a tick for each click at the bottom, and a dot for each click
+        ticks = np.stack([np.stack([x, np.full_like(x, -0.2)], axis=1), np.stack([x, np.full_like(x, -0.1)], axis=1)],
+                         axis=1)
+        ax[slot].add_collection(LineCollection(ticks, colors=c, rasterized=rasterize))
+        ax[slot].scatter(x, y, 500, marker='o', c=c, rasterized=rasterize)
+
+        on_panel = contents['link_slot'] == slot
+        segments = np.stack([
+            np.stack([contents['link_x0'][on_panel], contents['link_y0'][on_panel]], axis=1),
+            np.stack([contents['link_x1'][on_panel], contents['link_y1'][on_panel]], axis=1)], axis=1)
+        ax[slot].add_collection(LineCollection(
+            segments, linewidths=15, colors=colours[contents['link_whale'][on_panel] % len(colours)],
+            rasterized=rasterize))
+
+    fig.savefig(path, dpi=dpi)
+    plt.close(fig)
+    return path
+
+
+def render_book(book, folder=WHALESBOOK_DIR, file_format='pdf', dpi=None, rasterize=False, workers=1, force=False):
+    """
+    Render every page of the book to folder/page_<n>.<file_format>, skipping the pages whose contents did not change
+    since the last run (unless force). Returns the paths of the pages rendered.
+    """
+    os.makedirs(folder, exist_ok=True)
+    manifest_path = os.path.join(folder, MANIFEST)
+    previous = {}
+    if os.path.exists(manifest_path) and not force:
+        with open(manifest_path) as f:
+            previous = json.load(f)['pages']
+
+    options = {'format': file_format, 'dpi': dpi, 'rasterize': rasterize}
+    num_pages = -(-len(book['panel_origin']) // number_of_subplots_per_page)
+    pages = {}
+    jobs = []
+    for page in range(num_pages):
+        contents = page_contents(book, page)
+        name = f'page_{page}.{file_format}'
+        pages[name] = page_hash(contents, options)
+        if previous.get(name) != pages[name] or not os.path.exists(os.path.join(folder, name)):
+            jobs.append((contents, os.path.join(folder, name)))
+
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            rendered = list(pool.map(render_page, *zip(*jobs), [dpi] * len(jobs), [rasterize] * len(jobs)))
+    else:
+        rendered = [render_page(contents, path, dpi, rasterize) for contents, path in jobs]
+
+    # pages of an earlier, longer book
+    for name in previous:
+        if name not in pages and os.path.exists(os.path.join(folder, name)):
+            os.remove(os.path.join(folder, name))
+    with open(manifest_path, 'w') as f:
+        json.dump({'pages': pages}, f, indent=1)
+    return rendered
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--source', default=DIALOGUES_CSV, help='coda csv (sperm-whale-dialogues.csv format)')
+    parser.add_argument('--destination', default=WHALESBOOK_DIR, help='folder of the pages')
+    parser.add_argument('--format', choices=['pdf', 'png'], default='pdf')
+    parser.add_argument('--dpi', type=int, default=None, help='resolution of png pages and rasterized pdf content')
+    parser.add_argument('--rasterize', action='store_true', help='rasterize the clicks and links of pdf pages')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('--force', action='store_true', help='render every page, even unchanged ones')
+    args = parser.parse_args()
+
+    book = layout(load_dialogues(args.source))
+    rendered = render_book(book, args.destination, args.format, args.dpi, args.rasterize, args.workers, args.force)
+    num_pages = -(-len(book['panel_origin']) // number_of_subplots_per_page)
+    print(f"Rendered {len(rendered)} of {num_pages} pages to {args.destination}")
+
+
+if __name__ == '__main__':
+    main()
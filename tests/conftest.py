@@ -0,0 +1,6 @@
+import os
+import sys
+
+# the scripts import each other as flat modules, run from code/
+CODE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'code')
+sys.path.insert(0, CODE_DIR)
@@ -0,0 +1,48 @@
+"""
+The augmentation script must keep writing sperm-whale-dialogues_augmented.csv byte for byte, whole or in chunks.
+"""
+
+import filecmp
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from add_tempo_rubato_rhythm_ornament_to_datasets import ORNAMENTS_PICKLE, RHYTHMS_PICKLE, load_labels, write_csv, \
+    write_parquet
+from conftest import CODE_DIR
+from coda_data import DATA_DIR
+
+AUGMENTED_CSV = os.path.join(DATA_DIR, 'sperm-whale-dialogues_augmented.csv')
+
+
+def augment(destination, *args):
+    subprocess.run([sys.executable, 'add_tempo_rubato_rhythm_ornament_to_datasets.py', '--destination',
+                    str(destination), *args], cwd=CODE_DIR, check=True, capture_output=True)
+
+
+@pytest.mark.parametrize('args', [[], ['--chunksize', '500']])
+def test_same_as_committed_csv(tmp_path, args):
+    destination = tmp_path / 'augmented.csv'
+    augment(destination, *args)
+    assert filecmp.cmp(destination, AUGMENTED_CSV, shallow=False)
+
+
+
+def test_npy_labels_in_chunks(tmp_path):
+    # memory mapped labels, sliced per block
+    rhythms, ornaments = tmp_path / 'rhythms.npy', tmp_path / 'ornaments.npy'
+    np.save(rhythms, load_labels(RHYTHMS_PICKLE))
+    np.save(ornaments, load_labels(ORNAMENTS_PICKLE))
+    assert isinstance(load_labels(str(rhythms)), np.memmap)
+    destination = tmp_path / 'augmented.csv'
+    augment(destination, '--chunksize', '700', '--rhythms', str(rhythms), '--ornaments', str(ornaments))
+    assert filecmp.cmp(destination, AUGMENTED_CSV, shallow=False)
+
+
+@pytest.mark.parametrize('write', [write_csv, write_parquet])
+def test_no_blocks(tmp_path, write):
+    with pytest.raises(ValueError, match='No codas'):
+        write(iter([]), tmp_path / 'augmented')
@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+
+from click_times import MIN_ICI, click_times_from_icis, load_click_matrix
+from coda_data import DIALOGUES_CSV, DOMINICA_CSV, load_dominica
+
+
+def loop_click_times(icis):
+    # the click times of the dialogue script, row by row: stop at the first zero ICI, skip ICIs <= 0.0002
+    rows = []
+    for ici in icis:
+        temp = [0]
+        j = 0
+        while j < len(ici) and ici[j] != 0:
+            if ici[j] > MIN_ICI:
+                temp.append(np.sum(ici[:j + 1]))
+            j += 1
+        rows.append(temp)
+    return rows
+
+
+def test_click_times_from_icis_as_loop():
+    icis = pd.read_csv(DIALOGUES_CSV)[[f'ICI{k}' for k in range(1, 29)]].to_numpy(dtype=np.float64)
+    # and codas with annotation mistakes (tiny ICIs) and ICIs after a zero
+    icis = np.r_[icis, [[0.1, 0.0001, 0.2] + [0] * 25, [0.3, 0, 0.4] + [0] * 25, [0] * 28]]
+    click_times, n_clicks = click_times_from_icis(icis)
+    for row, expected in enumerate(loop_click_times(icis)):
+        assert n_clicks[row] == len(expected)
+        assert np.allclose(click_times[row, :n_clicks[row]], expected, rtol=0, atol=1e-12)
+        assert not click_times[row, n_clicks[row]:].any()
+
+
+def test_click_matrix_as_loop(tmp_path):
+    data = pd.read_csv(DOMINICA_CSV, encoding='utf-8-sig')
+    icis = data[[f'ICI{k}' for k in range(1, 10)]].to_numpy(dtype=np.float64)
+    clicks = load_click_matrix(DOMINICA_CSV, load_dominica, cache_dir=tmp_path)
+    for row, (ici, n) in enumerate(zip(icis, data['nClicks'].to_numpy())):
+        n = min(n, 10)
+        times = np.r_[0, np.cumsum(ici[:n - 1])]
+        assert clicks['n_clicks'][row] == n
+        assert np.allclose(clicks['click_times'][row, :n], times, rtol=1e-6)
+        assert clicks['click_mask'][row].sum() == n and not clicks['click_times'][row, n:].any()
+        assert np.isclose(clicks['duration'][row], times[-1], rtol=1e-6)
+        if times[-1] > 0:
+            assert np.allclose(clicks['positions'][row, :n], times / times[-1], rtol=1e-6)
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+
+from coda_data import DOMINICA_CSV
+from coda_index import same_whale_neighbours, successor_chain
+
+
+def loop_neighbours(days, whales):
+    # the next and previous coda of the same whale on the same day, row by row
+    next_ids = [-1] * len(days)
+    previous_ids = [-1] * len(days)
+    last = {}
+    for i, key in enumerate(zip(days, whales)):
+        if key in last:
+            previous_ids[i] = last[key]
+            next_ids[last[key]] = i
+        last[key] = i
+    return np.array(next_ids), np.array(previous_ids)
+
+
+def test_neighbours_as_loop():
+    data = pd.read_csv(DOMINICA_CSV, encoding='utf-8-sig')
+    days, whales = data['Date'].to_numpy(dtype=str), data['IDN'].to_numpy()
+    next_ids, previous_ids = same_whale_neighbours(days, whales)
+    expected_next, expected_previous = loop_neighbours(days, whales)
+    assert np.array_equal(next_ids, expected_next)
+    assert np.array_equal(previous_ids, expected_previous)
+
+    chains = successor_chain(next_ids, 3)
+    for i in range(len(days)):
+        j = i
+        for step in range(3):
+            j = expected_next[j] if j >= 0 else -1
+            assert chains[i, step] == j
+
+    backwards = successor_chain(previous_ids, 2)
+    assert np.array_equal(backwards[:, 0], expected_previous)
+    assert np.array_equal(backwards[:, 1], np.where(expected_previous >= 0, expected_previous[expected_previous], -1))
+
+
+def test_neighbours_in_time_order():
+    rng = np.random.default_rng(0)
+    days = rng.integers(0, 3, 200)
+    whales = rng.integers(0, 4, 200)
+    t = rng.permutation(200)
+    _, previous_ids = same_whale_neighbours(days, whales, t)
+    order = np.argsort(t)
+    _, expected = loop_neighbours(days[order], whales[order])
+    # back from positions in time order to row numbers
+    assert np.array_equal(previous_ids[order], np.where(expected >= 0, order[expected], -1))
@@ -0,0 +1,58 @@
+"""
+The dialogue script must keep writing whale_dialogues.txt byte for byte, with any number of workers.
+"""
+
+import filecmp
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import CODE_DIR
+from coda_data import DATA_DIR
+
+DIALOGUES_TXT = os.path.join(DATA_DIR, 'whale_dialogues.txt')
+
+
+@pytest.mark.parametrize('args', [['--workers', '1'], ['--workers', '2', '--chunksize', '500']])
+def test_same_as_committed_txt(tmp_path, args):
+    destination = tmp_path / 'whale_dialogues.txt'
+    subprocess.run([sys.executable, 'generate_whale_dialogue_txt_with_proper_timings.py', '--destination',
+                    str(destination), *args], cwd=CODE_DIR, check=True, capture_output=True)
+    assert filecmp.cmp(destination, DIALOGUES_TXT, shallow=False)
+
+
+def run_script(*args):
+    return subprocess.run([sys.executable, 'generate_whale_dialogue_txt_with_proper_timings.py', '--workers', '1',
+                           *map(str, args)], cwd=CODE_DIR, check=True, capture_output=True, text=True).stdout
+
+
+def test_incremental_rerenders_the_changed_recording(tmp_path):
+    source = tmp_path / 'augmented.csv'
+    fragments = tmp_path / 'fragments'
+    incremental = tmp_path / 'incremental.txt'
+    full = tmp_path / 'full.txt'
+    with open(os.path.join(DATA_DIR, 'sperm-whale-dialogues_augmented.csv')) as f:
+        lines = f.readlines()
+    source.write_text(''.join(lines))
+    stdout = run_script('--source', source, '--destination', incremental, '--incremental', '--fragments', fragments)
+    num_recordings = len(json.loads((fragments / 'manifest.json').read_text())['recordings'])
+    assert f"Re-rendered {num_recordings} of {num_recordings} recordings" in stdout
+    assert filecmp.cmp(incremental, DIALOGUES_TXT, shallow=False)
+    before = {r['file']: r['hash'] for r in json.loads((fragments / 'manifest.json').read_text())['recordings']}
+
+    # another word for one coda
+    fields = lines[1000].rstrip('\n').split(',')
+    fields[-1] = ('b' if fields[-1][0] != 'b' else 'c') + fields[-1][1:]
+    lines[1000] = ','.join(fields) + '\n'
+    source.write_text(''.join(lines))
+    stdout = run_script('--source', source, '--destination', incremental, '--incremental', '--fragments', fragments)
+    assert f"Re-rendered 1 of {num_recordings} recordings" in stdout
+    after = {r['file']: r['hash'] for r in json.loads((fragments / 'manifest.json').read_text())['recordings']}
+    assert [name for name in after if after[name] != before[name]] == [fields[lines[0].split(',').index('File')]]
+
+    run_script('--source', source, '--destination', full)
+    assert filecmp.cmp(incremental, full, shallow=False)
+    assert not filecmp.cmp(incremental, DIALOGUES_TXT, shallow=False)
@@ -0,0 +1,43 @@
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from information_capacity import coda_sequences, ngram_codes
+from tokens import CODA_STRINGS
+
+
+def loop_ngrams(symbols, sequence, n):
+    # the n-grams of each sequence, as tuples
+    ngrams = []
+    for i in range(len(symbols) - n + 1):
+        if sequence[i] == sequence[i + n - 1]:
+            ngrams.append(tuple(symbols[i:i + n]))
+    return ngrams
+
+
+@pytest.fixture(scope='module', params=['conversations', 'random'])
+def sequences(request):
+    if request.param == 'conversations':
+        symbols, sequence, _, _ = coda_sequences()
+        return symbols, sequence
+    rng = np.random.default_rng(0)
+    # few symbols, so that long n-grams repeat too
+    symbols = rng.choice([0, 5, len(CODA_STRINGS) - 1], 5000, p=[0.6, 0.3, 0.1])
+    return symbols, np.sort(rng.integers(0, 30, 5000))
+
+
+@pytest.mark.parametrize('n', range(1, 9))
+def test_ngram_counts_as_counter(sequences, n):
+    symbols, sequence = sequences
+    codes = ngram_codes(symbols, sequence, n)
+    ngrams = loop_ngrams(list(symbols), list(sequence), n)
+    assert len(codes) == len(ngrams)
+    # one code per distinct n-gram, and so the same counts
+    assert len(set(zip(codes.tolist(), ngrams))) == len(set(ngrams)) == len(set(codes.tolist()))
+    code_counts = Counter(codes.tolist())
+    assert {ngram: code_counts[code] for code, ngram in zip(codes.tolist(), ngrams)} == Counter(ngrams)
+
+
+def test_empty():
+    assert len(ngram_codes([1, 2], [0, 0], 3)) == 0
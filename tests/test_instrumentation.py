@@ -0,0 +1,58 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+import instrumentation
+from instrumentation import Profiler, profiled, stage, timed
+
+
+def work(n):
+    # a stage of n rows, and a stage timing the production of n items of 2 rows
+    with stage('compute', rows=n):
+        total = sum(range(n))
+    for item in timed([[0, 0]] * n, 'load'):
+        total += len(item)
+    return total
+
+
+def test_no_op_without_profiler():
+    assert instrumentation.ACTIVE is None
+    profiler = Profiler()
+    assert work(5) == 20
+    with pytest.raises(KeyError):
+        with stage('failing'):
+            raise KeyError
+    items = timed(iter([1, 2, 3]), 'load')
+    assert next(items) == 1 and list(items) == [2, 3]
+    assert profiler.stages == {} and instrumentation.ACTIVE is None
+
+
+def test_stages_of_active_profiler():
+    profiler = Profiler().start()
+    try:
+        work(3)
+        work(4)
+    finally:
+        profiler.stop()
+    assert instrumentation.ACTIVE is None
+    assert profiler.stages['compute']['calls'] == 2 and profiler.stages['compute']['rows'] == 7
+    # one call per item
+    assert profiler.stages['load']['calls'] == 7 and profiler.stages['load']['rows'] == 14
+
+
+def test_profiled_workers_merge():
+    sizes = [3, 4, 5, 6]
+    with ProcessPoolExecutor(max_workers=2) as pool:
+        results = list(pool.map(profiled, [work] * len(sizes), sizes))
+    assert [result for result, _ in results] == [work(n) for n in sizes]
+
+    profiler = Profiler()
+    for _, stages in results:
+        profiler.merge(stages)
+    compute = profiler.stages['compute']
+    assert compute['calls'] == 4 and compute['rows'] == sum(sizes)
+    assert profiler.stages['load']['calls'] == sum(sizes) and profiler.stages['load']['rows'] == 2 * sum(sizes)
+    for name in ['compute', 'load']:
+        assert profiler.stages[name]['seconds'] == pytest.approx(sum(s[name]['seconds'] for _, s in results))
+        assert profiler.stages[name]['peak_rss_mb'] == max(s[name]['peak_rss_mb'] for _, s in results)
+        assert profiler.stages[name]['allocated_blocks'] == sum(s[name]['allocated_blocks'] for _, s in results)
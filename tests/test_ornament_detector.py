@@ -0,0 +1,51 @@
+import filecmp
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from conftest import CODE_DIR
+from coda_data import DIALOGUES_CSV, load_dialogues
+from ornament_detector import (DEFAULT_THRESHOLD, THRESHOLD_GRID, catalog_features, detect_ornaments, fit_threshold,
+                               scores, stream_ornaments)
+
+
+@pytest.fixture
+def features():
+    rng = np.random.default_rng(0)
+    n = 400
+    ratio = np.round(rng.normal(0, 0.5, n), 2)     # on the grid, to test the boundaries
+    ratio[rng.random(n) < 0.1] = np.nan
+    return {'ratio': ratio, 'shorter_neighbour': rng.random(n) < 0.4}
+
+
+def test_scores_as_detection_per_threshold(features):
+    labels = (np.random.default_rng(1).random(len(features['ratio'])) < 0.2).astype(np.uint8)
+    true_positives, predicted, f1 = scores(features, labels)
+    for k, threshold in enumerate(THRESHOLD_GRID):
+        flags = detect_ornaments(features, threshold)
+        tp = np.sum((flags == 1) & (labels == 1))
+        assert (true_positives[k], predicted[k]) == (tp, flags.sum())
+        assert f1[k] == pytest.approx(2 * tp / (flags.sum() + labels.sum()))
+
+
+def test_fit_threshold_best_f1(features):
+    labels = detect_ornaments(features, 0.3)
+    # any threshold flagging the same codas is as good
+    assert np.array_equal(detect_ornaments(features, fit_threshold(features, labels)), labels)
+
+
+def test_stream_as_whole_catalog():
+    flags = detect_ornaments(catalog_features(load_dialogues()), DEFAULT_THRESHOLD)
+    for chunksize in [37, 1000]:
+        assert np.array_equal(stream_ornaments(DIALOGUES_CSV, DEFAULT_THRESHOLD, chunksize), flags)
+
+
+def test_augmentation_detected_ornaments_same_in_chunks(tmp_path):
+    for name, args in [('whole', []), ('chunks', ['--chunksize', '300'])]:
+        subprocess.run([sys.executable, 'add_tempo_rubato_rhythm_ornament_to_datasets.py', '--detect-ornaments',
+                        '--destination', str(tmp_path / f'{name}.csv'), *args],
+                       cwd=CODE_DIR, check=True, capture_output=True)
+    assert filecmp.cmp(tmp_path / 'whole.csv', tmp_path / 'chunks.csv', shallow=False)
+    assert filecmp.cmp(tmp_path / 'whole_ornaments.npy', tmp_path / 'chunks_ornaments.npy', shallow=False)
@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from overlaps import between_whales, first_overlapping, overlap_groups, overlapping_pairs
+
+
+@pytest.fixture
+def intervals():
+    rng = np.random.default_rng(0)
+    n = 300
+    group = rng.integers(0, 4, n)
+    # starts on a 0.1 s grid, so some codas start together or exactly at the end of another
+    start = rng.integers(0, 600, n) / 10
+    end = start + rng.integers(0, 20, n) / 10
+    return group, start, end
+
+
+def brute_force_pairs(group, start, end, open_end):
+    rank = np.lexsort((start, group))
+    position = np.empty(len(rank), dtype=int)
+    position[rank] = np.arange(len(rank))
+    pairs = set()
+    for i in range(len(start)):
+        for j in range(len(start)):
+            inside = start[j] < end[i] if open_end else start[j] <= end[i]
+            if group[i] == group[j] and position[i] < position[j] and start[i] <= start[j] and inside:
+                pairs.add((i, j))
+    return pairs
+
+
+@pytest.mark.parametrize('open_end', [False, True])
+def test_pairs_as_brute_force(intervals, open_end):
+    group, start, end = intervals
+    first, second = overlapping_pairs(group, start, end, open_end)
+    assert len(first) == len(set(zip(first, second)))
+    assert set(zip(first.tolist(), second.tolist())) == brute_force_pairs(group, start, end, open_end)
+
+
+def test_first_overlapping(intervals):
+    group, start, end = intervals
+    first, second = overlapping_pairs(group, start, end)
+    earliest = first_overlapping(first, second, len(start))
+    for i in range(len(start)):
+        partners = second[first == i]
+        assert earliest[i] == (partners[0] if len(partners) else -1)
+        if len(partners):
+            assert start[earliest[i]] == start[partners].min()
+
+
+def test_between_whales(intervals):
+    group, start, end = intervals
+    whale_id = np.random.default_rng(1).integers(1, 3, len(start))
+    first, second = between_whales(*overlapping_pairs(group, start, end), whale_id)
+    assert np.all(whale_id[first] != whale_id[second])
+
+
+def test_groups_are_chains_of_pairs(intervals):
+    group, start, end = intervals
+    ids = overlap_groups(group, start, end)
+    # union find over the overlapping pairs
+    parent = list(range(len(start)))
+
+    def root(i):
+        while parent[i] != i:
+            i = parent[i]
+        return i
+
+    for i, j in zip(*overlapping_pairs(group, start, end)):
+        parent[root(i)] = root(j)
+    roots = np.array([root(i) for i in range(len(start))])
+    for i in range(len(start)):
+        assert np.array_equal(ids == ids[i], roots == roots[i])
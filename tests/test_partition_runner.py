@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from click_times import load_click_matrix
+from coda_data import DOMINICA_CSV, load_dominica
+from coda_index import same_whale_neighbours
+from ornament_detector import detect_ornaments, ornament_features
+from partition_runner import NUM_TEMPOS, run
+from rhythm_types import CODA_TYPE_RHYTHMS, rhythm_types
+from rubato import durations_without_ornament, fit_thresholds, rubato_deltas
+from tempo_model import assign_tempos, fit_boundaries
+
+
+@pytest.fixture(scope='module')
+def table():
+    return run(workers=1)
+
+
+def test_same_with_workers(table):
+    pd.testing.assert_frame_equal(run(workers=3), table, check_exact=True)
+
+
+def test_partition_as_direct_call(table):
+    columns = load_dominica(DOMINICA_CSV)
+    clicks = load_click_matrix(DOMINICA_CSV, load_dominica)
+    row = table[(table['Clan'] == 'EC1') & (table['Unit'] == 'A')].iloc[0]
+    rows = np.flatnonzero((columns['Clan_categories'][columns['Clan']] == 'EC1') &
+                          (columns['Unit_categories'][columns['Unit']] == 'A'))
+    assert row['codas'] == len(rows)
+
+    boundaries = fit_boundaries(columns['Duration'][rows], num_tempos=NUM_TEMPOS)
+    assert [row[f'tempo_boundary_{k + 1}'] for k in range(NUM_TEMPOS - 1)] == list(boundaries)
+
+    counts = rhythm_types(columns, clicks, rows=rows)['rhythm_counts']
+    assert row['rhythms'] == len(counts)
+    assert row['top_rhythm_share'] == counts.max() / counts.sum()
+
+    # whales of the same day, unidentified codas never paired
+    idn = columns['IDN_categories'][columns['IDN'][rows]]
+    whales = np.where(idn == '0', -1 - np.arange(len(rows)), columns['IDN'][rows])
+    features = ornament_features(columns['ICI'][rows], columns['nClicks'][rows], columns['Date'][rows], whales,
+                                 np.arange(len(rows)), window=np.inf)
+    ornamented = detect_ornaments(features)
+    _, previous_ids = same_whale_neighbours(columns['Date'][rows], whales)
+    coda_types = columns['CodaType_categories'][columns['CodaType'][rows]]
+    rhythms = np.array([CODA_TYPE_RHYTHMS.get(t, -1) for t in coda_types])
+    previous_ids = np.where(rhythms >= 0, previous_ids, -1)
+    durations = durations_without_ornament(clicks['click_times'][rows], clicks['n_clicks'][rows], ornamented)
+    tempos = assign_tempos(columns['Duration'][rows])
+    deltas = rubato_deltas(previous_ids, np.zeros(len(rows)), durations, rhythms, tempos)
+    deltas = deltas[~np.isnan(deltas)]
+    assert row['rubato_pairs'] == len(deltas)
+    assert (row['rubato_q25'], row['rubato_q75']) == fit_thresholds(deltas)
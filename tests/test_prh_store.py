@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+from scipy.stats import spearmanr
+
+from prh_store import SensorStore, batch_spearman
+
+
+@pytest.fixture
+def data():
+    rng = np.random.default_rng(0)
+    x = rng.normal(size=80)
+    y = rng.normal(size=(80, 4, 3)) + 0.3 * x[:, None, None]
+    # ties, and NaNs in x and in single cells or runs of a column
+    y[:10, 1, 0] = np.round(y[:10, 1, 0])
+    x[3] = np.nan
+    y[:15, 3, :] = np.nan
+    y[40, 2, 1] = np.nan
+    return x, y
+
+
+def test_as_spearmanr_per_column(data):
+    x, y = data
+    coefficients, p_values = batch_spearman(x, y)
+    assert coefficients.shape == p_values.shape == y.shape[1:]
+    for w in range(y.shape[1]):
+        for c in range(y.shape[2]):
+            expected = spearmanr(x, y[:, w, c], nan_policy='omit')
+            assert coefficients[w, c] == pytest.approx(expected[0])
+            assert p_values[w, c] == pytest.approx(expected[1])
+
+
+def test_nan_in_one_column_leaves_the_others(data):
+    x, y = data
+    before, _ = batch_spearman(x, y)
+    y = y.copy()
+    y[0, 2, 1] = np.nan
+    after, _ = batch_spearman(x, y)
+    changed = np.zeros(before.shape, dtype=bool)
+    changed[2, 1] = True
+    assert np.array_equal(before[~changed], after[~changed])
+
+
+def test_missing_folder(tmp_path):
+    with pytest.raises(FileNotFoundError, match='PRH folder'):
+        SensorStore(str(tmp_path / 'missing'), str(tmp_path / 'cache'))
+
+
+def test_first_file_in_name_order(tmp_path):
+    for name in ['prh__061b_b.mat', 'prh__061b_a.mat', 'prh__063a.mat', 'notes.txt']:
+        (tmp_path / name).touch()
+    store = SensorStore(str(tmp_path), str(tmp_path / 'cache'))
+    assert sorted(store.paths) == ['sw061b', 'sw063a']
+    assert store.paths['sw061b'] == str(tmp_path / 'prh__061b_a.mat')
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from resampling import bucket_null, chunk_sizes, compute_quantile, permutation_null
+
+
+def notebook_compute_quantile(value, data):
+    # compute_quantile of 4-rubato and 5-ornament
+    sorted_data = sorted(data)
+    length = len(sorted_data)
+    position = 0
+    for i in range(length):
+        if sorted_data[i] >= value:
+            position = i
+            break
+        position = length
+    return (position + 1) / length
+
+
+def test_compute_quantile_as_notebook():
+    rng = np.random.default_rng(0)
+    data = rng.integers(0, 20, 500) / 4     # ties
+    for value in np.r_[data[:50], -1, 0, 2.5, 4.75, 5, 100]:
+        assert compute_quantile(value, data) == notebook_compute_quantile(value, data)
+
+
+@pytest.fixture
+def samples():
+    rng = np.random.default_rng(1)
+    keys = rng.choice(['a-1', 'b-2', 'c-1'], 300)
+    return rng.normal(size=40), rng.choice(keys[:100], 40), rng.normal(size=300), keys
+
+
+def test_bucket_null_same_with_workers(samples):
+    reference, reference_keys, pool_values, pool_keys = samples
+    # small chunks, so that the resamples are spread over several chunks and processes
+    max_bytes = 8 * 40 * 300
+    assert len(chunk_sizes(2000, 40, max_bytes)) == 7
+    null = bucket_null(reference, reference_keys, pool_values, pool_keys, 2000, seed=5, max_bytes=max_bytes)
+    assert null.shape == (2000,)
+    for workers in [2, 3]:
+        assert np.array_equal(bucket_null(reference, reference_keys, pool_values, pool_keys, 2000, seed=5,
+                                          workers=workers, max_bytes=max_bytes), null)
+    assert not np.array_equal(bucket_null(reference, reference_keys, pool_values, pool_keys, 2000, seed=6,
+                                          max_bytes=max_bytes), null)
+
+
+def test_permutation_null_same_with_workers(samples):
+    x, _, y, _ = samples
+    max_bytes = 8 * 340 * 100
+    null = permutation_null(x, y, 1000, seed=2, max_bytes=max_bytes)
+    assert np.array_equal(permutation_null(x, y, 1000, seed=2, workers=3, max_bytes=max_bytes), null)
+    # shuffled labels: the differences of the means are centered on 0
+    assert abs(null.mean()) < 0.1
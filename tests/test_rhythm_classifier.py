@@ -0,0 +1,44 @@
+from operator import itemgetter
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from coda_data import DIALOGUES_CSV
+from rhythm_classifier import classify, load_mean_codas
+
+
+def loop_classify(icis, n_clicks, mean_codas):
+    # return_relative and the min(enumerate(...)) over mean_codas of 5-ornament, coda by coda
+    cluster_ids, distances = [], []
+    for row, n in zip(icis, n_clicks):
+        coda = [np.sum(row[:t]) / np.sum(row[:n - 1]) for t in range(n)]
+        min_mse, corresponding_cluster = [], []
+        for j, coda_comp in enumerate(mean_codas):
+            if len(coda_comp) == len(coda):
+                min_mse.append(((np.array(coda) - coda_comp) ** 2).mean())
+                corresponding_cluster.append(j)
+        if min_mse:
+            idx, mse = min(enumerate(min_mse), key=itemgetter(1))
+            cluster_ids.append(corresponding_cluster[idx])
+            distances.append(mse)
+        else:
+            cluster_ids.append(-1)
+            distances.append(np.nan)
+    return np.array(cluster_ids), np.array(distances)
+
+
+@pytest.mark.parametrize('ornament', [0, 1])
+def test_classify_as_loop(ornament):
+    data = pd.read_csv(DIALOGUES_CSV)
+    icis = data[[f'ICI{k}' for k in range(1, 29)]].to_numpy(dtype=np.float64)
+    # with ornament, the last click is left out as for the ornamented codas of 5-ornament
+    n_clicks = data['nClicks'].to_numpy() - ornament
+    mean_codas = load_mean_codas()
+
+    cluster_ids, distances = classify(icis, n_clicks, mean_codas, chunk_size=1000)
+    with np.errstate(invalid='ignore'):
+        expected_ids, expected_distances = loop_classify(icis, n_clicks, mean_codas)
+    assert (cluster_ids >= 0).sum() > len(cluster_ids) / 2
+    assert np.array_equal(cluster_ids, expected_ids)
+    assert np.allclose(distances, expected_distances, equal_nan=True)
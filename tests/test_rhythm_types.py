@@ -0,0 +1,35 @@
+import pickle
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from conftest import CODE_DIR
+from rhythm_classifier import load_mean_codas
+from rhythm_types import load_rhythm_types, mean_codas_of
+
+
+def matches(means, mean_codas):
+    # for every mean coda of mean_codas.p, the means equal to it
+    return [[k for k, m in enumerate(means) if len(m) == len(coda) and np.allclose(m, coda, rtol=0, atol=1e-8)]
+            for coda in mean_codas]
+
+
+@pytest.mark.parametrize('mean_codas_types', [True, False])
+def test_mean_codas_types(tmp_path, mean_codas_types):
+    destination, pickled = tmp_path / 'rhythm_types.npz', tmp_path / 'mean_codas.p'
+    flags = ['--mean-codas-types'] if mean_codas_types else []
+    subprocess.run([sys.executable, 'rhythm_types.py', '--destination', str(destination), '--pickle', str(pickled),
+                    *flags], cwd=CODE_DIR, check=True, capture_output=True)
+    means = pickle.load(open(pickled, 'rb'))
+    assert len(means) == 18
+    assert all(np.array_equal(a, b) for a, b in zip(means, mean_codas_of(load_rhythm_types(destination))))
+
+    found = matches(means, load_mean_codas())
+    if mean_codas_types:
+        # the 18 means of mean_codas.p, each once (in another order)
+        assert sorted(k for ks in found for k in ks) == list(range(18))
+    else:
+        # pooling all the coda types of a rhythm moves the means of the rhythms of several coda types
+        assert sum(len(ks) for ks in found) < 18
@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+from coda_index import same_whale_neighbours
+from rubato import (DEFAULT_THRESHOLDS, MAX_GAP, QuantileSketch, categorize_rubato, durations_without_ornament,
+                    rubato_deltas)
+
+
+@pytest.fixture
+def book():
+    # codas of one recording in order of time: whale, start time, padded click times and word (rhythm letter,
+    # upper case if ornamented, and tempo digit)
+    rng = np.random.default_rng(0)
+    n = 400
+    whales = rng.integers(1, 4, n)
+    t_init = np.sort(rng.uniform(0, 600, n))
+    num_clicks = rng.integers(3, 8, n)
+    click_times = np.zeros((n, 40))
+    for i in range(n):
+        click_times[i, 1:num_clicks[i]] = np.cumsum(rng.uniform(0.05, 0.3, num_clicks[i] - 1))
+    rhythms = rng.choice(list('ab'), n)
+    ornamented = rng.random(n) < 0.2
+    words = np.array([(r.upper() if o else r) + str(rng.integers(1, 3)) for r, o in zip(rhythms, ornamented)])
+    return whales, t_init, click_times, num_clicks, words
+
+
+def loop_rubato(whales, t_init, click_times, num_clicks, words, thresholds):
+    # determine_rubato and categorize_rubato of the original dialogue script, coda by coda
+    strings = []
+    for i in range(len(whales)):
+        previous = i - 1
+        while previous >= 0 and whales[previous] != whales[i]:
+            previous -= 1
+        rubato_string = " "
+        if previous != -1 and t_init[i] - t_init[previous] <= MAX_GAP and \
+                words[i][0].lower() == words[previous][0].lower() and words[i][1] == words[previous][1]:
+            times = click_times[i, :num_clicks[i]]
+            times_previous = click_times[previous, :num_clicks[previous]]
+            duration = times[-2] if words[i][0].isupper() else times[-1]
+            duration_previous = times_previous[-2] if words[previous][0].isupper() else times_previous[-1]
+            delta = duration - duration_previous
+            if delta < thresholds[0]:
+                rubato_string = "\\"
+            elif delta < thresholds[1]:
+                rubato_string = "-"
+            else:
+                rubato_string = "/"
+        strings.append(rubato_string)
+    return strings
+
+
+@pytest.mark.parametrize('thresholds', [DEFAULT_THRESHOLDS, (-0.1, 0.05)])
+def test_rubato_as_loop(book, thresholds):
+    whales, t_init, click_times, num_clicks, words = book
+    _, previous_ids = same_whale_neighbours(np.zeros(len(whales), dtype=int), whales)
+    ornamented = np.array([w[0].isupper() for w in words])
+    durations = durations_without_ornament(click_times, num_clicks, ornamented)
+    deltas = rubato_deltas(previous_ids, t_init, durations, np.array([w[0].lower() for w in words]),
+                           np.array([w[1] for w in words]))
+    assert list(categorize_rubato(deltas, thresholds)) == \
+        loop_rubato(whales, t_init, click_times, num_clicks, words, thresholds)
+
+
+def test_sketch_as_percentile():
+    rng = np.random.default_rng(1)
+    values = rng.normal(0, 0.05, 20000)
+    sketch = QuantileSketch()
+    for chunk in np.array_split(values, 7):
+        sketch.merge(QuantileSketch().update(chunk))
+    expected = np.percentile(values, [25, 75])
+    assert np.allclose(sketch.thresholds(), expected, atol=2 * sketch.bin_width)
+    assert np.isclose(sketch.quantile(50), np.percentile(values, 50), atol=2 * sketch.bin_width)
+
+
+def test_empty_sketch():
+    with pytest.raises(ValueError):
+        QuantileSketch().quantile(25)
+    with pytest.raises(ValueError):
+        QuantileSketch().update([np.nan]).thresholds()
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from segmentation import block_bounds, block_breaks, block_ids
+
+
+def loop_blocks(file_codes, t, gap, whale_id=None):
+    """
+    Block of every coda, walking the codas one at a time in order of (file, whale, time).
+    """
+    whale_id = np.zeros(len(t), dtype=int) if whale_id is None else whale_id
+    rows = sorted(range(len(t)), key=lambda i: (file_codes[i], whale_id[i], t[i], i))
+    ids = [0] * len(t)
+    block = -1
+    previous = None
+    for i in rows:
+        if previous is None or (file_codes[i], whale_id[i]) != (file_codes[previous], whale_id[previous]) or \
+                t[i] - t[previous] >= gap:
+            block += 1
+        ids[i] = block
+        previous = i
+    return np.array(ids)
+
+
+@pytest.fixture
+def codas():
+    rng = np.random.default_rng(0)
+    n = 500
+    file_codes = rng.integers(0, 5, n)
+    whale_id = rng.integers(1, 4, n)
+    # gaps of whole seconds, so equal to the gap sometimes
+    t = rng.integers(0, 600, n).astype(np.float64)
+    return file_codes, t, whale_id
+
+
+@pytest.mark.parametrize('per_whale', [False, True])
+def test_blocks_as_loop(codas, per_whale):
+    file_codes, t, whale_id = codas
+    whale_id = whale_id if per_whale else None
+    gaps = [2, 8, 12]
+    ids = block_ids(file_codes, t, gaps, whale_id)
+    for k, gap in enumerate(gaps):
+        assert np.array_equal(ids[:, k], loop_blocks(file_codes, t, gap, whale_id))
+    assert np.array_equal(block_ids(file_codes, t, 8, whale_id), ids[:, 1])
+
+
+def test_bounds_cover_blocks(codas):
+    file_codes, t, whale_id = codas
+    order, bounds = block_bounds(file_codes, t, [8], whale_id)
+    ids = block_ids(file_codes, t, 8, whale_id)
+    starts, ends = bounds[0]
+    for k, (start, end) in enumerate(zip(starts, ends)):
+        assert np.all(ids[order[start:end]] == k)
+    assert ends[-1] == len(t)
+
+
+def test_no_codas():
+    empty = np.zeros(0)
+    order, breaks = block_breaks(empty, empty, [8, 12])
+    assert order.shape == (0,) and breaks.shape == (0, 2)
+    assert block_ids(empty, empty, 8).shape == (0,)
+    _, bounds = block_bounds(empty, empty, [8])
+    assert [len(a) for a in bounds[0]] == [0, 0]
@@ -0,0 +1,47 @@
+import asyncio
+import filecmp
+import os
+import subprocess
+import sys
+
+from conftest import CODE_DIR
+from coda_data import DATA_DIR, DIALOGUES_CSV
+from streaming_annotator import Feed
+
+DIALOGUES_TXT = os.path.join(DATA_DIR, 'whale_dialogues.txt')
+
+
+def test_replay_same_as_committed_txt(tmp_path):
+    destination = tmp_path / 'whale_dialogues.txt'
+    subprocess.run([sys.executable, 'streaming_annotator.py', '--replay', DIALOGUES_CSV, '--dialogue',
+                    str(destination), '--queue-size', '50'], cwd=CODE_DIR, check=True, capture_output=True)
+    assert filecmp.cmp(destination, DIALOGUES_TXT, shallow=False)
+
+
+def test_reader_waits_on_a_full_queue():
+    async def scenario():
+        feed = Feed(queue_size=3)
+
+        async def produce():
+            for k in range(10):
+                await feed.put({'number': k})
+
+        producer = asyncio.create_task(produce())
+        for _ in range(5):
+            await asyncio.sleep(0)
+        # nobody takes from the queue: the reader stops at the 4th coda
+        assert not producer.done()
+        assert feed.queue.qsize() == 3 and feed.counters['received'] == 3
+
+        await asyncio.sleep(0.05)
+        taken = []
+        while len(taken) < 10:
+            taken.append((await feed.queue.get())['number'])
+            assert feed.queue.qsize() <= 3
+        await producer
+        return feed, taken
+
+    feed, taken = asyncio.run(scenario())
+    assert taken == list(range(10))
+    assert feed.counters['received'] == 10 and feed.counters['queue_max'] == 3
+    assert feed.counters['blocked_seconds'] >= 0.05
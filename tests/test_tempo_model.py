@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+from coda_data import categorical_values, load_dominica
+from tempo_model import BANDWIDTH, DEFAULT_BOUNDARIES, binned_kde, density_minima, fit_boundaries
+
+
+def exact_kde(x, grid, bandwidth):
+    z = (grid[:, None] - x[None, :]) / bandwidth
+    return np.exp(-0.5 * z ** 2).sum(axis=1) / (len(x) * bandwidth * np.sqrt(2 * np.pi))
+
+
+@pytest.mark.parametrize('step, tolerance', [(0.001, 1e-3), (0.01, 3e-2)])
+def test_binned_kde_close_to_exact(step, tolerance):
+    rng = np.random.default_rng(0)
+    x = np.r_[rng.normal(0.4, 0.05, 300), rng.normal(1.0, 0.1, 200), 0.1001, 1.7499]
+    grid, density = binned_kde(x, step=step)
+    assert grid[0] == pytest.approx(0.1) and grid[-1] == pytest.approx(1.75)
+    exact = exact_kde(x, grid, BANDWIDTH)
+    assert np.max(np.abs(density - exact)) < tolerance * exact.max()
+
+
+def test_binned_kde_integrates_to_one():
+    # values well inside the range, so no mass falls outside the grid
+    x = np.random.default_rng(1).uniform(0.5, 1.2, 1000)
+    grid, density = binned_kde(x)
+    assert np.trapezoid(density, grid) == pytest.approx(1, abs=1e-3)
+
+
+def test_density_minima_ignore_round_off():
+    grid = np.arange(10.0)
+    density = np.array([5, 3, 4, 1e-16, 2e-16, 1e-16, 3e-16, 4, 2, 6])
+    assert list(density_minima(grid, density)) == [1, 8]
+
+
+def test_fit_boundaries_as_2_tempo():
+    columns = load_dominica()
+    ec1 = categorical_values(columns, 'Clan') == 'EC1'
+    assert fit_boundaries(columns['Duration'][ec1]) == DEFAULT_BOUNDARIES
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+from coda_data import iter_recordings
+from generate_whale_dialogue_txt_with_proper_timings import AUGMENTED_CSV, build_dialogue, parse_recording
+from rubato import DEFAULT_THRESHOLDS
+from tokens import (CODA_STRINGS, FIRST_CODA, MAX_WHALES, SPECIAL_TOKENS, VOCABULARY, coda_ids, decode, export_tokens,
+                    iter_batches, load_tokens)
+
+
+def test_vocabulary():
+    # special tokens, whales, and 4 rubatos (none, \ - /) times 18 rhythms, ornamented or not, and 5 tempos
+    assert len(VOCABULARY) == len(SPECIAL_TOKENS) + MAX_WHALES + 4 * 18 * 2 * 5 == 757
+    assert len(set(VOCABULARY)) == len(VOCABULARY)
+    assert decode(coda_ids(CODA_STRINGS)) == CODA_STRINGS.tolist()
+
+
+def test_round_trip(tmp_path):
+    offsets = export_tokens(folder=tmp_path)
+    tokens, loaded_offsets, names, vocabulary = load_tokens(tmp_path)
+    assert vocabulary == VOCABULARY
+    assert np.array_equal(loaded_offsets, offsets) and offsets[-1] == len(tokens)
+
+    recordings = list(iter_recordings(AUGMENTED_CSV))
+    assert names.tolist() == [recording['File'].iloc[0] for recording in recordings]
+    for c, recording in enumerate(recordings):
+        strings = decode(tokens[offsets[c]:offsets[c + 1]])
+        assert strings[0] == '<bos>' and strings[-1] == '<eos>'
+        # the whale and the text of every coda, in the order of the dialogue
+        whales = [int(s[len('<whale '):-1]) for s in strings if s.startswith('<whale ')]
+        texts = [s for s, i in zip(strings, tokens[offsets[c]:offsets[c + 1]]) if i >= FIRST_CODA]
+        book, words = parse_recording(recording)
+        dialogue = build_dialogue(names[c], book, words, DEFAULT_THRESHOLDS)['dialogue']
+        assert whales == [line['whale'] for line in dialogue]
+        assert texts == [line['text'] for line in dialogue]
+
+
+def loop_windows(tokens, offsets, window, stride, within_conversations):
+    if not within_conversations:
+        return [tokens[s:s + window + 1] for s in range(0, len(tokens) - window, stride)]
+    windows = []
+    for a, b in zip(offsets[:-1], offsets[1:]):
+        windows += [tokens[s:s + window + 1] for s in range(a, b - window, stride)]
+    return windows
+
+
+@pytest.mark.parametrize('within_conversations', [True, False])
+@pytest.mark.parametrize('stride', [1, 2])
+@pytest.mark.parametrize('seed', [None, 3])
+def test_batches_as_lists(within_conversations, stride, seed):
+    tokens = np.arange(100, 123).astype(np.uint16)
+    offsets = [0, 3, 10, 11, 23]
+    batches = list(iter_batches(tokens, np.array(offsets), 4, 3, stride, within_conversations, seed))
+    windows = loop_windows(tokens.tolist(), offsets, 4, stride, within_conversations)
+    assert all(len(inputs) == 3 for inputs, _ in batches[:-1])
+
+    inputs = [row.tolist() for batch, _ in batches for row in batch]
+    targets = [row.tolist() for _, batch in batches for row in batch]
+    got = [x + y[-1:] for x, y in zip(inputs, targets)]
+    assert all(x[1:] == y[:-1] for x, y in zip(inputs, targets))
+    if seed is None:
+        assert got == windows
+    else:
+        assert sorted(got) == sorted(windows) and got != windows
@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+
+from coda_data import DIALOGUES_CSV, load_dialogues
+from turn_taking import (MAX_RESPONSE, RESPONSE_BINS, first_match, gap_histograms, lookahead, transition_matrix,
+                         transitions)
+
+
+@pytest.fixture
+def codas():
+    rng = np.random.default_rng(0)
+    n = 300
+    file_codes = rng.integers(0, 4, n)
+    t = rng.integers(0, 200, n) / 4          # ties
+    whale_id = rng.integers(1, 4, n)
+    return file_codes, t, whale_id
+
+
+def loop_successors(file_codes, t, window):
+    rows = sorted(range(len(t)), key=lambda i: (file_codes[i], t[i], i))
+    successors = np.full((len(t), window), -1)
+    for position, i in enumerate(rows):
+        for k in range(1, window + 1):
+            if position + k < len(rows) and file_codes[rows[position + k]] == file_codes[i]:
+                successors[i, k - 1] = rows[position + k]
+    return successors
+
+
+def test_lookahead_as_loop(codas):
+    file_codes, t, _ = codas
+    assert np.array_equal(lookahead(file_codes, t, 4), loop_successors(file_codes, t, 4))
+
+
+def test_transitions(codas):
+    file_codes, t, whale_id = codas
+    pairs = transitions(file_codes, t, whale_id, window=3, max_gap=5)
+    expected = {(i, j, k + 1) for (i, k), j in np.ndenumerate(loop_successors(file_codes, t, 3))
+                if j >= 0 and t[j] - t[i] < 5}
+    assert set(zip(pairs['first'].tolist(), pairs['second'].tolist(), pairs['lag'].tolist())) == expected
+    assert np.array_equal(pairs['gap'], t[pairs['second']] - t[pairs['first']])
+    assert np.array_equal(pairs['self'], whale_id[pairs['first']] == whale_id[pairs['second']])
+
+
+def test_transition_matrix(codas):
+    file_codes, t, whale_id = codas
+    pairs = transitions(file_codes, t, whale_id)
+    counts = transition_matrix(pairs)
+    per_file = transition_matrix(pairs, num_whales=counts.shape[0], file_codes=file_codes)
+    mean_gap = transition_matrix(pairs, statistic='mean_gap')
+    assert np.array_equal(per_file.sum(axis=0), counts)
+    for a in range(1, 4):
+        for b in range(1, 4):
+            chosen = (pairs['from_whale'] == a) & (pairs['to_whale'] == b)
+            assert counts[a, b] == chosen.sum()
+            assert mean_gap[a, b] == pytest.approx(pairs['gap'][chosen].mean())
+
+
+def test_first_match(codas):
+    file_codes, t, whale_id = codas
+    successors = lookahead(file_codes, t, 4)
+    same_whale = whale_id[np.maximum(successors, 0)] == whale_id[:, None]
+    found = first_match(successors, same_whale)
+    for i in range(len(t)):
+        candidates = [j for j in successors[i] if j >= 0 and whale_id[j] == whale_id[i]]
+        assert found[i] == (candidates[0] if candidates else -1)
+
+
+def test_histograms_as_7_supplementary_extra():
+    # the loops of the notebook, over the csv rows (sorted by TsTo within each recording)
+    columns = load_dialogues(DIALOGUES_CSV)
+    names = columns['File_categories'][columns['File']]
+    t, whale = np.asarray(columns['TsTo']), np.asarray(columns['Whale'])
+    gaps = {'all': [], 'self': [], 'other': []}
+    for i in range(1, len(t)):
+        if names[i] == names[i - 1] and t[i] - t[i - 1] < MAX_RESPONSE:
+            gaps['all'].append(t[i] - t[i - 1])
+            gaps['self' if whale[i] == whale[i - 1] else 'other'].append(t[i] - t[i - 1])
+
+    histograms, bins = gap_histograms(transitions(columns['File'], t, whale, max_gap=MAX_RESPONSE))
+    for name, values in gaps.items():
+        assert np.array_equal(histograms[name], np.histogram(values, RESPONSE_BINS)[0])
@@ -0,0 +1,76 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from coda_data import DIALOGUES_CSV, load_dialogues
+from whalesbook import MANIFEST, duration_page, layout, left_margin_per_subplot, number_of_subplots_per_page, \
+    render_book
+
+
+@pytest.fixture
+def source(tmp_path):
+    # the first 300 codas: two audio files of one recording, 11 panels on 3 pages
+    path = tmp_path / 'codas.csv'
+    with open(DIALOGUES_CSV) as f:
+        path.write_text(''.join(f.readlines()[:301]))
+    return path
+
+
+def loop_layout(data):
+    # 1-exchange-plot: audio files in order of appearance, codas by time, a new panel per file and every 3 minutes
+    panels, placed = [], []
+    previous_recording = None
+    for audio_file in dict.fromkeys(data['REC'].str[:9]):
+        codas = data[data['REC'].str[:9] == audio_file].sort_values('TsTo', kind='stable')
+        if audio_file[:6] != previous_recording:
+            time_origin = codas['TsTo'].iloc[0]
+            previous_recording = audio_file[:6]
+        panel_origin = None
+        for t, whale in zip(codas['TsTo'] - time_origin, codas['Whale']):
+            if panel_origin is None or t - panel_origin > duration_page:
+                panel_origin = t - left_margin_per_subplot
+                panels.append((panel_origin, audio_file))
+            placed.append((whale, t, len(panels) - 1))
+    return panels, placed
+
+
+def test_layout_as_loop(source):
+    book = layout(load_dialogues(source, cache_dir=None))
+    panels, placed = loop_layout(pd.read_csv(source))
+    assert np.allclose(book['panel_origin'], [origin for origin, _ in panels])
+    assert book['panel_title'].tolist() == [title for _, title in panels]
+    assert book['whale'].tolist() == [whale for whale, _, _ in placed]
+    assert np.allclose(book['time'], [t for _, t, _ in placed])
+    assert book['panel'].tolist() == [panel for _, _, panel in placed]
+
+    # next coda of the same whale in the same audio file, in plotting order
+    titles = book['panel_title'][book['panel']]
+    whales = book['whale']
+    for i, j in enumerate(book['next']):
+        later = [k for k in range(i + 1, len(titles)) if titles[k] == titles[i] and whales[k] == whales[i]]
+        assert j == (later[0] if later else -1)
+
+
+def test_render_skips_unchanged_pages(source, tmp_path):
+    folder = tmp_path / 'pages'
+    book = layout(load_dialogues(source, cache_dir=None))
+    num_pages = -(-len(book['panel_origin']) // number_of_subplots_per_page)
+    rendered = render_book(book, folder, 'png', dpi=2)
+    assert [os.path.basename(p) for p in rendered] == [f'page_{k}.png' for k in range(num_pages)] and num_pages == 3
+    assert sorted(json.loads((folder / MANIFEST).read_text())['pages']) == sorted(f'page_{k}.png' for k in range(3))
+    assert render_book(book, folder, 'png', dpi=2) == []
+
+    # a longer click in the middle of page 1: only that page changes
+    data = pd.read_csv(source)
+    panels, placed = loop_layout(data)
+    on_page_1 = [k for k, (_, _, panel) in enumerate(placed) if panel == number_of_subplots_per_page + 1]
+    whale, t, _ = placed[on_page_1[len(on_page_1) // 2]]
+    row = np.flatnonzero(np.isclose(data['TsTo'] - data['TsTo'].iloc[0], t) & (data['Whale'] == whale))[0]
+    data.loc[row, 'ICI1'] += 0.05
+    data.to_csv(source, index=False)
+    book = layout(load_dialogues(source, cache_dir=None))
+    assert render_book(book, folder, 'png', dpi=2) == [os.path.join(folder, 'page_1.png')]
+    assert len(render_book(book, folder, 'png', dpi=2, force=True)) == 3